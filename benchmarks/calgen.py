@@ -0,0 +1,278 @@
+"""
+Deterministic generator of synthetic Google calendars
+
+Generated events look like Calendar API v3 `events().list(singleEvents=True)`
+items: instances of recurring series (including cancelled ones), all-day
+events and one-off meetings, some of them with large attendee lists. With
+`series=True` recurring series are generated as `singleEvents=False` items
+instead: the master event with rules, plus cancelled instances.
+"""
+
+import datetime
+import random
+from typing import Iterator
+
+from polycal.services.gcal import GoogleCalendarEvent
+
+WINDOW_START = datetime.datetime(2024, 1, 1)
+WINDOW_END = WINDOW_START + datetime.timedelta(days=90)
+
+TITLES = [
+    "Standup",
+    "1:1",
+    "Planning",
+    "Retro",
+    "Focus time",
+    "Lunch",
+    "Interview",
+    "Design review",
+    "All hands",
+    "Customer call",
+    "Sync: backend",
+    "Sync: frontend",
+    "[OOO] Dentist",
+    "Office hours",
+]
+ALL_DAY_TITLES = ["Vacation", "Conference", "Public holiday", "On call", "Offsite"]
+DURATIONS = [15, 25, 30, 45, 50, 60, 90, 120]
+EVENT_TYPES = ["default"] * 18 + ["focusTime", "outOfOffice"]
+RESPONSES = ["accepted"] * 7 + ["tentative", "needsAction", "declined"]
+
+
+def gdatetime(dt: datetime.datetime) -> dict[str, str]:
+    return {"dateTime": dt.isoformat() + "+00:00", "timeZone": "UTC"}
+
+
+def gdate(d: datetime.date) -> dict[str, str]:
+    return {"date": d.isoformat()}
+
+
+class CalendarGenerator:
+    """
+    Events of a single calendar owned by `calendar_id`
+
+    The same `seed` always generates the same events. Events are spread over
+    `[start, end)` and yielded roughly in order of creation, not start time.
+    """
+
+    def __init__(
+        self,
+        calendar_id: str,
+        seed: int = 0,
+        start: datetime.datetime = WINDOW_START,
+        end: datetime.datetime = WINDOW_END,
+        recurring_ratio: float = 0.5,
+        all_day_ratio: float = 0.05,
+        large_attendees_ratio: float = 0.01,
+        cancelled_ratio: float = 0.03,
+        series: bool = False,
+    ):
+        self.calendar_id = calendar_id
+        self.rng = random.Random(f"{calendar_id}:{seed}")
+        self.start = start
+        self.end = end
+        self.recurring_ratio = recurring_ratio
+        self.all_day_ratio = all_day_ratio
+        self.large_attendees_ratio = large_attendees_ratio
+        self.cancelled_ratio = cancelled_ratio
+        self.series = series
+        self.counter = 0
+
+    def generate(self, count: int) -> Iterator[GoogleCalendarEvent]:
+        """Events with `count` instances in total"""
+        generated = 0
+        while generated < count:
+            roll = self.rng.random()
+            if roll < self.recurring_ratio:
+                events = self.recurring_series(limit=count - generated)
+                generated += len(events)
+                if self.series and events:
+                    events = self.as_series(events)
+            elif roll < self.recurring_ratio + self.all_day_ratio:
+                events = [self.all_day_event()]
+                generated += 1
+            else:
+                events = [self.single_event()]
+                generated += 1
+            yield from events
+
+    def next_id(self) -> str:
+        self.counter += 1
+        return f"{self.rng.getrandbits(40):010x}{self.counter:06d}"
+
+    def random_start(self) -> datetime.datetime:
+        days = (self.end - self.start).days
+        day = self.start + datetime.timedelta(days=self.rng.randrange(days))
+        return day.replace(
+            hour=self.rng.randrange(7, 19), minute=self.rng.choice([0, 30])
+        )
+
+    def attendees(self) -> list[dict]:
+        if self.rng.random() < self.large_attendees_ratio:
+            count = self.rng.randrange(100, 300)
+        else:
+            count = self.rng.choice([0, 0, 1, 2, 3, 5, 8])
+        if not count:
+            return []
+        attendees = [
+            {
+                "email": f"person{self.rng.randrange(5000)}@example.com",
+                "responseStatus": self.rng.choice(RESPONSES),
+            }
+            for _ in range(count)
+        ]
+        attendees.append(
+            {
+                "email": self.calendar_id,
+                "self": True,
+                "responseStatus": self.rng.choice(RESPONSES),
+            }
+        )
+        return attendees
+
+    def base_event(self, event_id: str, title: str) -> GoogleCalendarEvent:
+        event = {
+            "kind": "calendar#event",
+            "etag": f'"{self.rng.getrandbits(48)}"',
+            "id": event_id,
+            "status": "confirmed",
+            "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+            "created": "2023-12-01T10:00:00.000Z",
+            "updated": "2023-12-01T10:00:00.000Z",
+            "summary": title,
+            "creator": {"email": self.calendar_id, "self": True},
+            "organizer": {"email": self.calendar_id, "self": True},
+            "iCalUID": f"{event_id}@google.com",
+            "sequence": 0,
+            "eventType": self.rng.choice(EVENT_TYPES),
+            "reminders": {"useDefault": True},
+        }
+        if self.rng.random() < 0.3:
+            event["location"] = f"Room {self.rng.randrange(1, 40)}"
+        if self.rng.random() < 0.2:
+            event["description"] = "Agenda:\n" + "\n".join(
+                f"- item {i}" for i in range(self.rng.randrange(1, 10))
+            )
+        if self.rng.random() < 0.1:
+            event["transparency"] = "transparent"
+        attendees = self.attendees()
+        if attendees:
+            event["attendees"] = attendees
+        return event
+
+    def single_event(self) -> GoogleCalendarEvent:
+        start = self.random_start()
+        end = start + datetime.timedelta(minutes=self.rng.choice(DURATIONS))
+        event = self.base_event(self.next_id(), self.rng.choice(TITLES))
+        event["start"] = gdatetime(start)
+        event["end"] = gdatetime(end)
+        return event
+
+    def all_day_event(self) -> GoogleCalendarEvent:
+        start = self.random_start().date()
+        end = start + datetime.timedelta(days=self.rng.choice([1, 1, 1, 2, 5]))
+        event = self.base_event(self.next_id(), self.rng.choice(ALL_DAY_TITLES))
+        event["eventType"] = "default"
+        event["start"] = gdate(start)
+        event["end"] = gdate(end)
+        event["transparency"] = "transparent"
+        return event
+
+    def recurring_series(self, limit: int) -> list[GoogleCalendarEvent]:
+        """Instances of a daily (on weekdays) or weekly series"""
+        series_id = self.next_id()
+        series = self.base_event(series_id, self.rng.choice(TITLES))
+        first = self.random_start() - datetime.timedelta(days=self.rng.randrange(30))
+        duration = datetime.timedelta(minutes=self.rng.choice(DURATIONS[:5]))
+        step = datetime.timedelta(days=self.rng.choice([1, 7, 7, 14]))
+        instances = []
+        instance_start = first
+        while instance_start < self.end and len(instances) < limit:
+            if instance_start >= self.start and instance_start.weekday() < 5:
+                instance_id = f"{series_id}_{instance_start:%Y%m%dT%H%M%SZ}"
+                instance = {
+                    **series,
+                    "id": instance_id,
+                    "recurringEventId": series_id,
+                    "originalStartTime": gdatetime(instance_start),
+                    "start": gdatetime(instance_start),
+                    "end": gdatetime(instance_start + duration),
+                }
+                if self.rng.random() < self.cancelled_ratio:
+                    instance["status"] = "cancelled"
+                instances.append(instance)
+            instance_start += step
+        return instances
+
+    @staticmethod
+    def as_series(instances: list[GoogleCalendarEvent]) -> list[GoogleCalendarEvent]:
+        """Master of the series `instances` belong to, and its cancelled instances"""
+        first, last = instances[0], instances[-1]
+        start = datetime.datetime.fromisoformat(first["start"]["dateTime"])
+        step = (
+            datetime.datetime.fromisoformat(instances[1]["start"]["dateTime"]) - start
+            if len(instances) > 1
+            else datetime.timedelta(days=7)
+        )
+        if step.days < 7:
+            rule = "FREQ=DAILY;BYDAY=MO,TU,WE,TH,FR"
+        else:
+            rule = f"FREQ=WEEKLY;INTERVAL={step.days // 7}"
+        until = datetime.datetime.fromisoformat(last["start"]["dateTime"])
+        master = {
+            key: value
+            for key, value in first.items()
+            if key not in ("recurringEventId", "originalStartTime")
+        }
+        master["id"] = first["recurringEventId"]
+        master["status"] = "confirmed"
+        master["recurrence"] = [f"RRULE:{rule};UNTIL={until:%Y%m%dT%H%M%SZ}"]
+        return [master] + [
+            {
+                "kind": "calendar#event",
+                "etag": instance["etag"],
+                "id": instance["id"],
+                "status": "cancelled",
+                "recurringEventId": instance["recurringEventId"],
+                "originalStartTime": instance["originalStartTime"],
+            }
+            for instance in instances
+            if instance["status"] == "cancelled"
+        ]
+
+
+def generate_calendars(
+    calendar_ids: list[str],
+    count: int,
+    seed: int = 0,
+    series: bool = False,
+    shared: float = 0.0,
+) -> dict[str, list[GoogleCalendarEvent]]:
+    """
+    `count` event instances spread evenly over calendars
+
+    :param shared: fraction of timed events of the first calendar also added to
+        each of the others, as the same meeting (`iCalUID`) under another id;
+        only one-off meetings with `series`
+    """
+    calendars = {}
+    for i, calendar_id in enumerate(calendar_ids):
+        share = count // len(calendar_ids) + (i < count % len(calendar_ids))
+        calendars[calendar_id] = list(
+            CalendarGenerator(calendar_id, seed=seed, series=series).generate(share)
+        )
+    if shared:
+        rng = random.Random(f"shared:{seed}")
+        first, *others = calendar_ids
+        meetings = [
+            event
+            for event in calendars[first]
+            if "dateTime" in event.get("start", {})
+            and not (series and ("recurrence" in event or "recurringEventId" in event))
+        ]
+        for i, calendar_id in enumerate(others):
+            calendars[calendar_id].extend(
+                {**event, "id": f"{event['id']}{i:02d}"}
+                for event in rng.sample(meetings, int(len(meetings) * shared))
+            )
+    return calendars
@@ -0,0 +1,723 @@
+"""
+In-process fake of the Calendar API v3 resources used by polycal
+
+Only `events().list/import_/patch/delete/watch`, `channels().stop` and batch
+requests are implemented, with just enough semantics for polycal: time window
+and iCalUID filtering, paging, sync tokens, `showDeleted`, `fields` masks of
+responses and merging of patches. Events are kept serialized and every response
+is parsed from JSON, so clients pay the same deserialization cost as with the
+real API. `ApiStats` counts requests and payload bytes. Recurring series are
+stored as loaded and never expanded, so `singleEvents` should match how
+calendars were generated. `FakeNotifier` POSTs push notifications of watched
+calendars. `FakeCalendarApi.fail` and `fail_batch` inject errors of batches.
+"""
+
+import collections
+import dataclasses
+import datetime
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.request
+from typing import TYPE_CHECKING, Any, Callable, Iterable, List, Optional
+
+from polycal.services.batch import MAX_BATCH_SIZE
+from polycal.services.gcal import (
+    GoogleCalendarEvent,
+    GoogleCalendarService,
+    from_google_cal_date,
+)
+from polycal.services.metrics import Metrics
+from polycal.services.ratelimit import RateLimiter
+from polycal.types import dt_sort_key
+
+# like polycal, the fake doesn't import Google client libraries unless needed
+if TYPE_CHECKING:
+    from googleapiclient.errors import HttpError
+
+
+# reasons of errors injected with `FakeCalendarApi.fail`
+ERROR_REASONS = {
+    400: "invalid",
+    403: "forbidden",
+    404: "notFound",
+    410: "deleted",
+    429: "rateLimitExceeded",
+}
+
+
+def http_error(status: int, reason: str, message: str = "") -> "HttpError":
+    # slow to import, kept out of startup benchmarks
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    content = {
+        "error": {
+            "code": status,
+            "message": message or reason,
+            "errors": [{"domain": "global", "reason": reason, "message": message}],
+        }
+    }
+    return HttpError(
+        httplib2.Response({"status": status}), json.dumps(content).encode()
+    )
+
+
+def parse_rfc3339(value: str) -> float:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def series_end(event: GoogleCalendarEvent, end: float) -> float:
+    """End of the last instance of a series, as far as UNTIL tells"""
+    if "recurrence" not in event:
+        return end
+    match = re.search(r"UNTIL=(\d{8}T\d{6}Z)", "".join(event["recurrence"]))
+    if not match:
+        return math.inf
+    start = dt_sort_key(from_google_cal_date(event["start"]))
+    until = datetime.datetime.strptime(match.group(1), "%Y%m%dT%H%M%SZ")
+    return dt_sort_key(until) + end - start
+
+
+FIELD_PATH = re.compile(r"[\w/]+")
+
+
+def parse_fields(fields: str) -> dict[str, dict]:
+    """
+    Partial response mask as a tree of selected keys, a leaf selects everything
+
+    >>> parse_fields("items(id,start/date),nextPageToken")
+    {'items': {'id': {}, 'start': {'date': {}}}, 'nextPageToken': {}}
+    """
+    tree, _ = _parse_fields(fields, 0)
+    return tree
+
+
+def _parse_fields(fields: str, pos: int) -> tuple[dict[str, dict], int]:
+    tree: dict[str, dict] = {}
+    while pos < len(fields):
+        match = FIELD_PATH.match(fields, pos)
+        node = tree
+        for key in match.group().split("/"):
+            node = node.setdefault(key, {})
+        pos = match.end()
+        if fields[pos : pos + 1] == "(":
+            subtree, pos = _parse_fields(fields, pos + 1)
+            node.update(subtree)
+            pos += 1
+        if fields[pos : pos + 1] == ")":
+            break
+        pos += 1
+    return tree, pos
+
+
+def project(value: Any, tree: dict[str, dict]) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    return {key: project(value[key], tree[key]) for key in tree if key in value}
+
+
+def merge_patch(value: dict, patch: dict) -> dict:
+    """
+    `patch` applied to `value` like `events().patch` does, in place
+
+    Nested objects are merged, null values unset fields.
+
+    >>> merge_patch({"start": {"date": "2024-01-01"}, "summary": "a"},
+    ...     {"start": {"date": None, "dateTime": "2024-01-01T10:00:00Z"}})
+    {'start': {'dateTime': '2024-01-01T10:00:00Z'}, 'summary': 'a'}
+    """
+    for key, patched in patch.items():
+        if patched is None:
+            value.pop(key, None)
+        elif isinstance(patched, dict) and isinstance(value.get(key), dict):
+            merge_patch(value[key], patched)
+        else:
+            value[key] = patched
+    return value
+
+
+def project_response(response: str, fields: Optional[str]) -> str:
+    """Response content limited to a `fields` mask of a single resource"""
+    if not fields:
+        return response
+    return json.dumps(project(json.loads(response), parse_fields(fields)))
+
+
+@dataclasses.dataclass
+class ApiStats:
+    # HTTP round trips, a batch request counts as one
+    requests: int = 0
+    # API calls by method, including calls sent inside batch requests
+    calls: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+
+    def record(
+        self, method: str, sent: int = 0, received: int = 0, request: bool = True
+    ) -> None:
+        with self.lock:
+            self.requests += request
+            self.calls[method] += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.calls.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "calls": dict(sorted(self.calls.items())),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+@dataclasses.dataclass
+class StoredEvent:
+    json: str
+    uid: str
+    start: float
+    end: float
+    cancelled: bool
+    version: int
+    # instance of a series, listed even when cancelled unless `singleEvents`
+    instance: bool = False
+    # serialized projections by `items` mask of `events().list`
+    projections: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    def projected(self, fields: Optional[str]) -> str:
+        if not fields:
+            return self.json
+        try:
+            return self.projections[fields]
+        except KeyError:
+            tree = parse_fields(fields).get("items", {})
+            content = json.dumps(project(json.loads(self.json), tree))
+            self.projections[fields] = content
+            return content
+
+
+class FakeRequest:
+    """
+    Counterpart of `googleapiclient.http.HttpRequest`
+
+    :param key: what the call is about, see `FakeCalendarApi.fail`
+    """
+
+    def __init__(
+        self,
+        api: "FakeCalendarApi",
+        method: str,
+        run: Callable,
+        key: Optional[str] = None,
+    ):
+        self.api = api
+        self.method = method
+        self.run = run
+        self.key = key
+        self.headers: dict[str, str] = {}
+
+    def execute(self, http: Any = None, num_retries: int = 0) -> Any:
+        self.api.check_quota()
+        return self.run(True)
+
+
+class FakeBatch:
+    """Counterpart of `googleapiclient.http.BatchHttpRequest`"""
+
+    def __init__(self, api: "FakeCalendarApi", callback: Optional[Callable] = None):
+        self.api = api
+        self.callback = callback
+        self.requests: list[tuple[str, FakeRequest, Optional[Callable]]] = []
+
+    def add(
+        self,
+        request: FakeRequest,
+        callback: Optional[Callable] = None,
+        request_id: Optional[str] = None,
+    ) -> None:
+        if len(self.requests) >= MAX_BATCH_SIZE:
+            raise ValueError("Too many requests in a batch")
+        request_id = request_id if request_id is not None else str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http: Any = None) -> None:
+        from googleapiclient.errors import HttpError
+
+        with self.api.lock:
+            self.api.stats.record("batch")
+        error = self.api.injected_error(("batch", None))
+        if error is not None:
+            raise error
+        for request_id, request, callback in self.requests:
+            response, exception = None, None
+            try:
+                if self.api.rng.random() < self.api.error_rate:
+                    raise http_error(403, "rateLimitExceeded", "Rate Limit Exceeded")
+                error = self.api.injected_error((request.method, request.key))
+                if error is not None:
+                    raise error
+                self.api.check_quota()
+                response = request.run(False)
+            except HttpError as e:
+                exception = e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeEvents:
+    def __init__(self, api: "FakeCalendarApi"):
+        self.api = api
+
+    def list(
+        self,
+        calendarId: str,
+        timeMin: Optional[str] = None,
+        timeMax: Optional[str] = None,
+        iCalUID: Optional[str] = None,
+        syncToken: Optional[str] = None,
+        pageToken: Optional[str] = None,
+        maxResults: int = 250,
+        singleEvents: bool = False,
+        showDeleted: bool = False,
+        orderBy: Optional[str] = None,
+        fields: Optional[str] = None,
+        **kwargs,
+    ) -> FakeRequest:
+        api = self.api
+
+        def run(direct: bool) -> dict:
+            with api.lock:
+                offset = 0
+                if pageToken:
+                    items, offset, sync_token = api.cursors.pop(pageToken)
+                else:
+                    items, sync_token = self.query(
+                        calendarId,
+                        timeMin=timeMin,
+                        timeMax=timeMax,
+                        iCalUID=iCalUID,
+                        syncToken=syncToken,
+                        singleEvents=singleEvents,
+                        showDeleted=showDeleted or bool(syncToken),
+                        orderBy=orderBy,
+                        fields=fields,
+                    )
+                page = items[offset : offset + maxResults]
+                tail = ""
+                if offset + maxResults < len(items):
+                    next_page_token = f"page{next(api.page_tokens)}"
+                    api.cursors[next_page_token] = (
+                        items,
+                        offset + maxResults,
+                        sync_token,
+                    )
+                    tail = f',"nextPageToken":"{next_page_token}"'
+                elif sync_token:
+                    tail = f',"nextSyncToken":"{sync_token}"'
+                # ETag of the collection, changes with any of its events
+                etag = json.dumps(f'"{api.etags.get(calendarId, 0)}"')
+                content = (
+                    f'{{"kind":"calendar#events","etag":{etag},"items":['
+                    + ",".join(page)
+                    + "]"
+                    + tail
+                    + "}"
+                )
+                api.stats.record("events.list", received=len(content), request=direct)
+            return json.loads(content)
+
+        return FakeRequest(api, "events.list", run)
+
+    def query(
+        self,
+        calendar_id: str,
+        timeMin: Optional[str],
+        timeMax: Optional[str],
+        iCalUID: Optional[str],
+        syncToken: Optional[str],
+        singleEvents: bool,
+        showDeleted: bool,
+        orderBy: Optional[str],
+        fields: Optional[str],
+    ) -> tuple[List[str], Optional[str]]:
+        api = self.api
+        events: Iterable[StoredEvent] = api.calendar(calendar_id).values()
+        sync_token = None
+        if syncToken:
+            generation, _, version = syncToken.partition(":")
+            if generation != str(api.token_generation):
+                raise http_error(
+                    410, "fullSyncRequired", "Sync token is no longer valid"
+                )
+            events = [event for event in events if event.version > int(version)]
+        if iCalUID:
+            event_id = api.uids.get((calendar_id, iCalUID))
+            events = [api.calendar(calendar_id)[event_id]] if event_id else []
+        else:
+            sync_token = f"{api.token_generation}:{api.version}"
+        if timeMin:
+            time_min = parse_rfc3339(timeMin)
+            events = [event for event in events if event.end > time_min]
+        if timeMax:
+            time_max = parse_rfc3339(timeMax)
+            events = [event for event in events if event.start < time_max]
+        if not showDeleted:
+            events = [
+                event
+                for event in events
+                if not event.cancelled or (event.instance and not singleEvents)
+            ]
+        if orderBy == "startTime":
+            events = sorted(events, key=lambda event: event.start)
+        return [event.projected(fields) for event in events], sync_token
+
+    def import_(
+        self,
+        calendarId: str,
+        body: GoogleCalendarEvent,
+        fields: Optional[str] = None,
+        **kwargs,
+    ):
+        api = self.api
+        content = json.dumps(body)
+
+        def run(direct: bool) -> dict:
+            with api.lock:
+                calendar = api.calendar(calendarId)
+                event_id = api.uids.get((calendarId, body["iCalUID"]))
+                event = {"status": "confirmed", **json.loads(content)}
+                if event_id is None:
+                    event_id = f"imported{next(api.event_ids):012d}"
+                    api.uids[(calendarId, body["iCalUID"])] = event_id
+                event.update(kind="calendar#event", id=event_id)
+                response = project_response(
+                    api.store(calendarId, calendar, event), fields
+                )
+                api.stats.record(
+                    "events.import",
+                    sent=len(content),
+                    received=len(response),
+                    request=direct,
+                )
+            return json.loads(response)
+
+        return FakeRequest(api, "events.import", run, key=body["iCalUID"])
+
+    def patch(
+        self,
+        calendarId: str,
+        eventId: str,
+        body: GoogleCalendarEvent,
+        fields: Optional[str] = None,
+        **kwargs,
+    ):
+        api = self.api
+        content = json.dumps(body)
+
+        def run(direct: bool) -> dict:
+            with api.lock:
+                calendar = api.calendar(calendarId)
+                if eventId not in calendar:
+                    raise http_error(404, "notFound", "Not Found")
+                event = merge_patch(
+                    json.loads(calendar[eventId].json), json.loads(content)
+                )
+                response = project_response(
+                    api.store(calendarId, calendar, event), fields
+                )
+                api.stats.record(
+                    "events.patch",
+                    sent=len(content),
+                    received=len(response),
+                    request=direct,
+                )
+            return json.loads(response)
+
+        return FakeRequest(api, "events.patch", run, key=eventId)
+
+    def delete(self, calendarId: str, eventId: str, **kwargs) -> FakeRequest:
+        api = self.api
+
+        def run(direct: bool) -> str:
+            with api.lock:
+                api.stats.record("events.delete", request=direct)
+                calendar = api.calendar(calendarId)
+                if eventId not in calendar:
+                    raise http_error(404, "notFound", "Not Found")
+                if calendar[eventId].cancelled:
+                    raise http_error(410, "deleted", "Resource has been deleted")
+                event = json.loads(calendar[eventId].json)
+                event["status"] = "cancelled"
+                api.store(calendarId, calendar, event)
+            return ""
+
+        return FakeRequest(api, "events.delete", run, key=eventId)
+
+    def watch(self, calendarId: str, body: dict, **kwargs) -> FakeRequest:
+        api = self.api
+
+        def run(direct: bool) -> dict:
+            api.stats.record("events.watch", sent=len(json.dumps(body)), request=direct)
+            resource_id = f"resource-{calendarId}"
+            api.notifier.watch(calendarId, resource_id, body)
+            return {
+                "kind": "api#channel",
+                "id": body["id"],
+                "resourceId": resource_id,
+                "expiration": str(int(api.now() * 1000) + 7 * 24 * 3600 * 1000),
+            }
+
+        return FakeRequest(api, "events.watch", run)
+
+
+class FakeChannels:
+    def __init__(self, api: "FakeCalendarApi"):
+        self.api = api
+
+    def stop(self, body: dict, **kwargs) -> FakeRequest:
+        api = self.api
+
+        def run(direct: bool) -> str:
+            api.stats.record("channels.stop", request=direct)
+            api.notifier.stop(body["id"])
+            return ""
+
+        return FakeRequest(api, "channels.stop", run)
+
+
+class FakeNotifier:
+    """
+    Push notifications of watched calendars, POSTed to channel addresses
+
+    https://developers.google.com/calendar/api/guides/push#receiving-notifications
+
+    Channels are opened by `events().watch` and closed by `channels().stop`.
+    Unlike with the real API, notifications are only sent by `notify`.
+    """
+
+    def __init__(self):
+        # watch request bodies and resource ids by channel id
+        self.channels: dict[str, tuple[str, str, dict]] = {}
+        self.message_numbers = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def watch(self, calendar_id: str, resource_id: str, body: dict) -> None:
+        with self.lock:
+            self.channels[body["id"]] = (calendar_id, resource_id, body)
+
+    def stop(self, channel_id: str) -> None:
+        with self.lock:
+            self.channels.pop(channel_id, None)
+
+    def watching(self, calendar_id: str) -> list[str]:
+        """Ids of channels open for a calendar"""
+        with self.lock:
+            return [
+                channel_id
+                for channel_id, (watched_id, _, _) in self.channels.items()
+                if watched_id == calendar_id
+            ]
+
+    def notify(self, calendar_id: str, state: str = "exists") -> int:
+        """Notify every channel watching a calendar, returns their number"""
+        with self.lock:
+            channels = [
+                (channel_id, resource_id, body)
+                for channel_id, (watched_id, resource_id, body) in self.channels.items()
+                if watched_id == calendar_id
+            ]
+        for channel_id, resource_id, body in channels:
+            headers = {
+                "X-Goog-Channel-ID": channel_id,
+                "X-Goog-Message-Number": str(next(self.message_numbers)),
+                "X-Goog-Resource-ID": resource_id,
+                "X-Goog-Resource-State": state,
+                "X-Goog-Resource-URI": f"https://www.googleapis.com/calendar/v3"
+                f"/calendars/{calendar_id}/events",
+            }
+            if body.get("token"):
+                headers["X-Goog-Channel-Token"] = body["token"]
+            request = urllib.request.Request(
+                body["address"], data=b"", headers=headers, method="POST"
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        return len(channels)
+
+
+class FakeCalendarApi:
+    """
+    Stand-in for `googleapiclient.discovery.build("calendar", "v3")`
+
+    :param error_rate: fraction of batched calls failing with a rate limit error
+    :param quota: calls accepted per second, others fail with a rate limit error
+    """
+
+    def __init__(
+        self, error_rate: float = 0.0, seed: int = 0, quota: Optional[int] = None
+    ):
+        self.calendars: dict[str, dict[str, StoredEvent]] = {}
+        self.uids: dict[tuple[str, str], str] = {}
+        self.cursors: dict[str, tuple[list[str], int, Optional[str]]] = {}
+        self.page_tokens = itertools.count()
+        self.event_ids = itertools.count()
+        self.version = 0
+        # version of the last change of every calendar
+        self.etags: dict[str, int] = {}
+        self.token_generation = 0
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.quota = quota
+        self.quota_calls: collections.deque[float] = collections.deque()
+        self.stats = ApiStats()
+        self.notifier = FakeNotifier()
+        # statuses of injected errors by (method, key), see `fail`
+        self.failures: dict[tuple[str, Optional[str]], collections.deque[int]] = {}
+        self.lock = threading.RLock()
+        self.now = lambda: datetime.datetime.now().timestamp()
+
+    def events(self) -> FakeEvents:
+        return FakeEvents(self)
+
+    def channels(self) -> FakeChannels:
+        return FakeChannels(self)
+
+    def new_batch_http_request(self, callback: Optional[Callable] = None) -> FakeBatch:
+        return FakeBatch(self, callback=callback)
+
+    def check_quota(self) -> None:
+        """Count a call against `quota`, rejecting it if over the quota"""
+        if self.quota is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            while self.quota_calls and self.quota_calls[0] <= now - 1:
+                self.quota_calls.popleft()
+            if len(self.quota_calls) >= self.quota:
+                self.stats.record("rateLimited", request=False)
+                raise http_error(403, "rateLimitExceeded", "Rate Limit Exceeded")
+            self.quota_calls.append(now)
+
+    def fail(self, method: str, key: str, *statuses: int) -> None:
+        """
+        Fail the next batched calls of `method` with `statuses`, one per call
+
+        Only calls about `key` fail: iCalUID of the imported event, or id of the
+        patched or deleted one.
+        """
+        with self.lock:
+            self.failures.setdefault((method, key), collections.deque()).extend(
+                statuses
+            )
+
+    def fail_batch(self, *statuses: int) -> None:
+        """Fail the next batch requests as a whole with `statuses`"""
+        with self.lock:
+            self.failures.setdefault(("batch", None), collections.deque()).extend(
+                statuses
+            )
+
+    def injected_error(
+        self, failure: tuple[str, Optional[str]]
+    ) -> Optional["HttpError"]:
+        with self.lock:
+            statuses = self.failures.get(failure)
+            if not statuses:
+                return None
+            status = statuses.popleft()
+        return http_error(status, ERROR_REASONS.get(status, "backendError"))
+
+    def calendar(self, calendar_id: str) -> dict[str, StoredEvent]:
+        return self.calendars.setdefault(calendar_id, {})
+
+    def store(
+        self,
+        calendar_id: str,
+        calendar: dict[str, StoredEvent],
+        event: GoogleCalendarEvent,
+    ) -> str:
+        self.version += 1
+        self.etags[calendar_id] = self.version
+        content = json.dumps(event, separators=(",", ":"))
+        # cancelled instances of series only have their original start
+        start = event.get("start") or event["originalStartTime"]
+        calendar[event["id"]] = StoredEvent(
+            json=content,
+            uid=event.get("iCalUID", ""),
+            start=dt_sort_key(from_google_cal_date(start)),
+            end=series_end(
+                event, dt_sort_key(from_google_cal_date(event.get("end", start)))
+            ),
+            cancelled=event.get("status") == "cancelled",
+            instance="recurringEventId" in event,
+            version=self.version,
+        )
+        if "iCalUID" in event:
+            self.uids.setdefault((calendar_id, event["iCalUID"]), event["id"])
+        return content
+
+    def load(self, calendar_id: str, events: Iterable[GoogleCalendarEvent]) -> None:
+        """Add events to a calendar, bypassing stats"""
+        with self.lock:
+            calendar = self.calendar(calendar_id)
+            for event in events:
+                self.store(calendar_id, calendar, event)
+
+    def dump(self) -> dict[str, list[GoogleCalendarEvent]]:
+        """Events of all calendars, to be `load`ed into another instance"""
+        with self.lock:
+            return {
+                calendar_id: [json.loads(event.json) for event in calendar.values()]
+                for calendar_id, calendar in self.calendars.items()
+            }
+
+    def modify(self, calendar_id: str, count: int, seed: int = 0) -> list[str]:
+        """Retitle `count` random events of a calendar, returns their ids"""
+        rng = random.Random(seed)
+        with self.lock:
+            calendar = self.calendar(calendar_id)
+            event_ids = rng.sample(sorted(calendar), min(count, len(calendar)))
+            for event_id in event_ids:
+                event = json.loads(calendar[event_id].json)
+                event["summary"] = f"{event.get('summary', '')} (moved)"
+                self.store(calendar_id, calendar, event)
+        return event_ids
+
+    def expire_sync_tokens(self) -> None:
+        with self.lock:
+            self.token_generation += 1
+
+
+class FakeGoogleCalendarService(GoogleCalendarService):
+    """`GoogleCalendarService` talking to a `FakeCalendarApi`"""
+
+    def __init__(
+        self,
+        api: FakeCalendarApi,
+        metrics: Optional[Metrics] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.creds = None
+        self.metrics = metrics
+        self.transport = None
+        self.limiter = limiter
+        self.service = api
+
+    def new_http(self):
+        return None
@@ -0,0 +1,161 @@
+"""
+iCalendar file source benchmark
+
+    python -m benchmarks.ics --events 100000 --years 5
+
+Writes a synthetic calendar with `--years` of history (generated as series,
+with cancelled instances as RECURRENCE-ID exceptions) to an .ics file and reads
+it with `IcsCalendarService`:
+
+- parse: every VEVENT turned into an `Event`, what reading the whole export
+  on every run costs
+- window: events of the 90 day benchmark window, instances of series expanded
+- series: the same as series with their exceptions
+- unchanged: incremental sync of the unchanged file
+"""
+
+import argparse
+import datetime
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Iterable, Iterator, Optional
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, CalendarGenerator
+from polycal.services import ics
+from polycal.services.gcal import GoogleCalendarEvent, from_google_cal_date
+
+PARTSTATS = {value: key for key, value in ics.PARTSTATS.items()}
+
+
+def ics_date(name: str, value: dict[str, str]) -> str:
+    dt = from_google_cal_date(value)
+    if not isinstance(dt, datetime.datetime):
+        return f"{name};VALUE=DATE:{dt:%Y%m%d}"
+    return f"{name}:{dt.astimezone(datetime.timezone.utc):%Y%m%dT%H%M%SZ}"
+
+
+def escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line: str) -> str:
+    """Content line folded at 75 characters"""
+    return "\r\n ".join(line[i : i + 74] for i in range(0, len(line), 74)) or line
+
+
+def to_vevent(event: GoogleCalendarEvent, uid: str) -> Iterator[str]:
+    yield "BEGIN:VEVENT"
+    yield f"UID:{uid}"
+    if "originalStartTime" in event:
+        yield ics_date("RECURRENCE-ID", event["originalStartTime"])
+    if "start" in event:
+        yield ics_date("DTSTART", event["start"])
+        yield ics_date("DTEND", event["end"])
+    yield from event.get("recurrence", [])
+    for name, key in [
+        ("SUMMARY", "summary"),
+        ("LOCATION", "location"),
+        ("DESCRIPTION", "description"),
+    ]:
+        if key in event:
+            yield f"{name}:{escape(event[key])}"
+    if event.get("status") == "cancelled":
+        yield "STATUS:CANCELLED"
+    if event.get("transparency") == "transparent":
+        yield "TRANSP:TRANSPARENT"
+    for attendee in event.get("attendees", []):
+        partstat = PARTSTATS[attendee.get("responseStatus", "needsAction")]
+        yield f"ATTENDEE;PARTSTAT={partstat}:mailto:{attendee['email']}"
+    yield "BEGIN:VALARM"
+    yield "TRIGGER:-PT10M"
+    yield "ACTION:DISPLAY"
+    yield "END:VALARM"
+    yield "END:VEVENT"
+
+
+def write_ics(path: pathlib.Path, events: Iterable[GoogleCalendarEvent]) -> None:
+    with path.open("w", newline="") as f:
+        f.write(
+            "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//polycal//benchmark//EN\r\n"
+        )
+        # cancelled instances of series only have the series id
+        uids = {}
+        for event in events:
+            uid = uids.setdefault(
+                event.get("recurringEventId", event["id"]), event.get("iCalUID")
+            )
+            f.writelines(fold(line) + "\r\n" for line in to_vevent(event, uid))
+        f.write("END:VCALENDAR\r\n")
+
+
+def parse_all(path: pathlib.Path) -> int:
+    count = 0
+    for component in ics.read_vevents(path):
+        properties = ics.parse_properties(component)
+        start, end = ics.event_span(properties)
+        ics.vevent_to_event(properties, start, end)
+        count += 1
+    return count
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--events", type=int, default=100000, help="event instances in the file"
+    )
+    parser.add_argument("--years", type=int, default=5, help="years of history")
+    parser.add_argument(
+        "--recurring",
+        type=float,
+        default=0.05,
+        help="ratio of recurring series among generated events",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    generator = CalendarGenerator(
+        "source@example.com",
+        start=WINDOW_END - datetime.timedelta(days=365 * args.years),
+        end=WINDOW_END,
+        recurring_ratio=args.recurring,
+        series=True,
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = pathlib.Path(tmp_dir) / "export.ics"
+        write_ics(path, generator.generate(args.events))
+        service = ics.IcsCalendarService(path)
+        token = service.sync_token()
+        scenarios = {
+            "parse": lambda: parse_all(path),
+            "window": lambda: len(
+                list(service.list_events("ics", WINDOW_START, WINDOW_END))
+            ),
+            "series": lambda: len(
+                list(service.list_events("ics", WINDOW_START, WINDOW_END, series=True))
+            ),
+            "unchanged": lambda: len(
+                service.list_events_changes(
+                    "ics", WINDOW_START, WINDOW_END, sync_token=token
+                ).events
+            ),
+        }
+        print(f"{path.stat().st_size / 2**20:.1f} MiB, {args.years} years")
+        print(f"{'scenario':<10} {'seconds':>8} {'events':>8}")
+        for scenario, func in scenarios.items():
+            started = time.perf_counter()
+            events = func()
+            seconds = time.perf_counter() - started
+            print(f"{scenario:<10} {seconds:>8.3f} {events:>8}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
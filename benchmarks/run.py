@@ -0,0 +1,321 @@
+"""
+Sync benchmarks on synthetic calendars against an in-process fake API
+
+    python -m benchmarks.run --events 1000,10000,100000 --sources 4
+
+For every size a fresh fake API is filled with generated source calendars and
+these scenarios are run in order:
+
+- full: first sync to an empty target calendar
+- noop: the same full sync again, nothing changed
+- modified: the same full sync after 1% of source events changed, written as
+  patches of the changed fields
+- incremental: incremental sync after 1% of source events changed
+
+Each scenario reports wall time, throughput (source event instances per second),
+peak memory allocated by Python (tracemalloc) and API usage as seen by the fake.
+"""
+
+import argparse
+import dataclasses
+import gc
+import json
+import logging
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+import yaml
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, generate_calendars
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+from polycal.services.metrics import Metrics
+from polycal.services.ratelimit import RateLimiter
+from polycal.services.syncstate import SyncStateStore
+from polycal.services.targetindex import TargetIndex
+from polycal.services.transformcache import TransformCache
+from polycal.services.transformpool import TransformPool
+
+TARGET_ID = "target@example.com"
+
+DEFAULT_TRANSFORMS = [
+    {"type": "SkipByAttr", "kwargs": {"type": "outOfOffice"}},
+    {"type": "SkipByDuration", "kwargs": {"min_duration": "20m"}},
+    {"type": "SkipByTitle", "kwargs": {"titles": ["Lunch", "Focus time"]}},
+    {"type": "ReplaceTitle", "kwargs": {"pattern": r"^\[OOO\].*$", "repl": "OOO"}},
+]
+
+
+@dataclasses.dataclass
+class Result:
+    scenario: str
+    events: int
+    seconds: float
+    peak_memory: Optional[int]
+    api: dict[str, Any]
+
+    @property
+    def throughput(self) -> float:
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+def measure(
+    scenario: str, events: int, api: FakeCalendarApi, func: Callable, memory: bool
+) -> Result:
+    gc.collect()
+    api.stats.reset()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        func()
+        seconds = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return Result(
+        scenario=scenario,
+        events=events,
+        seconds=seconds,
+        peak_memory=peak_memory,
+        api=api.stats.as_dict(),
+    )
+
+
+def make_config(args: argparse.Namespace, incremental: bool) -> ConfigModel:
+    transforms = DEFAULT_TRANSFORMS
+    if args.transforms:
+        transforms = yaml.safe_load(pathlib.Path(args.transforms).read_text())
+    return ConfigModel(
+        sources=[
+            {"id": source_id, "transforms": transforms}
+            for source_id in source_ids(args.sources)
+        ],
+        target={
+            "id": TARGET_ID,
+            "name": "target",
+            "index": args.index,
+            "transforms": [{"type": "Dedup"}] if args.dedup else [],
+        },
+        incremental=incremental,
+        fetch_concurrency=args.fetch_concurrency,
+        batch={"chunk_size": args.chunk_size, "backoff": 0},
+        metrics={"path": args.metrics},
+        recurring=args.recurring,
+        rate_limit={"rate": args.rate_limit},
+        columnar=args.columnar,
+        transform_cache={"enabled": args.transform_cache},
+        transform_pool={
+            "enabled": bool(args.transform_processes),
+            "processes": args.transform_processes or None,
+        },
+    )
+
+
+def source_ids(count: int) -> list[str]:
+    return [f"source{i}@example.com" for i in range(count)]
+
+
+def run_size(args: argparse.Namespace, size: int) -> list[Result]:
+    api = FakeCalendarApi(error_rate=args.error_rate, seed=args.seed, quota=args.quota)
+    calendars = generate_calendars(
+        source_ids(args.sources),
+        size,
+        seed=args.seed,
+        series=args.recurring == "series",
+        shared=args.shared,
+    )
+    for calendar_id, events in calendars.items():
+        api.load(calendar_id, events)
+    del calendars
+
+    metrics = Metrics()
+    limiter = None
+    if args.rate_limiter:
+        limiter = RateLimiter(
+            **make_config(args, incremental=False).rate_limit.dict(), metrics=metrics
+        )
+
+    def new_service() -> FakeGoogleCalendarService:
+        return FakeGoogleCalendarService(api, metrics=metrics, limiter=limiter)
+
+    pool = TransformPool(args.transform_processes or None)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = pathlib.Path(tmp_dir)
+
+        def processor(incremental: bool) -> CalendarProcessor:
+            return CalendarProcessor(
+                config=make_config(args, incremental=incremental),
+                gcal_service=new_service(),
+                sync_state=SyncStateStore(path),
+                gcal_service_factory=new_service,
+                target_index=TargetIndex(path),
+                transform_cache=TransformCache(path),
+                transform_pool=pool,
+                metrics=metrics,
+                rate_limiter=limiter,
+            )
+
+        full = processor(incremental=False)
+        incremental = processor(incremental=True)
+
+        def sync(sync_processor: CalendarProcessor) -> Callable[[], None]:
+            return lambda: sync_processor.process(start=WINDOW_START, end=WINDOW_END)
+
+        def modify(seed: int) -> None:
+            for i, calendar_id in enumerate(source_ids(args.sources)):
+                api.modify(
+                    calendar_id, max(size // args.sources // 100, 1), seed=seed + i
+                )
+
+        for scenario, func in [("full", sync(full)), ("noop", sync(full))]:
+            results.append(measure(scenario, size, api, func, memory=args.memory))
+        modify(seed=args.sources)
+        results.append(measure("modified", size, api, sync(full), memory=args.memory))
+        # first incremental run only captures sync tokens
+        incremental.process(start=WINDOW_START, end=WINDOW_END)
+        modify(seed=0)
+        results.append(
+            measure("incremental", size, api, sync(incremental), memory=args.memory)
+        )
+    pool.shutdown()
+    return results
+
+
+def format_results(results: list[Result]) -> str:
+    header = (
+        f"{'events':>8} {'scenario':<12} {'seconds':>8} {'events/s':>10}"
+        f" {'peak MiB':>9} {'requests':>8} {'list':>6} {'import':>7}"
+        f" {'patch':>7} {'delete':>7} {'limited':>7} {'MiB in':>7} {'MiB out':>7}"
+    )
+    lines = [header, "-" * len(header)]
+    for result in results:
+        calls = result.api["calls"]
+        peak = (
+            f"{result.peak_memory / 2**20:9.1f}"
+            if result.peak_memory is not None
+            else f"{'-':>9}"
+        )
+        lines.append(
+            f"{result.events:>8} {result.scenario:<12} {result.seconds:>8.2f}"
+            f" {result.throughput:>10.0f} {peak} {result.api['requests']:>8}"
+            f" {calls.get('events.list', 0):>6} {calls.get('events.import', 0):>7}"
+            f" {calls.get('events.patch', 0):>7}"
+            f" {calls.get('events.delete', 0):>7}"
+            f" {calls.get('rateLimited', 0):>7}"
+            f" {result.api['bytes_received'] / 2**20:>7.1f}"
+            f" {result.api['bytes_sent'] / 2**20:>7.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--events",
+        default="1000,10000,100000",
+        help="comma separated numbers of source events, e.g. 1000,1000000",
+    )
+    parser.add_argument("--sources", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--transforms", help="YAML file with transforms applied to every source"
+    )
+    parser.add_argument("--index", action="store_true", help="use target index")
+    parser.add_argument(
+        "--shared",
+        type=float,
+        default=0.0,
+        help="fraction of meetings of the first source also in the others",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="collapse copies of shared meetings with a Dedup target transform",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="run transforms on columnar batches, needs numpy",
+    )
+    parser.add_argument(
+        "--transform-cache",
+        action="store_true",
+        help="reuse transformed events of unchanged sources",
+    )
+    parser.add_argument(
+        "--transform-processes",
+        type=int,
+        default=0,
+        help="transform sources in a pool of this many processes",
+    )
+    parser.add_argument("--fetch-concurrency", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument(
+        "--recurring",
+        choices=["instances", "series"],
+        default="instances",
+        help="sync recurring events as single instances or as series",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of batched calls failing with rate limit errors",
+    )
+    parser.add_argument(
+        "--quota",
+        type=int,
+        help="API calls per second the fake accepts, others are rate limited",
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, help="`rate_limit.rate` of polycal config"
+    )
+    parser.add_argument(
+        "--no-rate-limiter",
+        dest="rate_limiter",
+        action="store_false",
+        help="send API calls without the rate limiter, as polycal used to",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip tracemalloc, which slows down the run",
+    )
+    parser.add_argument("--json", help="write results to this JSON file")
+    parser.add_argument(
+        "--metrics", help="export polycal metrics of the last run to this file"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    results = []
+    for size in [int(size) for size in args.events.split(",")]:
+        size_results = run_size(args, size)
+        print(format_results(size_results), end="\n\n", flush=True)
+        results.extend(size_results)
+    if args.json:
+        pathlib.Path(args.json).write_text(
+            json.dumps(
+                [
+                    {**dataclasses.asdict(result), "throughput": result.throughput}
+                    for result in results
+                ],
+                indent=2,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
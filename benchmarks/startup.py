@@ -0,0 +1,136 @@
+"""
+Cold start benchmarks, every run in a fresh interpreter
+
+    python -m benchmarks.startup --runs 20
+
+Scenarios:
+
+- python: bare interpreter start, for reference
+- import: `import polycal.cli`
+- help: `polycal --help`
+- noop: `polycal sync` with nothing to change, against a fake API loaded from
+  a snapshot; the fake stands in for Google client libraries, so it measures
+  polycal's own startup and sync overhead. The run fails if any of them was
+  imported anyway, neither polycal nor the fake need them without API errors
+
+Reports median wall time and mean CPU time (user + system) of a run.
+"""
+
+import argparse
+import datetime
+import json
+import pathlib
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import yaml
+
+from benchmarks.calgen import CalendarGenerator
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+
+SNAPSHOT_FILE = "snapshot.json"
+SOURCE_IDS = ["source0@example.com", "source1@example.com"]
+TARGET_ID = "target@example.com"
+GOOGLE_CLIENT_MODULES = ("googleapiclient", "google.auth", "google.oauth2", "httplib2")
+
+
+def prepare(path: pathlib.Path, events: int) -> None:
+    """Config and a fake API snapshot with target already in sync"""
+    from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+
+    config = {
+        "sources": [{"id": source_id} for source_id in SOURCE_IDS],
+        "target": {"id": TARGET_ID, "name": "target"},
+    }
+    (path / "polycal.yml").write_text(yaml.safe_dump(config))
+    api = FakeCalendarApi()
+    processor = CalendarProcessor(
+        config=ConfigModel(**config), gcal_service=FakeGoogleCalendarService(api)
+    )
+    start, end = processor.window(datetime.datetime.utcnow())
+    for source_id in SOURCE_IDS:
+        generator = CalendarGenerator(source_id, start=start, end=end)
+        api.load(source_id, generator.generate(events // len(SOURCE_IDS)))
+    processor.process(start=start, end=end)
+    (path / SNAPSHOT_FILE).write_text(json.dumps(api.dump()))
+
+
+def sync_child(path: pathlib.Path) -> None:
+    """`polycal sync` with Google services replaced by the fake"""
+    from dependency_injector import providers
+
+    from polycal import cli
+    from polycal.containers import PolycalAppContainer
+
+    api = FakeCalendarApi()
+    for calendar_id, events in json.loads((path / SNAPSHOT_FILE).read_text()).items():
+        api.load(calendar_id, events)
+    container = PolycalAppContainer()
+    container.config_path.override(path)
+    service = providers.Factory(
+        FakeGoogleCalendarService, api, metrics=container.metrics
+    )
+    container.google_calendar_service.override(service)
+    container.google_calendar_service_factory.override(service)
+    container.wire(modules=[cli])
+    cli.cli(["sync"], standalone_mode=False)
+    if api.stats.calls.keys() - {"events.list"}:
+        raise AssertionError(f"Sync wasn't a no-op: {api.stats.as_dict()}")
+    imported = sorted(
+        name for name in sys.modules if name.startswith(GOOGLE_CLIENT_MODULES)
+    )
+    if imported:
+        raise AssertionError(f"Google client libraries were imported: {imported}")
+
+
+def measure(command: list[str], runs: int) -> tuple[float, float]:
+    """Median wall and mean CPU seconds of running `command`"""
+    walls = []
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        walls.append(time.perf_counter() - started)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime
+    return statistics.median(walls), cpu / runs
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--events", type=int, default=200, help="source events of the noop sync"
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.child:
+        sync_child(pathlib.Path(args.child))
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prepare(pathlib.Path(tmp_dir), args.events)
+        scenarios = {
+            "python": [sys.executable, "-c", "pass"],
+            "import": [sys.executable, "-c", "import polycal.cli"],
+            "help": [sys.executable, "-m", "polycal.cli", "--help"],
+            "noop": [sys.executable, "-m", "benchmarks.startup", "--child", tmp_dir],
+        }
+        print(f"{'scenario':<10} {'wall ms':>8} {'cpu ms':>8}")
+        for scenario, command in scenarios.items():
+            wall, cpu = measure(command, args.runs)
+            print(f"{scenario:<10} {wall * 1000:>8.1f} {cpu * 1000:>8.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
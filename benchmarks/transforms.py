@@ -0,0 +1,96 @@
+"""
+Transform pipeline benchmarks, per-event and columnar
+
+    python -m benchmarks.transforms --events 100000,1000000
+
+Events of a generated calendar are fetched from the fake API once, then passed
+through the pipeline of the sync benchmarks (`benchmarks.run`) followed by
+`Merge`, both per event and on columnar batches (`polycal.columnar`, needs
+numpy). Only the pipeline is timed; "shared" pipelines copy events before
+modifying them, as with multiple targets.
+"""
+
+import argparse
+import sys
+import time
+from typing import Optional
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, generate_calendars
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from benchmarks.run import DEFAULT_TRANSFORMS
+from polycal.pipeline import Pipeline
+from polycal.services.calprocessor import TransformModel
+from polycal.transforms import FILTERS, TRANSFORMERS
+from polycal.types import Event
+
+CALENDAR_ID = "source@example.com"
+TRANSFORMS = [TransformModel(**transform) for transform in DEFAULT_TRANSFORMS] + [
+    TransformModel(type="Merge", kwargs={"elipsis": "15m"})
+]
+
+
+def make_pipeline(columnar: bool, shared: bool) -> Pipeline:
+    return Pipeline(
+        [
+            (
+                TRANSFORMERS[transform.type](**(transform.kwargs or {})),
+                [
+                    FILTERS[filter_.type](**(filter_.kwargs or {}))
+                    for filter_ in transform.filters
+                ],
+            )
+            for transform in TRANSFORMS
+        ],
+        shared=shared,
+        columnar=columnar,
+    )
+
+
+def fetch(size: int) -> list[Event]:
+    api = FakeCalendarApi()
+    api.load(CALENDAR_ID, generate_calendars([CALENDAR_ID], size)[CALENDAR_ID])
+    return list(
+        FakeGoogleCalendarService(api).list_events(
+            CALENDAR_ID, WINDOW_START, WINDOW_END, attendees=False
+        )
+    )
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--events",
+        default="10000,100000",
+        help="comma separated numbers of source events, e.g. 1000,1000000",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="best of runs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    print(f"{'events':>8} {'pipeline':<18} {'seconds':>8} {'events/s':>10} {'out':>8}")
+    for size in [int(size) for size in args.events.split(",")]:
+        events = fetch(size)
+        for columnar in (False, True):
+            for shared in (False, True):
+                best, count = float("inf"), 0
+                for _ in range(args.runs):
+                    # unshared pipelines modify their input
+                    run_events = events if shared else [e.copy() for e in events]
+                    pipeline = make_pipeline(columnar=columnar, shared=shared)
+                    started = time.perf_counter()
+                    count = sum(1 for _ in pipeline.process(run_events))
+                    best = min(best, time.perf_counter() - started)
+                name = ("columnar" if columnar else "per-event") + (
+                    " shared" if shared else ""
+                )
+                print(
+                    f"{len(events):>8} {name:<18} {best:>8.3f}"
+                    f" {len(events) / best:>10.0f} {count:>8}",
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
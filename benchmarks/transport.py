@@ -0,0 +1,195 @@
+"""
+HTTP transport benchmark against a local stand-in server
+
+    python -m benchmarks.transport --requests 2000 --threads 8
+
+The stand-in answers every request with a canned `events().list` page and
+counts the connections it accepted. Requests are sent from `--threads`
+threads through:
+
+- httplib2: a new `httplib2.Http` per `--per-http` requests, like the default
+  transport creates per batch chunk and per fetch thread
+- pooled: `HttpTransport` shared by all threads
+
+Plain HTTP on localhost, so connections are much cheaper to open than TLS
+connections to Google, compare the connection counts rather than timings.
+Every run also checks the pooled transport refreshes an expired access token
+once, even with all threads getting 401 at the same time.
+"""
+
+import argparse
+import http.server
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from polycal.services.transport import HttpTransport
+
+PAGE = json.dumps(
+    {
+        "items": [
+            {
+                "id": f"event{i}",
+                "iCalUID": f"event{i}@example.com",
+                "start": {"dateTime": "2024-01-01T10:00:00Z"},
+                "end": {"dateTime": "2024-01-01T11:00:00Z"},
+                "summary": "Meeting",
+            }
+            for i in range(50)
+        ]
+    }
+).encode()
+UNAUTHORIZED = b'{"error": {"code": 401}}'
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self) -> None:
+        token = self.server.token
+        if token and self.headers.get("authorization") != f"Bearer {token}":
+            self.send_response(401)
+            self.send_header("content-length", str(len(UNAUTHORIZED)))
+            self.end_headers()
+            self.wfile.write(UNAUTHORIZED)
+            return
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        # access token required by the server, none if unset
+        self.token: Optional[str] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}/calendar/v3/calendars/primary/events"
+
+
+class StandInCredentials:
+    """Minimal google-auth credentials, whose refresh takes the server's token"""
+
+    def __init__(self, server: StandInServer):
+        self.server = server
+        self.token = "expired"
+        self.refreshes = 0
+
+    @property
+    def valid(self) -> bool:
+        return self.token is not None
+
+    def refresh(self, request: Any) -> None:
+        time.sleep(0.01)
+        self.refreshes += 1
+        self.token = self.server.token
+
+    def apply(self, headers: dict[str, str]) -> None:
+        headers["authorization"] = f"Bearer {self.token}"
+
+
+def run(
+    server: StandInServer,
+    new_http: Callable[[], Any],
+    requests: int,
+    threads: int,
+    per_http: int,
+) -> tuple[float, int]:
+    """Seconds and new connections of sending `requests`"""
+    connections = server.connections
+    chunks = [min(per_http, requests - i) for i in range(0, requests, per_http)]
+
+    def send(count: int) -> None:
+        http = new_http()
+        for _ in range(count):
+            resp, content = http.request(server.url)
+            assert resp.status == 200 and content == PAGE, resp
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, chunks))
+    return time.perf_counter() - started, server.connections - connections
+
+
+def check_refresh(server: StandInServer, threads: int) -> int:
+    """Access token refreshes of all threads getting 401 at once"""
+    server.token = "fresh"
+    creds = StandInCredentials(server)
+    transport = HttpTransport(creds, pool_size=threads)
+    barrier = threading.Barrier(threads)
+
+    def send(_: int) -> None:
+        barrier.wait()
+        resp, _ = transport.request(server.url)
+        assert resp.status == 200, resp
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, range(threads)))
+    transport.close()
+    server.token = None
+    return creds.refreshes
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--per-http",
+        type=int,
+        default=20,
+        help="requests sent through one httplib2.Http, e.g. a batch chunk",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    import httplib2
+
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    server = StandInServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = HttpTransport(pool_size=args.threads)
+    try:
+        scenarios = {
+            "httplib2": httplib2.Http,
+            "pooled": lambda: transport,
+        }
+        print(f"{'transport':<10} {'req/s':>8} {'connections':>12}")
+        for name, new_http in scenarios.items():
+            seconds, connections = run(
+                server, new_http, args.requests, args.threads, args.per_http
+            )
+            print(f"{name:<10} {args.requests / seconds:>8.0f} {connections:>12}")
+        refreshes = check_refresh(server, args.threads)
+        print(f"token refreshes after concurrent 401s: {refreshes}")
+        if refreshes != 1:
+            raise AssertionError("Expected a single token refresh")
+    finally:
+        transport.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,9 @@ setup(
         "pydantic",
         "python-dateutil",
         "pyyaml",
+        "requests",
     ],
+    extras_require={"numpy": ["numpy"]},
     entry_points={"console_scripts": ["polycal=polycal.cli:main"]},
     keywords=["calendar"],
     classifiers=[
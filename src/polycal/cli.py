@@ -1,27 +1,74 @@
 import datetime
+import signal
 import sys
+from typing import Optional
 
 import click
-import coloredlogs
-from dateutil import relativedelta
 from dependency_injector.wiring import Provide, inject
 
 from polycal.containers import PolycalAppContainer
-from polycal.services.calprocessor import CalendarProcessor
+from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+from polycal.services.daemon import SyncDaemon
 
 
-@click.command()
+@click.group(invoke_without_command=True)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False),
+    help="Write metrics after each run, as JSON if the name ends with .json,"
+    " otherwise as a Prometheus textfile",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False),
+    help="Dump cProfile stats of each run",
+)
+@click.pass_context
 @inject
 def cli(
-    processor: CalendarProcessor = Provide[PolycalAppContainer.calendar_processor],
+    ctx: click.Context,
+    metrics_path: Optional[str],
+    profile_path: Optional[str],
+    config: ConfigModel = Provide[PolycalAppContainer.config],
 ) -> None:
     """polycal command line"""
+    import coloredlogs
+
     coloredlogs.install()
+    if metrics_path:
+        config.metrics.path = metrics_path
+    if profile_path:
+        config.metrics.profile = profile_path
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(sync)
+
+
+@cli.command()
+@inject
+def sync(
+    processor: CalendarProcessor = Provide[PolycalAppContainer.calendar_processor],
+) -> None:
+    """Sync source calendars to the target once (default)"""
+    start, end = processor.window(datetime.datetime.utcnow())
+    try:
+        processor.process(start=start, end=end)
+    finally:
+        processor.close()
+
 
-    now = datetime.datetime.utcnow()
-    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    end = start + relativedelta.relativedelta(months=3)
-    processor.process(start=start, end=end)
+@cli.command()
+@inject
+def serve(
+    daemon: SyncDaemon = Provide[PolycalAppContainer.sync_daemon],
+) -> None:
+    """Keep running and sync whenever source calendars change"""
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
 
 
 def main():
@@ -0,0 +1,275 @@
+"""
+Columnar batches of events for vectorized transforms
+
+Transforms run event by event in Python, which for hundreds of thousands of
+instances is most of a run's CPU time. `EventBatch` holds the events of a
+pipeline stage together with NumPy arrays of the fields filters look at:
+start and end (microseconds since the epoch, as `dt_sort_key` orders them),
+whether events are all-day, and `busy`, `deleted`, `type` and `title` as codes
+of interned values. Filters and transforms implementing `mask` and
+`process_batch` (see `polycal.transforms`) work on the arrays, dropping events
+is just selecting rows, and the events themselves are only touched when a
+transform modifies them. The writer iterates the batch as plain events.
+
+NumPy is an optional dependency, installed with `polycal[numpy]`.
+"""
+
+import datetime
+from operator import attrgetter
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional
+
+import numpy as np
+
+from polycal.types import Event, dt_sort_key
+
+# attributes held in arrays, the rest is only available on events
+COLUMNS = ("busy", "deleted", "type", "title")
+
+
+class Interned:
+    """Distinct values of a column, rows refer to them by code"""
+
+    def __init__(self, values: Iterable[Hashable] = ()):
+        self.values: list[Hashable] = []
+        self.codes: dict[Hashable, int] = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value: Hashable) -> int:
+        try:
+            return self.codes[value]
+        except KeyError:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+    def encode(self, values: list[Hashable]) -> np.ndarray:
+        # distinct values are interned first, then looked up without a call
+        # into Python per value
+        for value in dict.fromkeys(values).keys() - self.codes.keys():
+            self.code(value)
+        return np.fromiter(map(self.codes.__getitem__, values), np.int32, len(values))
+
+    def mask(self, predicate: Callable[[Any], bool]) -> np.ndarray:
+        """`predicate` of every distinct value, to be indexed by codes"""
+        return np.fromiter(map(predicate, self.values), bool, len(self.values))
+
+
+class EventBatch:
+    """
+    Events with arrays of their `COLUMNS`, start and end
+
+    Arrays describe the events as they are, transforms modifying events keep
+    both in sync. Batches derived by `select` share the interned values.
+
+    :param owned: events which may be modified in place, the rest is shared
+        with other pipelines and has to be copied first, see `own`
+    """
+
+    def __init__(
+        self,
+        events: list[Event],
+        start: np.ndarray,
+        end: np.ndarray,
+        all_day: np.ndarray,
+        codes: dict[str, np.ndarray],
+        interned: dict[str, Interned],
+        owned: np.ndarray,
+    ):
+        self.events = events
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+        self.codes = codes
+        self.interned = interned
+        self.owned = owned
+
+    @classmethod
+    def from_events(cls, events: Iterable[Event], owned: bool = True) -> "EventBatch":
+        events = list(events)
+        starts = list(map(attrgetter("start"), events))
+        interned = {column: Interned() for column in COLUMNS}
+        return cls(
+            events,
+            start=to_microseconds(starts),
+            end=to_microseconds(list(map(attrgetter("end"), events))),
+            all_day=np.fromiter(
+                (not isinstance(start, datetime.datetime) for start in starts),
+                bool,
+                len(starts),
+            ),
+            codes={
+                column: interned[column].encode(list(map(attrgetter(column), events)))
+                for column in COLUMNS
+            },
+            interned=interned,
+            owned=np.full(len(events), owned),
+        )
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self) -> Iterator[Event]:
+        return iter(self.events)
+
+    def select(self, mask: np.ndarray) -> "EventBatch":
+        """Batch of events where `mask` is true"""
+        if mask.all():
+            return self
+        rows = np.flatnonzero(mask)
+        events = self.events
+        return EventBatch(
+            [events[row] for row in rows.tolist()],
+            start=self.start[rows],
+            end=self.end[rows],
+            all_day=self.all_day[rows],
+            codes={column: values[rows] for column, values in self.codes.items()},
+            interned=self.interned,
+            owned=self.owned[rows],
+        )
+
+    @property
+    def durations(self) -> np.ndarray:
+        return self.end - self.start
+
+    def attr_mask(self, column: str, value: Any) -> np.ndarray:
+        """Events whose `column` attribute equals `value`, as `==` tells"""
+        return self.value_mask(column, lambda other: other == value)
+
+    def value_mask(self, column: str, predicate: Callable[[Any], bool]) -> np.ndarray:
+        """Events whose `column` attribute matches `predicate`"""
+        return self.interned[column].mask(predicate)[self.codes[column]]
+
+    def event_mask(self, predicate: Callable[[Event], bool]) -> np.ndarray:
+        """Events matching `predicate`, evaluated one by one"""
+        return np.fromiter(map(predicate, self.events), bool, len(self.events))
+
+    def own(self, rows: np.ndarray) -> None:
+        """Copy shared events of `rows`, so that they can be modified"""
+        for row in rows[~self.owned[rows]].tolist():
+            self.events[row] = self.events[row].copy()
+        self.owned[rows] = True
+
+    def set_attr(self, rows: np.ndarray, column: str, value: Any) -> None:
+        """Set attribute of events, and their column if it has one"""
+        self.own(rows)
+        events = self.events
+        for row in rows.tolist():
+            setattr(events[row], column, value)
+        if column in self.codes:
+            self.codes[column][rows] = self.interned[column].code(value)
+
+    def replace_values(
+        self, column: str, rows: np.ndarray, replace: Callable[[Any], Any]
+    ) -> None:
+        """Set `column` of events of `rows` to `replace` of its value"""
+        interned = self.interned[column]
+        codes = self.codes[column][rows]
+        mapping = np.arange(len(interned.values))
+        for code in np.unique(codes).tolist():
+            mapping[code] = interned.code(replace(interned.values[code]))
+        new_codes = mapping[codes]
+        # only events whose value changed are modified
+        changed = new_codes != codes
+        rows, new_codes = rows[changed], new_codes[changed]
+        self.own(rows)
+        events, values = self.events, interned.values
+        for row, code in zip(rows.tolist(), new_codes.tolist()):
+            setattr(events[row], column, values[code])
+        self.codes[column][rows] = new_codes
+
+    def rows(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Indices of events where `mask` is true, of all events without it"""
+        if mask is None:
+            return np.arange(len(self))
+        return np.flatnonzero(mask)
+
+    def all_of(self, masks: list[np.ndarray]) -> np.ndarray:
+        """Events matching all `masks`, all events if there are none"""
+        if not masks:
+            return np.ones(len(self), bool)
+        return np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
+
+    def merge(self, rows: np.ndarray, gap: int) -> Optional["EventBatch"]:
+        """
+        Merge events of `rows` with the same title, see `Merge`
+
+        Merged groups are represented by their first event, extended to the
+        latest end of the group. None if events aren't ordered by start, or
+        some end before they start, which `Merge.process` handles as it goes.
+        """
+        start, end = self.start[rows], self.end[rows]
+        if (self.start[1:] < self.start[:-1]).any() or (end < start).any():
+            return None
+        if not len(rows):
+            return self
+        heads, last = merge_groups(start, end, self.codes["title"][rows], gap)
+        extended = np.flatnonzero(heads & (last != np.arange(len(rows))))
+        extended_rows, last_rows = rows[extended], rows[last[extended]]
+        self.own(extended_rows)
+        events = self.events
+        for row, last_row in zip(extended_rows.tolist(), last_rows.tolist()):
+            events[row].end = events[last_row].end
+        self.end[extended_rows] = self.end[last_rows]
+        keep = np.ones(len(self), bool)
+        keep[rows[~heads]] = False
+        return self.select(keep)
+
+
+def to_microseconds(values: list[datetime.date]) -> np.ndarray:
+    """
+    `dt_sort_key` timestamps as integer microseconds, compared exactly
+
+    Float timestamps of our times are accurate to well under a microsecond.
+    Timestamps are computed once per distinct value, events of a calendar
+    mostly start and end at a few times of day.
+    """
+    keys = {value: dt_sort_key(value) for value in dict.fromkeys(values)}
+    timestamps = np.fromiter(map(keys.__getitem__, values), np.float64, len(values))
+    return np.rint(timestamps * 1e6).astype(np.int64)
+
+
+def merge_groups(
+    start: np.ndarray, end: np.ndarray, keys: np.ndarray, gap: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge time ranges with the same key overlapping or closer than `gap`
+
+    Ranges are ordered by start. Returns whether each range starts a merged
+    group, and for every range the row ending its group, the first of those
+    with the latest end.
+
+    >>> heads, last = merge_groups(
+    ...     np.array([0, 5, 6, 20]), np.array([10, 8, 12, 30]), np.zeros(4), 0
+    ... )
+    >>> heads.tolist(), last.tolist()
+    ([True, False, False, True], [2, 2, 2, 3])
+    """
+    count = len(start)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    first = np.ones(count, bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    runs = np.cumsum(first) - 1
+    # ends and gap-extended starts compared as ranks, so that running maximum
+    # of ends can restart at every run by offsetting runs past each other
+    values, ranks = np.unique(
+        np.concatenate([end[order], start[order] - gap]), return_inverse=True
+    )
+    end_ranks, start_ranks = ranks[:count], ranks[count:]
+    offset = runs * len(values)
+    latest = np.maximum.accumulate(end_ranks + offset) - offset
+    heads = first.copy()
+    heads[1:] |= start_ranks[1:] > latest[:-1]
+    groups = np.cumsum(heads) - 1
+    group_starts = np.flatnonzero(heads)
+    group_latest = np.maximum.reduceat(end_ranks, group_starts)
+    candidates = np.flatnonzero(end_ranks == group_latest[groups])
+    firsts = np.ones(len(candidates), bool)
+    firsts[1:] = groups[candidates[1:]] != groups[candidates[:-1]]
+    sorted_last = candidates[firsts][groups]
+    unsorted_heads = np.empty(count, bool)
+    unsorted_heads[order] = heads
+    last = np.empty(count, np.intp)
+    last[order] = order[sorted_last]
+    return unsorted_heads, last
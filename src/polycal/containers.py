@@ -4,7 +4,15 @@ import yaml
 from dependency_injector import containers, providers
 
 from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+from polycal.services.daemon import SyncDaemon
 from polycal.services.gcal import GoogleCalendarService, get_creds
+from polycal.services.metrics import Metrics
+from polycal.services.ratelimit import RateLimiter
+from polycal.services.syncstate import SyncStateStore
+from polycal.services.targetindex import TargetIndex
+from polycal.services.transformcache import TransformCache
+from polycal.services.transformpool import TransformPool
+from polycal.services.transport import HttpTransport
 
 
 def get_config_path(paths: list[pathlib.Path]):
@@ -33,13 +41,65 @@ class PolycalAppContainer(containers.DeclarativeContainer):
         DEFAULT_PATHS,
     )
     config = providers.Singleton(get_config, config_path)
+    sync_state = providers.Singleton(SyncStateStore, config_path)
+    target_index = providers.Singleton(TargetIndex, config_path)
+    transform_cache = providers.Singleton(
+        TransformCache,
+        config_path,
+        max_size=config.provided.transform_cache.max_size,
+    )
+    transform_pool = providers.Singleton(
+        TransformPool, processes=config.provided.transform_pool.processes
+    )
     g_client_credentials = providers.Singleton(get_creds, config_path)
+    metrics = providers.Singleton(Metrics)
 
+    http_transport = providers.Singleton(
+        HttpTransport,
+        g_client_credentials,
+        pool_size=config.provided.http.pool_size,
+        connect_timeout=config.provided.http.connect_timeout,
+        read_timeout=config.provided.http.read_timeout,
+        keep_alive=config.provided.http.keep_alive,
+    )
+    rate_limiter = providers.Singleton(
+        RateLimiter,
+        rate=config.provided.rate_limit.rate,
+        burst=config.provided.rate_limit.burst,
+        min_rate=config.provided.rate_limit.min_rate,
+        recovery=config.provided.rate_limit.recovery,
+        max_retries=config.provided.rate_limit.max_retries,
+        metrics=metrics,
+    )
     google_calendar_service = providers.Singleton(
-        GoogleCalendarService, g_client_credentials
+        GoogleCalendarService,
+        g_client_credentials,
+        metrics=metrics,
+        transport=http_transport,
+        limiter=rate_limiter,
+    )
+    google_calendar_service_factory = providers.Factory(
+        GoogleCalendarService,
+        g_client_credentials,
+        metrics=metrics,
+        transport=http_transport,
+        limiter=rate_limiter,
     )
     calendar_processor = providers.Singleton(
         CalendarProcessor,
         config=config,
         gcal_service=google_calendar_service,
+        sync_state=sync_state,
+        gcal_service_factory=google_calendar_service_factory.provider,
+        target_index=target_index,
+        metrics=metrics,
+        rate_limiter=rate_limiter,
+        transform_cache=transform_cache,
+        transform_pool=transform_pool,
+    )
+    sync_daemon = providers.Singleton(
+        SyncDaemon,
+        config=config,
+        processor=calendar_processor,
+        gcal_service=google_calendar_service,
     )
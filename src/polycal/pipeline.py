@@ -0,0 +1,337 @@
+import dataclasses
+import time
+from typing import Callable, Generator, Iterable, Optional
+
+from polycal.transforms import Filter, Predicate, ReplaceTitle, Transform
+from polycal.types import Event, event_sort_key
+
+Step = tuple[Transform, Optional[Predicate]]
+
+
+@dataclasses.dataclass
+class StageStats:
+    seconds: float = 0.0
+    events_in: int = 0
+    events_out: int = 0
+
+
+def combine_filters(filters: list[Filter]) -> Optional[Predicate]:
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0].match
+    matchers = [filter_.match for filter_ in filters]
+    return lambda event: all(match(event) for match in matchers)
+
+
+def timed_apply(
+    apply: Callable[[Event], Optional[Event]], stats: StageStats
+) -> Callable[[Event], Optional[Event]]:
+    def timed(event: Event) -> Optional[Event]:
+        started = time.perf_counter()
+        result = apply(event)
+        stats.seconds += time.perf_counter() - started
+        stats.events_in += 1
+        stats.events_out += result is not None
+        return result
+
+    return timed
+
+
+def timed_segment(
+    segment: Callable[[Iterable[Event]], Iterable[Event]], stats: StageStats
+) -> Callable[[Iterable[Event]], Iterable[Event]]:
+    """Time a stateful segment, excluding time spent producing its input"""
+
+    def process(events: Iterable[Event]) -> Generator[Event, None, None]:
+        upstream = StageStats()
+
+        def consume() -> Generator[Event, None, None]:
+            iterator = iter(events)
+            while True:
+                started = time.perf_counter()
+                try:
+                    event = next(iterator)
+                except StopIteration:
+                    upstream.seconds += time.perf_counter() - started
+                    return
+                upstream.seconds += time.perf_counter() - started
+                stats.events_in += 1
+                yield event
+
+        iterator = iter(segment(consume()))
+        total = 0.0
+        while True:
+            started = time.perf_counter()
+            try:
+                event = next(iterator)
+            except StopIteration:
+                total += time.perf_counter() - started
+                stats.seconds = total - upstream.seconds
+                return
+            total += time.perf_counter() - started
+            stats.seconds = total - upstream.seconds
+            stats.events_out += 1
+            yield event
+
+    return process
+
+
+def copy_events(events: Iterable[Event]) -> Generator[Event, None, None]:
+    for event in events:
+        yield event.copy()
+
+
+def sort_events(events: Iterable[Event]) -> list[Event]:
+    return sorted(events, key=event_sort_key)
+
+
+def vectorize(
+    transform: Transform,
+    filters: list[Filter],
+    include: Optional[Predicate],
+    shared: bool = False,
+    stats: Optional[StageStats] = None,
+) -> Callable[[Iterable[Event]], Iterable[Event]]:
+    """
+    Run a transform on a columnar batch of events, see `polycal.columnar`
+
+    Events coming from per-event steps are collected into a batch, batches
+    are passed from one vectorized step to another as they are. Transforms
+    which can't process a particular batch fall back to `Transform.process`.
+
+    :param shared: input events, unless already batched, are shared
+    """
+    from polycal.columnar import EventBatch
+
+    def process(events: Iterable[Event]) -> EventBatch:
+        # events of preceding per-event steps are produced before timing
+        batch = events if isinstance(events, EventBatch) else list(events)
+        started = time.perf_counter()
+        if not isinstance(batch, EventBatch):
+            batch = EventBatch.from_events(batch, owned=not shared)
+        mask = None
+        if filters:
+            mask = batch.all_of([filter_.mask(batch) for filter_ in filters])
+        result = transform.process_batch(batch, mask)
+        if result is None:
+            fallback, owned = iter(batch), bool(batch.owned.all())
+            if transform.mutates and not owned:
+                fallback, owned = copy_events(fallback), True
+            result = EventBatch.from_events(
+                transform.process(fallback, include), owned=owned
+            )
+        if stats is not None:
+            stats.seconds += time.perf_counter() - started
+            # as `timed_apply`, counting only included events unless stateful
+            included = len(batch)
+            if mask is not None and not transform.stateful:
+                included = int(mask.sum())
+            stats.events_in += included
+            stats.events_out += included - len(batch) + len(result)
+        return result
+
+    return process
+
+
+def fuse(
+    steps: list[Step],
+    stats: Optional[list[StageStats]] = None,
+    shared: bool = False,
+    copy_output: bool = False,
+) -> Callable[[Iterable[Event]], Iterable[Event]]:
+    """
+    Run stateless steps in a single loop, stopping once an event is dropped
+
+    :param shared: input events are shared, copy them before they get modified
+    :param copy_output: make sure even unmodified shared events are copied
+    """
+
+    bound_steps = [(transform.apply, include) for transform, include in steps]
+    if stats is not None:
+        bound_steps = [
+            (timed_apply(apply, step_stats), include)
+            for (apply, include), step_stats in zip(bound_steps, stats)
+        ]
+
+    def process(events: Iterable[Event]) -> Generator[Event, None, None]:
+        for event in events:
+            for apply, include in bound_steps:
+                if include is None or include(event):
+                    event = apply(event)
+                    if event is None:
+                        break
+            else:
+                yield event
+
+    if not shared:
+        return process
+
+    mutating_steps = [
+        (apply, include, transform.mutates)
+        for (apply, include), (transform, _) in zip(bound_steps, steps)
+    ]
+
+    def process_shared(events: Iterable[Event]) -> Generator[Event, None, None]:
+        for event in events:
+            copied = False
+            for apply, include, mutates in mutating_steps:
+                if include is None or include(event):
+                    if mutates and not copied:
+                        event = event.copy()
+                        copied = True
+                    event = apply(event)
+                    if event is None:
+                        break
+            else:
+                yield event if copied or not copy_output else event.copy()
+
+    return process_shared
+
+
+class Pipeline:
+    """
+    Transforms of a source compiled into as few generator layers as possible
+
+    Consecutive stateless transforms are fused into a single loop, which
+    evaluates their filters once per event and stops as soon as the event is
+    dropped; unfiltered `ReplaceTitle` chains are merged into one. Stateful
+    transforms (e.g. `Merge`) need to see the whole stream, so they act as
+    barriers between the fused segments. They expect events ordered by start,
+    as do targets merging events of their sources, so events are sorted again
+    before them and at the end if a transform `reorders` them.
+
+    With `timed`, time spent in every step and its events in/out are collected
+    in `stats`, keyed by position and name of the transform, e.g. "0:SkipByAttr"
+    or "2-3:ReplaceTitle" for merged chains. Timing adds per-event overhead.
+
+    With `shared`, input events are also used elsewhere (e.g. by pipelines of
+    other targets), so each one is copied before it's modified for the first
+    time. Unmodified events are passed through as they are.
+
+    With `columnar`, transforms and filters which are `vectorized` run on
+    NumPy arrays of batches of events instead (see `polycal.columnar`), the
+    rest are fused as usual. The output is then an `EventBatch`.
+    """
+
+    def __init__(
+        self,
+        stages: list[tuple[Transform, list[Filter]]],
+        timed: bool = False,
+        shared: bool = False,
+        columnar: bool = False,
+    ):
+        self.stages = stages
+        self.timed = timed
+        self.columnar = columnar
+        self.segments: list[Callable[[Iterable[Event]], Iterable[Event]]] = []
+        self.stats: dict[str, StageStats] = {}
+        steps: list[Step] = []
+        labels: list[str] = []
+        ordered = True
+
+        def flush_steps(copy_output: bool = False) -> None:
+            nonlocal shared
+            if steps:
+                stats = [self.stats[label] for label in labels] if timed else None
+                self.segments.append(
+                    fuse(list(steps), stats, shared=shared, copy_output=copy_output)
+                )
+                steps.clear()
+                labels.clear()
+            elif shared and copy_output:
+                self.segments.append(copy_events)
+            shared = shared and not copy_output
+
+        for index, (transform, filters) in enumerate(stages):
+            include = combine_filters(filters)
+            label = f"{index}:{type(transform).__name__}"
+            if transform.stateful and not ordered:
+                flush_steps()
+                self.segments.append(sort_events)
+                ordered = True
+            ordered = ordered and not transform.reorders
+            if (
+                columnar
+                and transform.vectorized
+                and all(filter_.vectorized for filter_ in filters)
+            ):
+                flush_steps()
+                self.segments.append(
+                    vectorize(
+                        transform,
+                        filters,
+                        include,
+                        shared=shared,
+                        stats=(
+                            self.stats.setdefault(label, StageStats())
+                            if timed
+                            else None
+                        ),
+                    )
+                )
+                continue
+            if not transform.stateful:
+                if (
+                    include is None
+                    and isinstance(transform, ReplaceTitle)
+                    and steps
+                    and steps[-1][1] is None
+                    and isinstance(steps[-1][0], ReplaceTitle)
+                ):
+                    # chained replacements are memoized as a whole
+                    steps[-1] = (ReplaceTitle.chain([steps[-1][0], transform]), None)
+                    first_index = labels[-1].split("-")[0].split(":")[0]
+                    label = f"{first_index}-{label}"
+                    self.stats[label] = self.stats.pop(labels[-1])
+                    labels[-1] = label
+                else:
+                    steps.append((transform, include))
+                    labels.append(label)
+                    self.stats[label] = StageStats()
+                continue
+            # stateful transforms keep references to events they have seen
+            flush_steps(copy_output=True)
+            segment = (
+                lambda events, transform=transform, include=include: transform.process(
+                    events, include
+                )
+            )
+            if timed:
+                segment = timed_segment(
+                    segment, self.stats.setdefault(label, StageStats())
+                )
+            self.segments.append(segment)
+        flush_steps()
+        if not ordered:
+            self.segments.append(sort_events)
+        if not timed:
+            self.stats.clear()
+
+    @property
+    def transforms(self) -> list[Transform]:
+        return [transform for transform, _ in self.stages]
+
+    @property
+    def stateful(self) -> bool:
+        return any(transform.stateful for transform in self.transforms)
+
+    @property
+    def uses_src(self) -> bool:
+        return any(
+            transform.uses_src or any(filter_.uses_src for filter_ in filters)
+            for transform, filters in self.stages
+        )
+
+    @property
+    def uses_attendees(self) -> bool:
+        return any(
+            transform.uses_attendees
+            or any(filter_.uses_attendees for filter_ in filters)
+            for transform, filters in self.stages
+        )
+
+    def process(self, events: Iterable[Event]) -> Iterable[Event]:
+        for segment in self.segments:
+            events = segment(events)
+        return events
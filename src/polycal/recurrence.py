@@ -0,0 +1,282 @@
+"""
+Recurring series fetched without expansion into single instances
+
+Google returns a series as its master event, with `recurrence` rules and timed
+by the first instance, plus exceptions: instances which were modified or
+cancelled. Exceptions are folded into the master as EXDATEs and kept as
+standalone events, so a series is written out as a master and a few single
+events. Series are only expanded into instances for transforms which need to
+see them, like `Merge`.
+
+Only exceptions within the sync window are fetched, so series are written
+`bound` to the window: instances outside of it might have been cancelled or
+moved by exceptions which aren't known.
+"""
+
+import datetime
+import logging
+import math
+import re
+import zoneinfo
+from typing import Iterable, Iterator, Optional, Union
+
+from dateutil import rrule
+
+from polycal.types import Event, dt_sort_key, event_sort_key
+
+LOG = logging.getLogger(__name__)
+
+UNTIL = re.compile(r"UNTIL=(\d{8})(T\d{6})?(Z?)")
+
+
+def instance_suffix(start: Union[datetime.datetime, datetime.date]) -> str:
+    """
+    Suffix Google appends to the series id to get ids of its instances
+
+    >>> instance_suffix(datetime.date(2024, 1, 5))
+    '20240105'
+    """
+    if isinstance(start, datetime.datetime):
+        if start.tzinfo:
+            start = start.astimezone(datetime.timezone.utc)
+        return f"{start:%Y%m%dT%H%M%SZ}"
+    return f"{start:%Y%m%d}"
+
+
+def exdate(start: Union[datetime.datetime, datetime.date]) -> str:
+    if isinstance(start, datetime.datetime):
+        return f"EXDATE:{instance_suffix(start)}"
+    return f"EXDATE;VALUE=DATE:{instance_suffix(start)}"
+
+
+def fold_exceptions(events: Iterable[Event]) -> list[Event]:
+    """
+    Exclude exceptions from their series, keeping modified ones as single events
+
+    Cancelled exceptions, including those declined by the calendar owner, are
+    expected as deleted events and dropped. Returned events are sorted by start.
+    """
+    events = list(events)
+    masters = {event.source_ids[0]: event for event in events if event.recurrence}
+    folded = []
+    for event in events:
+        if event.recurring_id is not None:
+            master = masters.get(event.recurring_id)
+            if master is not None and event.original_start is not None:
+                master.recurrence = master.recurrence + [exdate(event.original_start)]
+        if not event.deleted:
+            folded.append(event)
+    folded.sort(key=event_sort_key)
+    return folded
+
+
+def until(value: Union[datetime.datetime, datetime.date]) -> str:
+    """
+    UNTIL of a rule ending with an instance starting at `value`
+
+    >>> until(datetime.datetime(2024, 1, 5, 10, tzinfo=datetime.timezone.utc))
+    'UNTIL=20240105T100000Z'
+    >>> until(datetime.datetime(2024, 1, 5, 10))
+    'UNTIL=20240105T100000'
+    """
+    if isinstance(value, datetime.datetime) and not value.tzinfo:
+        return f"UNTIL={value:%Y%m%dT%H%M%S}"
+    return f"UNTIL={instance_suffix(value)}"
+
+
+def bounded(
+    event: Event, start: datetime.datetime, end: datetime.datetime
+) -> Optional[Event]:
+    """
+    Series limited to its instances overlapping `[start, end)`
+
+    The series is rebased to its first instance in the window, and its rules end
+    with the last one. None if there are no instances in the window.
+
+    Since the written series covers no more than the window, it changes when
+    the window passes one of its instances. That's once per instance, like
+    instances entering the window are written when syncing them one by one.
+    """
+    all_day = not isinstance(event.start, datetime.datetime)
+    if not all_day and event.start.tzinfo:
+        start = start.replace(tzinfo=datetime.timezone.utc)
+        end = end.replace(tzinfo=datetime.timezone.utc)
+    duration = event.duration
+    try:
+        rules = occurrences(event, after=start - duration)
+        window = rules.between(start - duration, end)
+        ended = rules.after(window[-1]) is None if window else True
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError) as e:
+        LOG.warning("Can't bound %s, kept as it is: %r", event.iCalUID, e)
+        return event
+    if not window:
+        return None
+    first = window[0].date() if all_day else window[0]
+    last = window[-1].date() if all_day else window[-1]
+    if first == event.start and ended:
+        return event
+    series = event.copy()
+    series.start = first
+    series.end = first + duration
+    series.recurrence = [
+        (
+            ";".join(
+                [
+                    part
+                    for part in line.split(";")
+                    if not part.startswith(("COUNT=", "UNTIL="))
+                ]
+                + [until(last)]
+            )
+            if line.startswith("RRULE:")
+            else line
+        )
+        for line in event.recurrence
+    ]
+    return series
+
+
+def bound(
+    events: Iterable[Event], start: datetime.datetime, end: datetime.datetime
+) -> list[Event]:
+    """Limit series to their instances overlapping the window, see `bounded`"""
+    limited = []
+    for event in events:
+        if event.recurrence:
+            event = bounded(event, start, end)
+            if event is None:
+                continue
+        limited.append(event)
+    limited.sort(key=event_sort_key)
+    return limited
+
+
+def occurrences(
+    event: Event, after: Optional[datetime.datetime] = None
+) -> rrule.rruleset:
+    """
+    Instance starts of a series, in its time zone
+
+    :param after: only instances after it are needed, see `rebased_start`
+    """
+    dtstart = event.start
+    if not isinstance(dtstart, datetime.datetime):
+        dtstart = datetime.datetime.combine(dtstart, datetime.time())
+    elif event.timezone and dtstart.tzinfo:
+        dtstart = dtstart.astimezone(zoneinfo.ZoneInfo(event.timezone))
+    lines = event.recurrence
+    if after is not None:
+        dtstart = rebased_start(dtstart, lines, after)
+    if dtstart.tzinfo:
+        # dateutil rejects floating UNTIL of zoned series, Google accepts it
+        lines = [UNTIL.sub(utc_until, line) for line in lines]
+    return rrule.rrulestr("\n".join(lines), dtstart=dtstart, forceset=True)
+
+
+def rebased_start(
+    dtstart: datetime.datetime, lines: list[str], after: datetime.datetime
+) -> datetime.datetime:
+    """
+    Later start of a series, generating the same instances after `after`
+
+    Rules repeating every so many days or weeks generate the same instances
+    from any start whole periods later, so that expanding a series started
+    years ago doesn't iterate over all of its past instances. Series with other
+    rules, or limited by COUNT, are expanded from their actual start.
+
+    >>> rebased_start(
+    ...     datetime.datetime(2020, 1, 6, 10),
+    ...     ["RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE"],
+    ...     datetime.datetime(2024, 1, 1),
+    ... )
+    datetime.datetime(2023, 12, 4, 10, 0)
+    """
+    rules = [line for line in lines if line.startswith(("RRULE", "EXRULE"))]
+    if len(rules) != 1 or not rules[0].startswith("RRULE:"):
+        return dtstart
+    parts = dict(
+        part.split("=", 1)
+        for part in rules[0][len("RRULE:") :].split(";")
+        if "=" in part
+    )
+    days = {"DAILY": 1, "WEEKLY": 7}.get(parts.get("FREQ", ""))
+    if days is None or "COUNT" in parts or "BYSETPOS" in parts:
+        return dtstart
+    period = datetime.timedelta(days=days * int(parts.get("INTERVAL", 1)))
+    # a period of margin for instances spanning `after`
+    periods = (after - dtstart) // period - 1
+    if periods <= 0:
+        return dtstart
+    return dtstart + periods * period
+
+
+def utc_until(match: re.Match) -> str:
+    date, time, utc = match.groups()
+    if utc:
+        return match.group()
+    return f"UNTIL={date}{time or 'T235959'}Z"
+
+
+def instances(
+    event: Event, start: datetime.datetime, end: datetime.datetime
+) -> Iterator[Event]:
+    """Instances of a series overlapping `[start, end)`"""
+    all_day = not isinstance(event.start, datetime.datetime)
+    if isinstance(event.start, datetime.datetime) and event.start.tzinfo:
+        start = start.replace(tzinfo=datetime.timezone.utc)
+        end = end.replace(tzinfo=datetime.timezone.utc)
+    duration = event.duration
+    try:
+        rules = occurrences(event, after=start - duration)
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError) as e:
+        LOG.warning("Can't expand %s, kept as a single event: %r", event.iCalUID, e)
+        yield event
+        return
+    series_id = event.source_ids[0]
+    uid, _, domain = event.iCalUID.rpartition("@")
+    for occurrence in rules.between(start - duration, end):
+        instance = event.copy()
+        instance.start = occurrence.date() if all_day else occurrence
+        instance.end = instance.start + duration
+        suffix = instance_suffix(instance.start)
+        instance.iCalUID = f"{uid}_{suffix}@{domain}"
+        instance.source_ids = [f"{series_id}_{suffix}"]
+        instance.recurrence = None
+        instance.recurring_id = series_id
+        instance.original_start = instance.start
+        instance.fingerprint = None
+        yield instance
+
+
+def expand(
+    events: Iterable[Event], start: datetime.datetime, end: datetime.datetime
+) -> list[Event]:
+    """Replace series with their instances overlapping the window, sorted by start"""
+    expanded = []
+    for event in events:
+        if event.recurrence:
+            expanded.extend(instances(event, start, end))
+        else:
+            expanded.append(event)
+    expanded.sort(key=event_sort_key)
+    return expanded
+
+
+def end_key(event: Event) -> float:
+    """Sort key of the end of the last instance, infinite for endless series"""
+    if not event.recurrence:
+        return dt_sort_key(event.end)
+    if any(
+        line.startswith("RRULE") and "COUNT=" not in line and "UNTIL=" not in line
+        for line in event.recurrence
+    ):
+        return math.inf
+    try:
+        last = occurrences(event)[-1]
+    except IndexError:
+        return dt_sort_key(event.end)
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError):
+        return math.inf
+    if isinstance(event.start, datetime.datetime):
+        return dt_sort_key(last + event.duration)
+    return dt_sort_key(last.date() + event.duration)
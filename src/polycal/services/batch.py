@@ -0,0 +1,254 @@
+import dataclasses
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from polycal.services.metrics import Metrics
+from polycal.services.ratelimit import RateLimiter
+
+# googleapiclient is slow to import, it's only imported once API calls are made
+if TYPE_CHECKING:
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import HttpRequest
+
+LOG = logging.getLogger(__name__)
+
+# https://developers.google.com/calendar/api/guides/batch
+MAX_BATCH_SIZE = 1000
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+# statuses of operations on events missing from the calendar
+FALLBACK_STATUSES = {404, 410}
+
+
+def error_reasons(error: "HttpError") -> set[str]:
+    details = getattr(error, "error_details", None)
+    if not isinstance(details, list):
+        return set()
+    return {detail.get("reason") for detail in details if isinstance(detail, dict)}
+
+
+def is_rate_limited(error: Exception) -> bool:
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or (
+        status == 403 and bool(error_reasons(error) & RATE_LIMIT_REASONS)
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(error, HttpError):
+        return isinstance(error, OSError)
+    return error.resp.status in RETRYABLE_STATUSES or is_rate_limited(error)
+
+
+@dataclasses.dataclass
+class OperationResult:
+    operation: str
+    uid: str
+    event_id: Optional[str] = None
+    attempts: int = 0
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.attempts > 0 and self.error is None
+
+
+@dataclasses.dataclass
+class Operation:
+    result: OperationResult
+    request: Callable[[], "HttpRequest"]
+    # errors which mean the operation is already done, e.g. 410 for delete
+    ok_statuses: frozenset[int] = frozenset()
+    # operation retried in place of this one if its event is missing, e.g.
+    # import of a patched event, its result replaces the result of this one
+    fallback: Optional["Operation"] = None
+
+
+@dataclasses.dataclass
+class SyncReport:
+    results: list[OperationResult] = dataclasses.field(default_factory=list)
+
+    @property
+    def failed(self) -> list[OperationResult]:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def retried(self) -> list[OperationResult]:
+        return [result for result in self.results if result.attempts > 1]
+
+    def count(self, operation: str) -> int:
+        return sum(
+            1 for result in self.results if result.ok and result.operation == operation
+        )
+
+    def summary(self) -> str:
+        counts = {
+            operation: self.count(operation)
+            for operation in sorted({result.operation for result in self.results})
+        }
+        return ", ".join(
+            [f"{count} {operation}" for operation, count in counts.items()]
+            + [f"{len(self.retried)} retried", f"{len(self.failed)} failed"]
+        )
+
+
+class BatchSyncError(Exception):
+    def __init__(self, report: SyncReport):
+        super().__init__(
+            f"{len(report.failed)} of {len(report.results)} operations failed",
+            [(result.uid, result.error) for result in report.failed[:10]],
+        )
+        self.report = report
+
+
+class BatchWriter:
+    """
+    Execute operations in batch requests of at most `chunk_size` operations
+
+    Chunks may be sent in parallel, each worker uses its own http object from
+    `http_factory`. Sub-requests which failed with rate limit or server errors
+    are retried with exponential backoff, other errors are recorded in the
+    report without interrupting remaining operations. With `limiter`, every
+    operation counts as an API call and rate limit errors slow it down.
+    """
+
+    def __init__(
+        self,
+        new_batch: Callable[[], Any],
+        http_factory: Callable[[], Any],
+        chunk_size: int = 50,
+        concurrency: int = 1,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        metrics: Optional[Metrics] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.new_batch = new_batch
+        self.http_factory = http_factory
+        self.chunk_size = min(chunk_size, MAX_BATCH_SIZE)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.limiter = limiter
+
+    def execute(self, operations: list[Operation]) -> SyncReport:
+        chunks = [
+            operations[i : i + self.chunk_size]
+            for i in range(0, len(operations), self.chunk_size)
+        ]
+        if self.concurrency <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                self.execute_chunk(chunk)
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.concurrency, len(chunks)),
+                thread_name_prefix="polycal-batch",
+            ) as executor:
+                list(executor.map(self.execute_chunk, chunks))
+        return SyncReport(results=[operation.result for operation in operations])
+
+    def execute_chunk(self, chunk: list[Operation]) -> None:
+        http = self.http_factory()
+        pending = chunk
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1) * (1 + random.random())
+                LOG.info(
+                    "Retrying %d operations in %.1fs (attempt %d)",
+                    len(pending),
+                    delay,
+                    attempt + 1,
+                )
+                time.sleep(delay)
+            pending = self.execute_batch(
+                pending, http, last_attempt=attempt == self.max_retries
+            )
+            if not pending:
+                break
+
+    def execute_batch(
+        self, operations: list[Operation], http: Any, last_attempt: bool
+    ) -> list[Operation]:
+        """Execute single batch request, returns operations to retry"""
+        from googleapiclient.errors import HttpError
+
+        retry = []
+        rate_limited = False
+
+        def callback(request_id: str, response: Any, exception: Optional[Exception]):
+            nonlocal rate_limited
+            operation = operations[int(request_id)]
+            result = operation.result
+            result.attempts += 1
+            result.error = None
+            if exception is None:
+                if isinstance(response, dict):
+                    result.event_id = response.get("id", result.event_id)
+            elif (
+                isinstance(exception, HttpError)
+                and exception.resp.status in operation.ok_statuses
+            ):
+                pass
+            elif (
+                isinstance(exception, HttpError)
+                and exception.resp.status in FALLBACK_STATUSES
+                and operation.fallback is not None
+                and not last_attempt
+            ):
+                LOG.info(
+                    "Event %s is missing, falling back from %s to %s",
+                    result.uid,
+                    result.operation,
+                    operation.fallback.result.operation,
+                )
+                operation.result = operation.fallback.result
+                retry.append(operation.fallback)
+            elif is_retryable(exception) and not last_attempt:
+                result.error = exception
+                retry.append(operation)
+            else:
+                result.error = exception
+            if exception is not None and is_rate_limited(exception):
+                rate_limited = True
+
+        batch = self.new_batch()
+        for request_id, operation in enumerate(operations):
+            batch.add(
+                operation.request(), callback=callback, request_id=str(request_id)
+            )
+        if self.metrics is not None:
+            self.metrics.inc("api_batch_requests_total")
+            self.metrics.inc("api_batched_calls_total", len(operations))
+        try:
+            if self.limiter is None:
+                batch.execute(http=http)
+            else:
+                self.limiter.acquire(len(operations))
+                with self.limiter.slot():
+                    batch.execute(http=http)
+        except (HttpError, OSError) as e:
+            rate_limited = is_rate_limited(e)
+            if last_attempt or not is_retryable(e):
+                for operation in operations:
+                    operation.result.attempts += 1
+                    operation.result.error = e
+                retry = []
+            else:
+                LOG.warning("Batch request failed: %r", e)
+                retry = operations
+        if rate_limited and self.limiter is not None:
+            self.limiter.throttled()
+        if retry and self.metrics is not None:
+            self.metrics.inc("write_retries_total", len(retry))
+        return retry
@@ -1,16 +1,54 @@
-import base64
+import collections
 import datetime
 import hashlib
+import heapq
+import importlib.util
 import itertools
 import json
+import logging
+import pathlib
+import threading
 import time
-from typing import Generator, Iterable, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Literal,
+    Optional,
+    TypeVar,
+    Union,
+)
 
 import pydantic
+from dateutil import relativedelta
 
-from polycal.services.gcal import GoogleCalendarEvent, GoogleCalendarService
-from polycal.transforms import TRANSFORMERS
-from polycal.types import Event
+from polycal import recurrence
+from polycal.pipeline import Pipeline
+from polycal.services.batch import MAX_BATCH_SIZE, BatchSyncError, SyncReport
+from polycal.services.gcal import (
+    CalendarChanges,
+    EventPatch,
+    GoogleCalendarService,
+    SyncTokenExpired,
+)
+from polycal.services.ics import IcsCalendarService
+from polycal.services.metrics import Metrics, profiled
+from polycal.services.ratelimit import RateLimiter
+from polycal.services.syncstate import SyncStateModel, SyncStateStore
+from polycal.services.targetindex import IndexedEvent, TargetIndex
+from polycal.services.transformcache import CACHE_VERSION, TransformCache
+from polycal.services.transformpool import TransformPool
+from polycal.transforms import FILTERS, TRANSFORMERS, interpret_human_timedelta
+from polycal.types import Event, dt_sort_key, event_sort_key
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# backends of sources other than Google calendars by type, built from their path
+SOURCE_BACKENDS = {"ics": IcsCalendarService}
 
 
 class BaseModel(pydantic.BaseModel):
@@ -32,79 +70,1156 @@ class TransformModel(BaseModel):
 class SourceModel(BaseModel):
     id: str
     name: Optional[str]
+    # Google calendar, or one of `SOURCE_BACKENDS`
+    type: Literal["google", "ics"] = "google"
+    # file of non-Google sources
+    path: Optional[str] = None
     transforms: list[TransformModel] = []
 
+    @pydantic.root_validator(skip_on_failure=True)
+    def check_path(cls, values):
+        if values["type"] != "google" and not values["path"]:
+            raise ValueError(f"path of {values['type']} source is required")
+        return values
+
 
 class TargetModel(BaseModel):
     id: str
     name: str
+    index: bool = False
+    reconcile_interval: str = "1d"
+    # ids of sources synced to the target, all sources by default
+    sources: Optional[list[str]] = None
+    # applied to events of all target sources, after transforms of the source
+    transforms: list[TransformModel] = []
+
+
+class BatchModel(BaseModel):
+    chunk_size: pydantic.conint(ge=1, le=MAX_BATCH_SIZE) = 50
+    concurrency: pydantic.conint(ge=1) = 1
+    max_retries: pydantic.conint(ge=0) = 5
+    backoff: pydantic.confloat(ge=0) = 1.0
+
+
+class HttpModel(BaseModel):
+    # connections to Google APIs kept open, shared by all fetch and batch threads
+    pool_size: pydantic.conint(ge=1) = 10
+    connect_timeout: pydantic.confloat(gt=0) = 10.0
+    read_timeout: pydantic.confloat(gt=0) = 60.0
+    keep_alive: bool = True
+
+
+class RateLimitModel(BaseModel):
+    # API calls per second, every call of a batch counts; unlimited if not set,
+    # until rate limit errors slow it down
+    rate: Optional[pydantic.confloat(gt=0)] = None
+    burst: pydantic.conint(ge=1) = 20
+    min_rate: pydantic.confloat(gt=0) = 1.0
+    # seconds without rate limit errors before rate and concurrency go up a step
+    recovery: pydantic.confloat(gt=0) = 10.0
+    # retries of rate limited reads, writes are retried as per `batch`
+    max_retries: pydantic.conint(ge=0) = 5
+
+
+class ServeModel(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = 8080
+    path: str = "/notifications"
+    # public address of the receiver, push notifications are disabled without it
+    webhook_url: Optional[str] = None
+    channel_ttl: str = "7d"
+    # sync once no more notifications arrive for `debounce`, or `max_debounce`
+    # after the first one at the latest
+    debounce: str = "10s"
+    max_debounce: str = "1m"
+    poll_interval: str = "15m"
+
+
+class WindowModel(BaseModel):
+    # horizons relative to the current day, from the beginning of the current
+    # month to three months ahead if neither is set
+    past: Optional[str] = None
+    future: Optional[str] = None
+    # sync the window in "day" or "week" segments, skipping recently synced ones
+    segment: Optional[Literal["day", "week"]] = None
+    # segments starting sooner than `near` are synced on every run, the rest
+    # only once their last sync is older than `max_age`
+    near: str = "7d"
+    max_age: str = "1h"
+
+
+class TransformCacheModel(BaseModel):
+    # reuse transformed events of sources whose listing didn't change since the
+    # last run, kept in transform_cache.sqlite next to the config
+    enabled: bool = False
+    # bytes of cached events, least recently used ones are evicted beyond it
+    max_size: pydantic.conint(ge=1) = 256 * 2**20
+
+
+class TransformPoolModel(BaseModel):
+    # run transforms of every source in a worker process, in parallel with
+    # other sources, instead of one source after another in the main process
+    enabled: bool = False
+    # worker processes, one per CPU by default
+    processes: Optional[pydantic.conint(ge=1)] = None
+
+
+class MetricsModel(BaseModel):
+    # Prometheus textfile, or JSON if the name ends with .json
+    path: Optional[str] = None
+    # cProfile stats of the main thread
+    profile: Optional[str] = None
 
 
 class ConfigModel(BaseModel):
     sources: list[SourceModel]
-    target: TargetModel
+    # single target, shorthand for `targets` with one item
+    target: Optional[TargetModel] = None
+    targets: list[TargetModel] = []
     user_agent: str = "polycal"
+    incremental: bool = False
+    fetch_concurrency: pydantic.conint(ge=1) = 1
+    batch: BatchModel = BatchModel()
+    http: HttpModel = HttpModel()
+    rate_limit: RateLimitModel = RateLimitModel()
+    serve: ServeModel = ServeModel()
+    metrics: MetricsModel = MetricsModel()
+    window: WindowModel = WindowModel()
+    transform_cache: TransformCacheModel = TransformCacheModel()
+    transform_pool: TransformPoolModel = TransformPoolModel()
+    # fetch and write recurring events as single "instances", or as "series"
+    # (rules plus exceptions), expanded only for stateful transforms
+    recurring: Literal["instances", "series"] = "instances"
+    # run vectorizable transforms on NumPy arrays of batches of events, needs
+    # numpy installed (`polycal[numpy]`)
+    columnar: bool = False
+
+    @pydantic.root_validator(skip_on_failure=True)
+    def check_targets(cls, values):
+        target, targets = values["target"], values["targets"]
+        if target and targets:
+            raise ValueError("target and targets are mutually exclusive")
+        if target:
+            values["targets"] = targets = [target]
+        if not targets:
+            raise ValueError("no target configured")
+        target_ids = [target.id for target in targets]
+        if len(set(target_ids)) != len(target_ids):
+            raise ValueError("duplicate target ids")
+        source_ids = {source.id for source in values["sources"]}
+        for target in targets:
+            unknown = set(target.sources or []) - source_ids
+            if unknown:
+                raise ValueError(f"unknown sources of {target.id}: {sorted(unknown)}")
+        return values
+
+    @pydantic.root_validator(skip_on_failure=True)
+    def check_recurring(cls, values):
+        # series are timed by their first instance, which can precede the
+        # segment they have instances in
+        if values["recurring"] == "series" and values["window"].segment:
+            raise ValueError("window segments can't be used with recurring series")
+        return values
+
+    @pydantic.root_validator(skip_on_failure=True)
+    def check_incremental(cls, values):
+        # sync tokens are only valid for the window they were issued for, which
+        # moves every day with `past`/`future` horizons, and incremental sync
+        # of the whole window would bypass segments anyway
+        if values["incremental"] and values["window"].segment:
+            raise ValueError("window segments can't be used with incremental sync")
+        return values
+
+    @pydantic.validator("columnar")
+    def check_columnar(cls, columnar):
+        if columnar and importlib.util.find_spec("numpy") is None:
+            raise ValueError("columnar transforms need numpy, install polycal[numpy]")
+        return columnar
 
 
 class CalendarProcessor:
-    def __init__(self, config: ConfigModel, gcal_service: GoogleCalendarService):
+    def __init__(
+        self,
+        config: ConfigModel,
+        gcal_service: GoogleCalendarService,
+        sync_state: Optional[SyncStateStore] = None,
+        gcal_service_factory: Optional[Callable[[], GoogleCalendarService]] = None,
+        target_index: Optional[TargetIndex] = None,
+        metrics: Optional[Metrics] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        transform_cache: Optional[TransformCache] = None,
+        transform_pool: Optional[TransformPool] = None,
+    ):
         self.config = config
         self.gcal_service = gcal_service
+        self.sync_state = sync_state
+        self.gcal_service_factory = gcal_service_factory
+        self.target_index = target_index
+        self.metrics = metrics or Metrics()
+        self.rate_limiter = rate_limiter
+        self.transform_cache = transform_cache
+        self.transform_pool = transform_pool
+
+    def process(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        calendar_ids: Optional[set[str]] = None,
+    ):
+        """
+        Sync events of source calendars within `[start, end)` window to targets
+
+        :param calendar_ids: source calendars known to be changed, the rest is
+            assumed unchanged; only honoured by incremental sync
+        """
+        profile = self.config.metrics.profile
+        started = time.perf_counter()
+        usage = self.rate_limiter.usage() if self.rate_limiter else None
+        success = False
+        try:
+            with profiled(pathlib.Path(profile).expanduser() if profile else None):
+                if self.config.incremental and self.sync_state:
+                    self.process_incremental(start, end, calendar_ids)
+                else:
+                    self.process_full(start, end)
+            success = True
+        finally:
+            self.record_run(time.perf_counter() - started, success)
+            if usage is not None:
+                LOG.info("Quota usage: %s", self.rate_limiter.summary(since=usage))
+
+    def close(self) -> None:
+        """Stop worker processes of the transform pool, if any were started"""
+        if self.transform_pool is not None:
+            self.transform_pool.shutdown()
+
+    def record_run(self, seconds: float, success: bool) -> None:
+        """Record run metrics and export them if configured"""
+        self.metrics.inc("runs_total", status="success" if success else "failure")
+        self.metrics.inc("run_seconds_total", seconds)
+        self.metrics.set("last_run_seconds", seconds)
+        self.metrics.set("last_run_timestamp_seconds", time.time())
+        self.metrics.set("last_run_success", int(success))
+        if self.config.metrics.path:
+            path = pathlib.Path(self.config.metrics.path).expanduser()
+            try:
+                self.metrics.write(path)
+            except OSError as e:
+                LOG.warning("Can't write metrics to %s: %r", path, e)
+
+    @property
+    def timed_transforms(self) -> bool:
+        """Time every transform, only worth its overhead if metrics are exported"""
+        return bool(self.config.metrics.path)
 
-    def process(self, start: datetime.datetime, end: datetime.datetime):
-        events = itertools.chain.from_iterable(
-            self.process_source(source, start=start, end=end)
+    def record_pipeline(self, pipeline: Pipeline, **labels: str) -> None:
+        for transform, stats in pipeline.stats.items():
+            self.metrics.inc(
+                "transform_seconds_total", stats.seconds, transform=transform, **labels
+            )
+            for direction, count in [
+                ("in", stats.events_in),
+                ("out", stats.events_out),
+            ]:
+                self.metrics.inc(
+                    "transform_events_total",
+                    count,
+                    transform=transform,
+                    direction=direction,
+                    **labels,
+                )
+
+    @property
+    def used_sources(self) -> list[SourceModel]:
+        """Sources synced to at least one target"""
+        source_ids = set()
+        for target in self.config.targets:
+            source_ids.update(target.sources or [])
+            if target.sources is None:
+                return self.config.sources
+        return [source for source in self.config.sources if source.id in source_ids]
+
+    def target_sources(self, target: TargetModel) -> list[SourceModel]:
+        return [
+            source
             for source in self.config.sources
+            if target.sources is None or source.id in target.sources
+        ]
+
+    @property
+    def series(self) -> bool:
+        """Whether recurring events are synced as series, see `polycal.recurrence`"""
+        return self.config.recurring == "series"
+
+    @property
+    def shared_events(self) -> bool:
+        """Whether source events are passed to multiple target pipelines"""
+        return len(self.config.targets) > 1
+
+    def source_pipelines(self, source: SourceModel) -> list[Pipeline]:
+        """Pipelines of the source and of all targets it's synced to"""
+        return [self.get_pipeline(source.transforms)] + [
+            self.get_pipeline(target.transforms)
+            for target in self.config.targets
+            if target.sources is None or source.id in target.sources
+        ]
+
+    def keep_src(self, source: SourceModel) -> bool:
+        return any(pipeline.uses_src for pipeline in self.source_pipelines(source))
+
+    def keep_attendees(self, source: SourceModel) -> bool:
+        return any(
+            pipeline.uses_attendees for pipeline in self.source_pipelines(source)
         )
-        self.sync_to_target(events, start, end)
 
-    def process_source(
-        self, source: SourceModel, start: datetime.datetime, end: datetime.datetime
-    ) -> Generator[GoogleCalendarEvent, None, None]:
-        transforms = [
-            TRANSFORMERS[transform_config.type](**(transform_config.kwargs or {}))
-            for transform_config in source.transforms
+    def window(
+        self, now: datetime.datetime
+    ) -> tuple[datetime.datetime, datetime.datetime]:
+        """Sync window as configured, see `WindowModel`"""
+        window = self.config.window
+        if window.past is None and window.future is None:
+            return default_window(now)
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return (
+            today - interpret_human_timedelta(window.past or "0d"),
+            today + interpret_human_timedelta(window.future or "90d"),
+        )
+
+    def config_hash(self) -> str:
+        return hashlib.blake2s(
+            self.config.json(include={"sources", "targets"}).encode("utf-8")
+        ).hexdigest()
+
+    @property
+    def use_transform_cache(self) -> bool:
+        return self.transform_cache is not None and self.config.transform_cache.enabled
+
+    @property
+    def use_transform_pool(self) -> bool:
+        return self.transform_pool is not None and self.config.transform_pool.enabled
+
+    def source_config_hash(self, source: SourceModel) -> str:
+        return hashlib.blake2s(
+            source.json(include={"type", "path", "transforms"}).encode("utf-8")
+        ).hexdigest()
+
+    def transform_cache_key(
+        self,
+        source: SourceModel,
+        fingerprint: Optional[str],
+        start: datetime.datetime,
+        end: datetime.datetime,
+        fetch_kwargs: dict[str, bool],
+    ) -> Optional[str]:
+        """Key of transformed events of a source listing, None if uncacheable"""
+        if fingerprint is None:
+            return None
+        key = [
+            CACHE_VERSION,
+            source.id,
+            fingerprint,
+            self.source_config_hash(source),
+            start.isoformat(),
+            end.isoformat(),
+            self.series,
+            fetch_kwargs,
         ]
-        events = self.gcal_service.list_events(
-            calendar_id=source.id, start=start, end=end
+        return hashlib.blake2s(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def process_full(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_tokens: Optional[dict[str, Optional[str]]] = None,
+    ):
+        if sync_tokens is None and self.config.window.segment and self.sync_state:
+            self.process_segments(start, end)
+        else:
+            self.process_range(start, end, sync_tokens=sync_tokens)
+
+    def process_segments(self, start: datetime.datetime, end: datetime.datetime):
+        """
+        Sync only segments of the window which are new or stale
+
+        Consecutive stale segments are synced together. Segments which moved
+        out of the window are forgotten, their events are left in the target.
+        Everything is synced again whenever sources or targets config changes,
+        or when a target index is due for reconciliation.
+        """
+        window = self.config.window
+        state = self.sync_state.load()
+        now = time.time()
+        near = dt_sort_key(
+            datetime.datetime.utcnow() + interpret_human_timedelta(window.near)
+        )
+        max_age = interpret_human_timedelta(window.max_age).total_seconds()
+        synced = state.segments if state.config_hash == self.config_hash() else {}
+        sync_all = any(
+            self.use_target_index(target)
+            and self.target_needs_reconciliation(target, start, end)
+            for target in self.config.targets
+        )
+        boundaries = segment_boundaries(start, end, weeks=window.segment == "week")
+        keys = [segment_start.isoformat() for segment_start in boundaries[:-1]]
+        stale = [
+            sync_all
+            or key not in synced
+            or dt_sort_key(segment_start) < near
+            or now - synced[key] > max_age
+            for key, segment_start in zip(keys, boundaries)
+        ]
+        self.metrics.inc("window_segments_total", sum(stale), state="stale")
+        self.metrics.inc(
+            "window_segments_total", len(stale) - sum(stale), state="fresh"
         )
-        for transform in transforms:
-            events = transform.process(events)
-        yield from events
+        LOG.info("Syncing %d of %d window segments", sum(stale), len(stale))
 
-    def sync_to_target(
+        segments = {key: synced[key] for key in keys if key in synced}
+        index = 0
+        for is_stale, group in itertools.groupby(stale):
+            count = len(list(group))
+            if is_stale:
+                self.process_range(
+                    boundaries[index],
+                    boundaries[index + count],
+                    owned_from=boundaries[index] if index else None,
+                )
+                segments.update((key, now) for key in keys[index : index + count])
+                self.save_sync_state(segments=segments, config_hash=self.config_hash())
+            index += count
+        self.save_sync_state(segments=segments, config_hash=self.config_hash())
+
+    def process_range(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_tokens: Optional[dict[str, Optional[str]]] = None,
+        owned_from: Optional[datetime.datetime] = None,
+    ):
+        """
+        Fetch every used source once and sync all targets
+
+        With a single target, events are streamed from sources to the target.
+        Otherwise events of each source are kept in memory and shared by the
+        target pipelines, which copy events only when they modify them.
+
+        :param owned_from: only sync events starting at or after it, earlier
+            ones belong to the preceding range
+        """
+        sources = self.used_sources
+        source_events = self.process_sources(
+            sources, start=start, end=end, sync_tokens=sync_tokens
+        )
+        if not self.shared_events:
+            (target,) = self.config.targets
+            self.sync_to_target(
+                target,
+                self.target_events(target, list(source_events), start, end),
+                start,
+                end,
+                owned_from=owned_from,
+            )
+            return
+
+        events_by_source = {
+            source.id: list(events) for source, events in zip(sources, source_events)
+        }
+        errors = []
+        for target in self.config.targets:
+            events = self.target_events(
+                target,
+                [events_by_source[source.id] for source in self.target_sources(target)],
+                start,
+                end,
+            )
+            try:
+                self.sync_to_target(target, events, start, end, owned_from=owned_from)
+            except BatchSyncError as e:
+                LOG.error("Sync of %s failed: %r", target.id, e)
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def target_events(
+        self,
+        target: TargetModel,
+        source_events: list[Iterable[Event]],
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> Iterable[Event]:
+        """
+        Events of target sources passed through target transforms
+
+        Stateful target transforms get events of all sources merged by start time,
+        with recurring series expanded into instances.
+        """
+        if not target.transforms:
+            return itertools.chain.from_iterable(source_events)
+        pipeline = self.get_pipeline(target.transforms, shared=self.shared_events)
+        if pipeline.stateful:
+            if self.series:
+                source_events = [
+                    recurrence.expand(events, start, end) for events in source_events
+                ]
+            events = heapq.merge(*source_events, key=event_sort_key)
+        else:
+            events = itertools.chain.from_iterable(source_events)
+
+        def process() -> Generator[Event, None, None]:
+            yield from pipeline.process(events)
+            self.record_pipeline(pipeline, target=target.id)
+
+        return process()
+
+    def process_incremental(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        calendar_ids: Optional[set[str]] = None,
+    ):
+        """
+        Sync only events changed since the last run
+
+        Falls back to full sync whenever stored sync tokens can't be used: on the
+        first run, when the window moved or when Google expired the tokens. Full
+        sync is also done when a target index is due for reconciliation.
+        Stateful transforms (e.g. `Merge`) of sources or targets need to see
+        whole window to be processed correctly, so they always force full sync.
+        """
+        sources = self.used_sources
+        stateful = [
+            source.id
+            for source in sources
+            if self.get_pipeline(source.transforms).stateful
+        ] + [
+            target.id
+            for target in self.config.targets
+            if self.get_pipeline(target.transforms).stateful
+        ]
+        if stateful:
+            LOG.warning(
+                "Incremental sync unavailable due to stateful transforms in %r",
+                stateful,
+            )
+            self.process_full(start, end)
+            return
+        if self.series:
+            LOG.warning("Incremental sync unavailable for recurring series")
+            self.process_full(start, end)
+            return
+
+        state = self.sync_state.load()
+        if (
+            (state.start, state.end) == (start, end)
+            and all(source.id in state.sync_tokens for source in sources)
+            and not any(
+                self.use_target_index(target)
+                and self.target_needs_reconciliation(target, start, end)
+                for target in self.config.targets
+            )
+        ):
+            try:
+                self.process_changes(start, end, state, calendar_ids)
+                return
+            except SyncTokenExpired as e:
+                LOG.warning("Sync token for %s expired, doing full sync", e)
+
+        sync_tokens = {}
+        self.process_full(start, end, sync_tokens=sync_tokens)
+        self.save_sync_state(start=start, end=end, sync_tokens=sync_tokens)
+
+    def process_changes(
         self,
-        events: Generator[Event, None, None],
         start: datetime.datetime,
         end: datetime.datetime,
+        state: SyncStateModel,
+        calendar_ids: Optional[set[str]] = None,
     ) -> None:
-        events_to_remove = {
-            event.iCalUID: event
+        sources = [
+            source
+            for source in self.used_sources
+            if calendar_ids is None or source.id in calendar_ids
+        ]
+
+        def fetch_changes(
+            source: SourceModel, gcal_service: GoogleCalendarService
+        ) -> tuple[CalendarChanges, list[Event]]:
+            pipeline = self.get_pipeline(source.transforms)
+            service = self.source_service(source, gcal_service)
+            with self.metrics.timer("source_fetch_seconds_total", source=source.id):
+                changes = service.list_events_changes(
+                    calendar_id=source.id,
+                    start=start,
+                    end=end,
+                    sync_token=state.sync_tokens[source.id],
+                    keep_src=self.keep_src(source),
+                    attendees=self.keep_attendees(source),
+                )
+            self.metrics.inc(
+                "source_fetched_events_total", len(changes.events), source=source.id
+            )
+            changed_uids = {event.iCalUID for event in changes.events}
+            events = list(pipeline.process(changes.events))
+            self.record_pipeline(pipeline, source=source.id)
+            self.metrics.inc("source_events_total", len(events), source=source.id)
+            # events dropped by transforms might have been synced before
+            changes.removed_uids.update(
+                changed_uids - {event.iCalUID for event in events}
+            )
+            return changes, events
+
+        sync_tokens = dict(state.sync_tokens)
+        changes_by_source = {}
+        for source, (changes, events) in zip(
+            sources, self.map_sources(fetch_changes, sources)
+        ):
+            sync_tokens[source.id] = changes.sync_token
+            changes_by_source[source.id] = (events, changes.removed_uids)
+
+        errors = []
+        for target in self.config.targets:
+            target_changes = [
+                changes_by_source[source.id]
+                for source in self.target_sources(target)
+                if source.id in changes_by_source
+            ]
+            source_events = [events for events, _ in target_changes]
+            updated_events = list(self.target_events(target, source_events, start, end))
+            removed_uids = set().union(
+                *(removed_uids for _, removed_uids in target_changes)
+            )
+            # events dropped by target transforms might have been synced before
+            removed_uids.update(
+                event.iCalUID for events in source_events for event in events
+            )
+            removed_uids -= {event.iCalUID for event in updated_events}
+
+            LOG.info(
+                "Incremental sync of %s: %d updated, %d removed events",
+                target.id,
+                len(updated_events),
+                len(removed_uids),
+            )
+            if not (updated_events or removed_uids):
+                continue
+            try:
+                self.sync_changes_to_target(target, updated_events, removed_uids)
+            except BatchSyncError as e:
+                LOG.error("Sync of %s failed: %r", target.id, e)
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        self.save_sync_state(start=start, end=end, sync_tokens=sync_tokens)
+
+    def save_sync_state(
+        self, sync_tokens: Optional[dict[str, Optional[str]]] = None, **state
+    ) -> None:
+        """Update fields of the stored sync state"""
+        if sync_tokens is not None:
+            state["sync_tokens"] = {
+                calendar_id: token
+                for calendar_id, token in sync_tokens.items()
+                if token
+            }
+        self.sync_state.save(self.sync_state.load().copy(update=state))
+
+    def get_pipeline(
+        self, transforms: list[TransformModel], shared: bool = False
+    ) -> Pipeline:
+        return Pipeline(
+            [
+                (
+                    TRANSFORMERS[transform_config.type](
+                        **(transform_config.kwargs or {})
+                    ),
+                    [
+                        FILTERS[filter_config.type](**(filter_config.kwargs or {}))
+                        for filter_config in transform_config.filters
+                    ],
+                )
+                for transform_config in transforms
+            ],
+            timed=self.timed_transforms,
+            columnar=self.config.columnar,
+            shared=shared,
+        )
+
+    def map_sources(
+        self,
+        func: Callable[[SourceModel, GoogleCalendarService], T],
+        sources: list[SourceModel],
+    ) -> Iterator[T]:
+        """
+        Call `func` for every source, concurrently if `fetch_concurrency` allows
+
+        Results are yielded in order of `sources` regardless of which source was
+        fetched first. Every worker thread gets its own `GoogleCalendarService`,
+        their requests still share the connection pool of the transport.
+        """
+        max_workers = min(self.config.fetch_concurrency, len(sources))
+        if max_workers <= 1 or not self.gcal_service_factory:
+            for source in sources:
+                yield func(source, self.gcal_service)
+            return
+
+        local = threading.local()
+
+        def worker(source: SourceModel) -> T:
+            if not hasattr(local, "gcal_service"):
+                local.gcal_service = self.gcal_service_factory()
+            return func(source, local.gcal_service)
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="polycal-fetch"
+        ) as executor:
+            yield from executor.map(worker, sources)
+
+    def source_service(
+        self, source: SourceModel, gcal_service: GoogleCalendarService
+    ) -> Union[GoogleCalendarService, IcsCalendarService]:
+        """Backend listing events of `source`, `gcal_service` for Google calendars"""
+        if source.type == "google":
+            return gcal_service
+        return SOURCE_BACKENDS[source.type](source.path)
+
+    def process_sources(
+        self,
+        sources: list[SourceModel],
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_tokens: Optional[dict[str, Optional[str]]] = None,
+    ) -> Iterator[Iterable[Event]]:
+        if self.use_transform_pool:
+            # every source is fetched and handed over to the pool before waiting
+            # for any results, so that sources are transformed in parallel
+            transformed = list(
+                self.map_sources(
+                    lambda source, gcal_service: self.fetch_source(
+                        source,
+                        start=start,
+                        end=end,
+                        sync_tokens=sync_tokens,
+                        gcal_service=gcal_service,
+                    ),
+                    sources,
+                )
+            )
+            return (result() for result in transformed)
+
+        concurrent = self.config.fetch_concurrency > 1
+
+        def fetch(
+            source: SourceModel, gcal_service: GoogleCalendarService
+        ) -> Iterable[Event]:
+            events = self.process_source(
+                source,
+                start=start,
+                end=end,
+                sync_tokens=sync_tokens,
+                gcal_service=gcal_service,
+            )
+            # make sure worker threads do the fetching
+            return list(events) if concurrent else events
+
+        return self.map_sources(fetch, sources)
+
+    def process_source(
+        self,
+        source: SourceModel,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_tokens: Optional[dict[str, Optional[str]]] = None,
+        gcal_service: Optional[GoogleCalendarService] = None,
+    ) -> Generator[Event, None, None]:
+        yield from self.fetch_source(
+            source,
+            start=start,
+            end=end,
+            sync_tokens=sync_tokens,
+            gcal_service=gcal_service,
+        )()
+
+    def fetch_source(
+        self,
+        source: SourceModel,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_tokens: Optional[dict[str, Optional[str]]] = None,
+        gcal_service: Optional[GoogleCalendarService] = None,
+    ) -> Callable[[], Iterable[Event]]:
+        """
+        Fetch events of `source`, returning a function which transforms them
+
+        Events are streamed from the source through its transforms once the
+        result of the function is iterated, unless the transform pool or cache
+        is used. Then events are fetched in full right away and the pool starts
+        transforming them, the function waits for the results.
+        """
+        gcal_service = self.source_service(source, gcal_service or self.gcal_service)
+        pipeline = self.get_pipeline(source.transforms)
+        fetch_kwargs = {
+            "keep_src": self.keep_src(source),
+            "attendees": self.keep_attendees(source),
+        }
+        labels = {"source": source.id}
+        cache_key = None
+        if sync_tokens is None:
+            if self.use_transform_cache:
+                with self.metrics.timer("source_fetch_seconds_total", **labels):
+                    fetched = gcal_service.fetch_events(
+                        calendar_id=source.id,
+                        start=start,
+                        end=end,
+                        series=self.series,
+                        **fetch_kwargs,
+                    )
+                cache_key = self.transform_cache_key(
+                    source, fetched.fingerprint, start, end, fetch_kwargs
+                )
+                cached = cache_key and self.transform_cache.get(cache_key)
+                if cached is not None:
+                    # neither parsed nor transformed
+                    self.metrics.inc("transform_cache_total", result="hit", **labels)
+                    self.metrics.inc("source_events_total", len(cached), **labels)
+                    return lambda: cached
+                self.metrics.inc("transform_cache_total", result="miss", **labels)
+                listed = fetched.parse()
+            else:
+                listed = gcal_service.list_events(
+                    calendar_id=source.id,
+                    start=start,
+                    end=end,
+                    series=self.series,
+                    **fetch_kwargs,
+                )
+            events = self.metrics.timed(
+                listed,
+                "source_fetch_seconds_total",
+                "source_fetched_events_total",
+                **labels,
+            )
+            if self.series:
+                events = recurrence.bound(
+                    recurrence.fold_exceptions(events), start, end
+                )
+                if pipeline.stateful:
+                    events = recurrence.expand(events, start, end)
+        else:
+            with self.metrics.timer("source_fetch_seconds_total", **labels):
+                changes = gcal_service.list_events_changes(
+                    calendar_id=source.id, start=start, end=end, **fetch_kwargs
+                )
+            self.metrics.inc(
+                "source_fetched_events_total", len(changes.events), **labels
+            )
+            sync_tokens[source.id] = changes.sync_token
+            events = sorted(changes.events, key=event_sort_key)
+        events = with_calendar_id(events, source.id)
+
+        if self.use_transform_pool and pipeline.stages:
+            # attendees are only used by transforms, they are dropped unless
+            # some transform of the source or its targets needs them
+            transform = self.transform_pool.process(
+                pipeline, events, attendees=fetch_kwargs["attendees"]
+            )
+        elif cache_key is None:
+
+            def stream() -> Generator[Event, None, None]:
+                count = 0
+                for event in pipeline.process(events):
+                    count += 1
+                    yield event
+                self.record_pipeline(pipeline, **labels)
+                self.metrics.inc("source_events_total", count, **labels)
+
+            return stream
+        else:
+
+            def transform() -> list[Event]:
+                return list(pipeline.process(events))
+
+        def collect() -> list[Event]:
+            transformed = transform()
+            if cache_key is not None:
+                # stored before anything downstream gets to modify the events
+                self.transform_cache.put(
+                    cache_key, source.id, self.source_config_hash(source), transformed
+                )
+            self.record_pipeline(pipeline, **labels)
+            self.metrics.inc("source_events_total", len(transformed), **labels)
+            return transformed
+
+        return collect
+
+    def use_target_index(self, target: TargetModel) -> bool:
+        return self.target_index is not None and target.index
+
+    def target_needs_reconciliation(
+        self, target: TargetModel, start: datetime.datetime, end: datetime.datetime
+    ) -> bool:
+        if not self.use_target_index(target):
+            return True
+        return self.target_index.needs_reconciliation(
+            target.id,
+            start,
+            end,
+            max_age=interpret_human_timedelta(target.reconcile_interval),
+        )
+
+    def get_target_events(
+        self, target: TargetModel, start: datetime.datetime, end: datetime.datetime
+    ) -> dict[str, IndexedEvent]:
+        """
+        Target events in the window by iCalUID
+
+        Target calendar is listed only if the local index is disabled or due for
+        reconciliation.
+        """
+        with self.metrics.timer(
+            "stage_seconds_total", stage="target_listing", target=target.id
+        ):
+            return self._get_target_events(target, start, end)
+
+    def _get_target_events(
+        self, target: TargetModel, start: datetime.datetime, end: datetime.datetime
+    ) -> dict[str, IndexedEvent]:
+        target_id = target.id
+        if not self.target_needs_reconciliation(target, start, end):
+            return self.target_index.events(target_id, start, end)
+
+        target_events = {
+            event.iCalUID: IndexedEvent(
+                uid=event.iCalUID,
+                event_id=event.source_ids[0],
+                start=dt_sort_key(event.start),
+                end=recurrence.end_key(event),
+                fingerprint=event.fingerprint
+                or self.gcal_service.event_fingerprint(event),
+            )
             for event in self.gcal_service.list_events(
-                calendar_id=self.config.target.id, start=start, end=end
+                calendar_id=target_id,
+                start=start,
+                end=end,
+                attendees=False,
+                series=True,
             )
+            # instances of series cancelled in the target itself
+            if not event.deleted
         }
+        if self.use_target_index(target):
+            self.target_index.reconcile(target_id, start, end, target_events.values())
+        return target_events
+
+    def sync_to_target(
+        self,
+        target: TargetModel,
+        events: Iterable[Event],
+        start: datetime.datetime,
+        end: datetime.datetime,
+        owned_from: Optional[datetime.datetime] = None,
+    ) -> None:
+        """
+        Make target events in the window match `events`
+
+        :param owned_from: ignore source and target events starting before it
+        """
+        events_to_remove = self.get_target_events(target, start, end)
+        if owned_from is not None:
+            owned_from_key = dt_sort_key(owned_from)
+            events_to_remove = {
+                uid: event
+                for uid, event in events_to_remove.items()
+                if event.start >= owned_from_key
+            }
+            events = (
+                event for event in events if dt_sort_key(event.start) >= owned_from_key
+            )
         updated_events = []
-        for event in events:
+        fingerprints = {}
+        patches: dict[str, EventPatch] = {}
+        labels = {"target": target.id}
+        # diff time excludes time spent fetching and transforming source events
+        sources_seconds = self.metrics.get(
+            "stage_seconds_total", stage="sources", **labels
+        )
+        started = time.perf_counter()
+        for event in self.metrics.timed(
+            events,
+            "stage_seconds_total",
+            "stage_events_total",
+            stage="sources",
+            **labels,
+        ):
+            fingerprint = event.fingerprint = self.gcal_service.event_fingerprint(event)
             old_event = events_to_remove.pop(event.iCalUID, None)
-            if not old_event or pydantic_hash(event) != pydantic_hash(old_event):
+            if self.needs_write(event, old_event, patches):
                 event.sequence = int(time.time())
                 updated_events.append(event)
+                fingerprints[event.iCalUID] = (event, fingerprint)
+        sources_seconds = (
+            self.metrics.get("stage_seconds_total", stage="sources", **labels)
+            - sources_seconds
+        )
+        self.metrics.inc(
+            "stage_seconds_total",
+            time.perf_counter() - started - sources_seconds,
+            stage="diff",
+            **labels,
+        )
 
-        for removed_event in events_to_remove.values():
+        removed_events = []
+        for old_event in events_to_remove.values():
+            removed_event = old_event.to_event()
             removed_event.deleted = True
-        self.gcal_service.sync_events(
-            self.config.target.id,
-            itertools.chain(updated_events, events_to_remove.values()),
+            removed_events.append(removed_event)
+        self.write_events(
+            target,
+            itertools.chain(updated_events, removed_events),
+            fingerprints,
+            patches,
+        )
+
+    def needs_write(
+        self,
+        event: Event,
+        old_event: Optional[IndexedEvent],
+        patches: dict[str, EventPatch],
+    ) -> bool:
+        """
+        Whether `event` has to be written over `old_event` in the target
+
+        Adds changed fields to `patches` if patching the old event is enough,
+        `event.fingerprint` has to be set.
+        """
+        if old_event is None:
+            return True
+        if event.fingerprint == old_event.fingerprint:
+            return False
+        fields = self.gcal_service.patch_fields(event, old_event.fingerprint)
+        if fields is not None:
+            if not fields:
+                return False
+            patches[event.iCalUID] = EventPatch(old_event.event_id, fields)
+        return True
+
+    def sync_changes_to_target(
+        self, target: TargetModel, updated_events: list[Event], removed_uids: set[str]
+    ) -> None:
+        fingerprints = {}
+        patches: dict[str, EventPatch] = {}
+        for event in updated_events:
+            event.fingerprint = self.gcal_service.event_fingerprint(event)
+
+        with self.metrics.timer(
+            "stage_seconds_total", stage="target_lookup", target=target.id
+        ):
+            removed_events = []
+            if self.use_target_index(target):
+                old_events = {
+                    old_event.uid: old_event
+                    for old_event in self.target_index.lookup(
+                        target.id, (event.iCalUID for event in updated_events)
+                    )
+                }
+                updated_events = [
+                    event
+                    for event in updated_events
+                    if self.needs_write(event, old_events.get(event.iCalUID), patches)
+                ]
+                for old_event in self.target_index.lookup(target.id, removed_uids):
+                    removed_event = old_event.to_event()
+                    removed_event.deleted = True
+                    removed_events.append(removed_event)
+            else:
+                for uid in removed_uids:
+                    for removed_event in self.gcal_service.list_events_by_uid(
+                        calendar_id=target.id, uid=uid
+                    ):
+                        removed_event.deleted = True
+                        removed_events.append(removed_event)
+        for event in updated_events:
+            event.sequence = int(time.time())
+            fingerprints[event.iCalUID] = (event, event.fingerprint)
+        self.write_events(
+            target,
+            itertools.chain(updated_events, removed_events),
+            fingerprints,
+            patches,
         )
 
+    def write_events(
+        self,
+        target: TargetModel,
+        events: Iterable[Event],
+        fingerprints: dict[str, tuple[Event, str]],
+        patches: Optional[dict[str, EventPatch]] = None,
+    ) -> SyncReport:
+        """
+        Write events to target calendar
+
+        :param fingerprints: fingerprints of written events, by iCalUID
+        :param patches: changed fields of events to patch, by iCalUID
+        """
+        target_id = target.id
+        with self.metrics.timer("stage_seconds_total", stage="write", target=target_id):
+            report = self.gcal_service.sync_events(
+                target_id, events, patches=patches, **self.config.batch.dict()
+            )
+        LOG.info("Synced %s: %s", target_id, report.summary())
+        operations = collections.Counter(
+            (result.operation, "ok" if result.ok else "failed")
+            for result in report.results
+        )
+        for (operation, status), count in operations.items():
+            self.metrics.inc(
+                "write_operations_total",
+                count,
+                operation=operation,
+                status=status,
+                target=target_id,
+            )
+        if self.use_target_index(target):
+            self.target_index.update(target_id, report, fingerprints)
+        if report.failed:
+            raise BatchSyncError(report)
+        return report
+
+
+def with_calendar_id(
+    events: Iterable[Event], calendar_id: str
+) -> Generator[Event, None, None]:
+    for event in events:
+        event.calendar_id = calendar_id
+        yield event
+
+
+def segment_boundaries(
+    start: datetime.datetime, end: datetime.datetime, weeks: bool = False
+) -> list[datetime.datetime]:
+    """
+    Window split at midnights (Monday midnights with `weeks`)
+
+    >>> [d.day for d in segment_boundaries(datetime.datetime(2024, 1, 1, 12),
+    ...                                   datetime.datetime(2024, 1, 4))]
+    [1, 2, 3, 4]
+    """
+    step = datetime.timedelta(weeks=1) if weeks else datetime.timedelta(days=1)
+    boundary = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if weeks:
+        boundary -= datetime.timedelta(days=boundary.weekday())
+    boundaries = [start]
+    boundary += step
+    while boundary < end:
+        boundaries.append(boundary)
+        boundary += step
+    boundaries.append(end)
+    return boundaries
+
 
-def pydantic_hash(obj: pydantic.BaseModel) -> str:
-    return base64.b85encode(
-        hashlib.blake2s(
-            json.dumps(
-                obj.json(exclude={"sequence", "source_ids", "attendees", "src"}),
-                sort_keys=True,
-            ).encode("utf-8")
-        ).digest()
-    ).decode()
+def default_window(
+    now: datetime.datetime,
+) -> tuple[datetime.datetime, datetime.datetime]:
+    """From the beginning of the current month, three months ahead"""
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = start + relativedelta.relativedelta(months=3)
+    return start, end
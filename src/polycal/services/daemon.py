@@ -0,0 +1,284 @@
+import datetime
+import http.server
+import logging
+import queue
+import secrets
+import threading
+import time
+import uuid
+from typing import Callable, NamedTuple, Optional
+
+from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+from polycal.services.gcal import GoogleCalendarService
+from polycal.transforms import interpret_human_timedelta
+
+LOG = logging.getLogger(__name__)
+
+# renew channels this long before Google expires them
+CHANNEL_RENEW_MARGIN = datetime.timedelta(hours=1)
+
+
+class Notification(NamedTuple):
+    channel_id: str
+    resource_id: str
+    resource_state: str
+    token: Optional[str]
+
+
+class Channel(NamedTuple):
+    calendar_id: str
+    channel_id: str
+    resource_id: str
+    expiration: float
+
+
+class NotificationReceiver:
+    """
+    HTTP server receiving Calendar API push notifications
+
+    https://developers.google.com/calendar/api/guides/push#receiving-notifications
+
+    Server runs in a background thread, `on_notification` is called from it.
+    Use port 0 to bind to any free port, see `address`.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        path: str,
+        on_notification: Callable[[Notification], None],
+    ):
+        self.path = path
+        self.on_notification = on_notification
+        receiver = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                receiver.handle(self)
+
+            def log_message(self, format, *args):
+                LOG.debug(format, *args)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.server.server_address[:2]
+
+    def start(self) -> None:
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="polycal-receiver", daemon=True
+        )
+        self.thread.start()
+        LOG.info("Receiving notifications on %s:%d", *self.address)
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request: http.server.BaseHTTPRequestHandler) -> None:
+        request.rfile.read(int(request.headers.get("Content-Length") or 0))
+        path_matches = request.path.split("?")[0] == self.path
+        channel_id = request.headers.get("X-Goog-Channel-ID")
+        if not path_matches:
+            request.send_response(404)
+        elif not channel_id:
+            request.send_response(400)
+        else:
+            request.send_response(200)
+        request.end_headers()
+        if path_matches and channel_id:
+            self.on_notification(
+                Notification(
+                    channel_id=channel_id,
+                    resource_id=request.headers.get("X-Goog-Resource-ID", ""),
+                    resource_state=request.headers.get("X-Goog-Resource-State", ""),
+                    token=request.headers.get("X-Goog-Channel-Token"),
+                )
+            )
+
+
+class SyncDaemon:
+    """
+    Keep syncing source calendars whenever they change
+
+    With `serve.webhook_url` configured, source calendars are watched using push
+    notifications; calendars without an active channel are polled every
+    `serve.poll_interval` instead. Notifications are debounced, so a burst of
+    changes results in a single sync of just the changed calendars.
+
+    Syncs are always incremental, only then changed calendars can be synced on
+    their own; see `CalendarProcessor.process_incremental` for when it still
+    falls back to full sync.
+    """
+
+    def __init__(
+        self,
+        config: ConfigModel,
+        processor: CalendarProcessor,
+        gcal_service: GoogleCalendarService,
+        window: Optional[
+            Callable[[datetime.datetime], tuple[datetime.datetime, datetime.datetime]]
+        ] = None,
+    ):
+        self.config = config
+        self.serve = config.serve
+        self.processor = processor
+        if processor.config.window.segment:
+            raise ValueError("window segments can't be used with incremental sync")
+        if not processor.config.incremental:
+            LOG.info("Enabling incremental sync, to sync only changed calendars")
+            processor.config.incremental = True
+        self.gcal_service = gcal_service
+        self.window = window or processor.window
+        self.debounce = interpret_human_timedelta(self.serve.debounce).total_seconds()
+        self.max_debounce = interpret_human_timedelta(
+            self.serve.max_debounce
+        ).total_seconds()
+        self.poll_interval = interpret_human_timedelta(
+            self.serve.poll_interval
+        ).total_seconds()
+        self.channel_ttl = interpret_human_timedelta(self.serve.channel_ttl)
+        self.token = secrets.token_urlsafe(16)
+        self.channels: dict[str, Channel] = {}
+        self.changed: queue.Queue[Optional[str]] = queue.Queue()
+        self.failed: set[str] = set()
+        self.stopped = threading.Event()
+
+    @property
+    def calendar_ids(self) -> set[str]:
+        return {source.id for source in self.processor.used_sources}
+
+    @property
+    def google_calendar_ids(self) -> set[str]:
+        """Source calendars which can be watched, others are always polled"""
+        return {
+            source.id
+            for source in self.processor.used_sources
+            if source.type == "google"
+        }
+
+    @property
+    def watched_calendar_ids(self) -> set[str]:
+        return {channel.calendar_id for channel in self.channels.values()}
+
+    def notify(self, notification: Notification) -> None:
+        """Handle push notification, called from the receiver thread"""
+        channel = self.channels.get(notification.channel_id)
+        if channel is None or notification.token != self.token:
+            LOG.debug("Ignoring notification of unknown channel %r", notification)
+        elif notification.resource_state != "sync":
+            self.changed.put(channel.calendar_id)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.changed.put(None)
+
+    def run(self) -> None:
+        receiver = None
+        if self.serve.webhook_url:
+            receiver = NotificationReceiver(
+                self.serve.host, self.serve.port, self.serve.path, self.notify
+            )
+            receiver.start()
+        try:
+            if receiver:
+                for calendar_id in sorted(self.google_calendar_ids):
+                    self.watch(calendar_id)
+            self.sync(None)
+            self.loop()
+        finally:
+            for channel in list(self.channels.values()):
+                self.unwatch(channel)
+            if receiver:
+                receiver.stop()
+            self.processor.close()
+
+    def loop(self) -> None:
+        next_poll = time.time() + self.poll_interval
+        while not self.stopped.is_set():
+            self.renew_channels()
+            timeout = min([next_poll] + self.renewal_times()) - time.time()
+            changed = self.collect_changes(timeout=max(timeout, 0))
+            if time.time() >= next_poll:
+                changed |= (self.calendar_ids - self.watched_calendar_ids) | self.failed
+                next_poll = time.time() + self.poll_interval
+            if changed and not self.stopped.is_set():
+                self.sync(changed)
+
+    def collect_changes(self, timeout: float) -> set[str]:
+        """
+        Wait for changed calendars, until no more arrive for `debounce`
+
+        Continuous changes are collected for at most `max_debounce`, so that they
+        don't postpone the sync indefinitely.
+        """
+        changed = set()
+        try:
+            calendar_id = self.changed.get(timeout=timeout)
+            deadline = time.time() + self.max_debounce
+            while calendar_id is not None:
+                changed.add(calendar_id)
+                calendar_id = self.changed.get(
+                    timeout=max(min(self.debounce, deadline - time.time()), 0)
+                )
+        except queue.Empty:
+            pass
+        return changed
+
+    def sync(self, calendar_ids: Optional[set[str]]) -> None:
+        LOG.info("Syncing %s", sorted(calendar_ids) if calendar_ids else "all")
+        start, end = self.window(datetime.datetime.utcnow())
+        try:
+            self.processor.process(start, end, calendar_ids)
+        except Exception:
+            LOG.exception("Sync failed, will retry with the next poll")
+            self.failed |= calendar_ids or self.calendar_ids
+        else:
+            self.failed -= calendar_ids or self.calendar_ids
+
+    def watch(self, calendar_id: str) -> None:
+        # slow to import, see `polycal.services.gcal`
+        from googleapiclient.errors import HttpError
+
+        channel_id = str(uuid.uuid4())
+        try:
+            response = self.gcal_service.watch_events(
+                calendar_id=calendar_id,
+                channel_id=channel_id,
+                address=self.serve.webhook_url,
+                token=self.token,
+                ttl=self.channel_ttl,
+            )
+        except HttpError as e:
+            LOG.warning("Can't watch %s, polling it instead: %r", calendar_id, e)
+            return
+        self.channels[channel_id] = Channel(
+            calendar_id=calendar_id,
+            channel_id=channel_id,
+            resource_id=response["resourceId"],
+            expiration=int(response.get("expiration", 0)) / 1000
+            or time.time() + self.channel_ttl.total_seconds(),
+        )
+
+    def unwatch(self, channel: Channel) -> None:
+        from googleapiclient.errors import HttpError
+
+        self.channels.pop(channel.channel_id, None)
+        try:
+            self.gcal_service.stop_channel(channel.channel_id, channel.resource_id)
+        except HttpError as e:
+            LOG.warning("Can't stop channel of %s: %r", channel.calendar_id, e)
+
+    def renewal_times(self) -> list[float]:
+        margin = CHANNEL_RENEW_MARGIN.total_seconds()
+        return [channel.expiration - margin for channel in self.channels.values()]
+
+    def renew_channels(self) -> None:
+        margin = CHANNEL_RENEW_MARGIN.total_seconds()
+        for channel in list(self.channels.values()):
+            if channel.expiration - margin <= time.time():
+                self.watch(channel.calendar_id)
+                self.unwatch(channel)
@@ -1,20 +1,85 @@
+import base64
 import datetime
+import functools
+import hashlib
+import json
 import logging
 import pathlib
-from typing import Generator, Iterable, List, TypedDict, Union
-
-from google.auth.exceptions import RefreshError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-from polycal.types import Attendee, Event
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Generator,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    TypedDict,
+    Union,
+)
+
+from polycal.services.batch import (
+    BatchWriter,
+    Operation,
+    OperationResult,
+    SyncReport,
+    is_rate_limited,
+)
+from polycal.services.metrics import MeteredHttp, Metrics
+from polycal.services.ratelimit import RateLimiter
+from polycal.services.transport import HttpTransport
+from polycal.types import Attendee, Event, dt_sort_key
+
+# Google auth and API client libraries take longer to import than the rest of
+# polycal, so they are imported on first use
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 LOG = logging.getLogger(__name__)
 
 TOKEN_FILE = "token.json"
 
+# private extended property of target events holding fingerprint of their content
+FINGERPRINT_PROPERTY = "polycalFingerprint"
+
+# event fields fingerprints are made of, in order, see `gevent_fingerprint`
+FINGERPRINT_FIELDS = (
+    "iCalUID",
+    "summary",
+    "start",
+    "end",
+    "status",
+    "location",
+    "transparency",
+    "eventType",
+    "recurrence",
+)
+# fields which can't be patched, events with changes of them are re-imported
+IMMUTABLE_FIELDS = frozenset({"iCalUID", "eventType"})
+# base85 characters of a single field digest (4 bytes)
+FIELD_DIGEST_LENGTH = 5
+
+# Google only compresses responses for user agents containing "gzip"
+USER_AGENT = "polycal (gzip)"
+
+# partial response masks of `events().list`, only fields read by
+# `_gevent_to_event`, `_is_declined`, `_in_window` and `event_fingerprint`
+EVENT_FIELDS = (
+    "id",
+    "iCalUID",
+    "sequence",
+    "status",
+    "start",
+    "end",
+    "eventType",
+    "summary",
+    "location",
+    "transparency",
+    f"extendedProperties/private/{FINGERPRINT_PROPERTY}",
+)
+ATTENDEE_FIELDS = "attendees(email,responseStatus)"
+SERIES_FIELDS = ("recurrence", "recurringEventId", "originalStartTime")
+
 SCOPES = [
     "https://www.googleapis.com/auth/calendar.acls.readonly",
     "https://www.googleapis.com/auth/calendar.calendarlist.readonly",
@@ -23,7 +88,12 @@ SCOPES = [
 ]
 
 
-def get_creds(path: pathlib.Path) -> Credentials:
+def get_creds(path: pathlib.Path) -> "Credentials":
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     token_path = path / TOKEN_FILE
     creds = None
 
@@ -62,10 +132,44 @@ def from_google_cal_date(dt: dict[str, str]) -> Union[datetime.datetime, datetim
         return datetime.date.fromisoformat(dt["date"])
 
 
-def to_google_cal_date(dt: Union[datetime.datetime, datetime.date]) -> dict[str, str]:
-    return {
-        ("dateTime" if isinstance(dt, datetime.datetime) else "date"): dt.isoformat()
-    }
+def to_google_cal_date(
+    dt: Union[datetime.datetime, datetime.date], timezone: Optional[str] = None
+) -> dict[str, str]:
+    if not isinstance(dt, datetime.datetime):
+        return {"date": dt.isoformat()}
+    if timezone:
+        return {"dateTime": dt.isoformat(), "timeZone": timezone}
+    return {"dateTime": dt.isoformat()}
+
+
+def events_list_fields(attendees: bool = True, series: bool = False) -> str:
+    """
+    `fields` mask of `events().list` responses
+
+    >>> events_list_fields(attendees=False)[:42]
+    'nextPageToken,nextSyncToken,items(id,iCalU'
+    """
+    fields = EVENT_FIELDS + ((ATTENDEE_FIELDS,) if attendees else ())
+    if series:
+        fields += SERIES_FIELDS
+    return f"nextPageToken,nextSyncToken,items({','.join(fields)}),etag"
+
+
+class GzipHttp:
+    """`httplib2.Http` compatible wrapper asking for gzip compressed responses"""
+
+    def __init__(self, http: Any):
+        self.http = http
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        headers = dict(headers or {})
+        headers["accept-encoding"] = "gzip"
+        user_agent = headers.get("user-agent", "").replace("(gzip)", "").strip()
+        headers["user-agent"] = f"{USER_AGENT} {user_agent}".strip()
+        return self.http.request(uri, method, body, headers, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.http, name)
 
 
 dt_str = str
@@ -130,30 +234,184 @@ class GoogleCalendarEvent(TypedDict, total=False):
     attendees: list[GoogleAttendee]
 
 
+def field_digest(value: Any) -> str:
+    return base64.b85encode(
+        hashlib.blake2s(
+            json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+            digest_size=4,
+        ).digest()
+    ).decode()
+
+
+def gevent_fingerprint(body: GoogleCalendarEvent) -> str:
+    """
+    Digests of `FINGERPRINT_FIELDS` of `body`, telling which fields changed
+
+    >>> body = {"iCalUID": "a@polycal", "summary": "Lunch"}
+    >>> fingerprint = gevent_fingerprint(body)
+    >>> len(fingerprint) == len(FINGERPRINT_FIELDS) * FIELD_DIGEST_LENGTH
+    True
+    >>> sorted(changed_fields({**body, "summary": "Dinner"}, fingerprint))
+    ['summary']
+    """
+    return "".join(field_digest(body.get(field)) for field in FINGERPRINT_FIELDS)
+
+
+def changed_fields(
+    body: GoogleCalendarEvent, fingerprint: Optional[str]
+) -> Optional[frozenset[str]]:
+    """
+    Fields of `body` which changed since `fingerprint` was taken
+
+    None if it's unknown which fields changed, e.g. as `FINGERPRINT_FIELDS` did.
+    """
+    if fingerprint is None:
+        return None
+    if len(fingerprint) != len(FINGERPRINT_FIELDS) * FIELD_DIGEST_LENGTH:
+        return None
+    return frozenset(
+        field
+        for i, field in enumerate(FINGERPRINT_FIELDS)
+        if fingerprint[i * FIELD_DIGEST_LENGTH : (i + 1) * FIELD_DIGEST_LENGTH]
+        != field_digest(body.get(field))
+    )
+
+
+class EventPatch(NamedTuple):
+    """Changed fields of an event to patch in place of re-importing it"""
+
+    event_id: str
+    fields: frozenset[str]
+
+
+class SyncTokenExpired(Exception):
+    """Stored sync token was rejected by Google, full sync is required"""
+
+
+class CalendarChanges(NamedTuple):
+    events: list[Event]
+    removed_uids: set[str]
+    sync_token: Optional[str]
+
+
+class FetchedEvents(NamedTuple):
+    """Listing of a source, fetched but not parsed into events yet"""
+
+    # changes whenever the listing does, None if it can't be told
+    fingerprint: Optional[str]
+    parse: Callable[[], Iterable[Event]]
+
+
+def pages_fingerprint(pages: list[dict]) -> Optional[str]:
+    """
+    Fingerprint of `events().list` pages, by their ETags and sizes
+
+    >>> pages_fingerprint([{"etag": '"1"', "items": []}]) == pages_fingerprint(
+    ...     [{"etag": '"2"', "items": []}]
+    ... )
+    False
+    """
+    etags = [[page.get("etag"), len(page["items"])] for page in pages]
+    if any(etag is None for etag, _ in etags):
+        return None
+    return hashlib.blake2s(json.dumps(etags).encode("utf-8")).hexdigest()
+
+
 class GoogleCalendarService:
-    def __init__(self, creds):
-        self.service = build("calendar", "v3", credentials=creds)
+    def __init__(
+        self,
+        creds,
+        metrics: Optional[Metrics] = None,
+        transport: Optional[HttpTransport] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        :param transport: shared pooled transport, requests go through a new
+            `httplib2.Http`, with its own connections, per `new_http` without it
+        :param limiter: rate limiter shared by all API calls, see `execute`
+        """
+        self.creds = creds
+        self.metrics = metrics
+        self.transport = transport
+        self.limiter = limiter
+
+    @functools.cached_property
+    def service(self):
+        """Calendar API client, built on first use"""
+        from googleapiclient.discovery import build
+
+        # discovery document bundled with the client library, never fetched
+        return build(
+            "calendar",
+            "v3",
+            http=self.new_http(),
+            static_discovery=True,
+            cache_discovery=False,
+        )
 
-    def yield_all(self, query):
+    def new_http(self):
+        if self.transport is not None:
+            http = GzipHttp(self.transport)
+        else:
+            import google_auth_httplib2
+            from googleapiclient.http import build_http
+
+            http = GzipHttp(
+                google_auth_httplib2.AuthorizedHttp(self.creds, http=build_http())
+            )
+        if self.metrics is not None:
+            http = MeteredHttp(http, self.metrics)
+        return http
+
+    def execute(self, request) -> Any:
+        """
+        Execute a single API request within the limits of `limiter`
+
+        Rate limited requests are retried, after the limiter slowed down.
+        """
+        if self.limiter is None:
+            return request.execute()
+        from googleapiclient.errors import HttpError
+
+        for attempt in range(self.limiter.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                with self.limiter.slot():
+                    return request.execute()
+            except HttpError as e:
+                if not is_rate_limited(e):
+                    raise
+                self.limiter.throttled()
+                if attempt == self.limiter.max_retries:
+                    raise
+                LOG.info("Retrying rate limited request (attempt %d)", attempt + 2)
+
+    def yield_pages(self, query):
         fetch_more = True
         page_token = None
         while fetch_more:
             result = query(page_token=page_token)
-            yield from result["items"]
+            if self.metrics is not None:
+                self.metrics.inc("api_pages_total")
+            yield result
             page_token = result.get("nextPageToken")
             fetch_more = bool(page_token)
 
+    def yield_all(self, query):
+        for result in self.yield_pages(query):
+            yield from result["items"]
+
     def get_calendar_owner_emails(self, calendar_id: str) -> Generator[str, None, None]:
         if "@" in calendar_id and not calendar_id.endswith("calendar.google.com"):
             yield calendar_id
         return
         for acl in self.yield_all(
-            lambda page_token: self.service.acl()
-            .list(
-                calendarId=calendar_id,
-                pageToken=page_token,
-            )
-            .execute(),
+            lambda page_token: self.execute(
+                self.service.acl().list(
+                    calendarId=calendar_id,
+                    pageToken=page_token,
+                )
+            ),
         ):
             if acl["role"] == "owner":
                 scope = acl["scope"]
@@ -161,62 +419,303 @@ class GoogleCalendarService:
                     yield scope["value"]
 
     def list_events(
-        self, calendar_id: str, start: datetime.datetime, end: datetime.datetime
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        keep_src: bool = False,
+        attendees: bool = True,
+        series: bool = False,
     ) -> Generator[Event, None, None]:
         """
         List events which calendar owner is/was attending
+
+        :param keep_src: keep raw API payload in `Event.src`, otherwise only
+            fields used by polycal are fetched
+        :param attendees: fetch attendees, they are still fetched when needed
+            to skip events declined by the calendar owner
+        :param series: list recurring series as their master events plus
+            exceptions, in no particular order; cancelled and declined
+            exceptions are listed as deleted, see `fold_exceptions`
         """
 
         emails = set(self.get_calendar_owner_emails(calendar_id))
-        for google_event in self.yield_all(
-            lambda page_token: self.service.events()
-            .list(
+        pages = self.yield_pages(
+            self._events_query(
+                calendar_id, start, end, emails, keep_src, attendees, series
+            )
+        )
+        return self._page_events(pages, emails, keep_src=keep_src, series=series)
+
+    def fetch_events(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        keep_src: bool = False,
+        attendees: bool = True,
+        series: bool = False,
+    ) -> FetchedEvents:
+        """
+        `list_events`, fingerprinted by ETags of the listed pages
+
+        All pages are fetched before any event is parsed, so that unchanged
+        listings can be told apart without parsing them.
+        """
+        emails = set(self.get_calendar_owner_emails(calendar_id))
+        pages = list(
+            self.yield_pages(
+                self._events_query(
+                    calendar_id, start, end, emails, keep_src, attendees, series
+                )
+            )
+        )
+        return FetchedEvents(
+            fingerprint=pages_fingerprint(pages),
+            parse=lambda: self._page_events(
+                pages, emails, keep_src=keep_src, series=series
+            ),
+        )
+
+    def _events_query(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        emails: set[str],
+        keep_src: bool,
+        attendees: bool,
+        series: bool,
+    ) -> Callable[[Optional[str]], dict]:
+        fields = None
+        if not keep_src:
+            fields = events_list_fields(
+                attendees=attendees or bool(emails), series=series
+            )
+        return lambda page_token: self.execute(
+            self.service.events().list(
                 calendarId=calendar_id,
                 timeMin=iso_z(start),
                 timeMax=iso_z(end),
                 maxResults=2500,
-                singleEvents=True,
-                orderBy="startTime",
+                singleEvents=not series,
+                orderBy=None if series else "startTime",
                 pageToken=page_token,
+                fields=fields,
             )
-            .execute()
-        ):
-            google_event: GoogleCalendarEvent
-            if any(
-                attendee.get("email") in emails
-                and attendee.get("responseStatus") == "declined"
-                for attendee in google_event.get("attendees", [])
+        )
+
+    def _page_events(
+        self, pages: Iterable[dict], emails: set[str], keep_src: bool, series: bool
+    ) -> Generator[Event, None, None]:
+        for page in pages:
+            for google_event in page["items"]:
+                google_event: GoogleCalendarEvent
+                declined = self._is_declined(google_event, emails)
+                if declined and not (series and "recurringEventId" in google_event):
+                    continue
+
+                event = self._gevent_to_event(google_event, keep_src=keep_src)
+                event.deleted = event.deleted or declined
+                yield event
+
+    def list_events_changes(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_token: Optional[str] = None,
+        keep_src: bool = False,
+        attendees: bool = True,
+    ) -> CalendarChanges:
+        """
+        List events changed since `sync_token` was issued
+
+        Without `sync_token` all events in the window are listed (in no particular
+        order) and returned token can be used for incremental listing next time.
+        Changed events which are cancelled, declined or moved out of the window
+        are reported by their iCalUID in `removed_uids`.
+        """
+        if sync_token:
+            query_kwargs = {"syncToken": sync_token}
+        else:
+            query_kwargs = {"timeMin": iso_z(start), "timeMax": iso_z(end)}
+
+        emails = set(self.get_calendar_owner_emails(calendar_id))
+        fields = None
+        if not keep_src:
+            fields = events_list_fields(attendees=attendees or bool(emails))
+        from googleapiclient.errors import HttpError
+
+        events = []
+        removed_uids = set()
+        next_sync_token = None
+        try:
+            for result in self.yield_pages(
+                lambda page_token: self.execute(
+                    self.service.events().list(
+                        calendarId=calendar_id,
+                        maxResults=2500,
+                        singleEvents=True,
+                        showDeleted=bool(sync_token),
+                        pageToken=page_token,
+                        fields=fields,
+                        **query_kwargs,
+                    )
+                )
             ):
-                continue
+                next_sync_token = result.get("nextSyncToken")
+                for google_event in result["items"]:
+                    google_event: GoogleCalendarEvent
+                    if (
+                        google_event.get("status") == "cancelled"
+                        or self._is_declined(google_event, emails)
+                        or not self._in_window(google_event, start, end)
+                    ):
+                        removed_uids.add(self._gevent_uid(google_event))
+                    else:
+                        events.append(
+                            self._gevent_to_event(google_event, keep_src=keep_src)
+                        )
+        except HttpError as e:
+            if e.resp.status == 410:
+                raise SyncTokenExpired(calendar_id) from e
+            raise
+        return CalendarChanges(
+            events=events, removed_uids=removed_uids, sync_token=next_sync_token
+        )
 
+    def list_events_by_uid(
+        self, calendar_id: str, uid: str
+    ) -> Generator[Event, None, None]:
+        for google_event in self.yield_all(
+            lambda page_token: self.execute(
+                self.service.events().list(
+                    calendarId=calendar_id,
+                    iCalUID=uid,
+                    pageToken=page_token,
+                    fields=events_list_fields(attendees=False),
+                )
+            )
+        ):
             yield self._gevent_to_event(google_event)
 
-    def _gevent_to_event(self, google_event: GoogleCalendarEvent) -> Event:
-        uid = google_event["iCalUID"]
+    def watch_events(
+        self,
+        calendar_id: str,
+        channel_id: str,
+        address: str,
+        token: str,
+        ttl: datetime.timedelta,
+    ) -> dict:
+        """
+        Subscribe `address` to push notifications about changes of events
+
+        https://developers.google.com/calendar/api/guides/push
+        """
+        return self.execute(
+            self.service.events().watch(
+                calendarId=calendar_id,
+                body={
+                    "id": channel_id,
+                    "type": "web_hook",
+                    "address": address,
+                    "token": token,
+                    "params": {"ttl": str(int(ttl.total_seconds()))},
+                },
+            )
+        )
+
+    def stop_channel(self, channel_id: str, resource_id: str) -> None:
+        self.execute(
+            self.service.channels().stop(
+                body={"id": channel_id, "resourceId": resource_id}
+            )
+        )
+
+    @staticmethod
+    def _is_declined(google_event: GoogleCalendarEvent, emails: set[str]) -> bool:
+        return any(
+            attendee.get("email") in emails
+            and attendee.get("responseStatus") == "declined"
+            for attendee in google_event.get("attendees", [])
+        )
+
+    @staticmethod
+    def _in_window(
+        google_event: GoogleCalendarEvent,
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> bool:
+        event_start = from_google_cal_date(google_event["start"])
+        event_end = from_google_cal_date(google_event["end"])
+        return dt_sort_key(event_start) < dt_sort_key(end) and dt_sort_key(
+            event_end
+        ) > dt_sort_key(start)
+
+    @staticmethod
+    def _gevent_uid(google_event: GoogleCalendarEvent) -> str:
+        uid = google_event.get("iCalUID", "")
         if not uid.endswith("@polycal"):
             uid = f"{google_event['id']}@polycal"
+        return uid
+
+    def _gevent_to_event(
+        self, google_event: GoogleCalendarEvent, keep_src: bool = False
+    ) -> Event:
+        # cancelled exceptions of series only have their original start
+        start = google_event.get("start") or google_event["originalStartTime"]
+        original_start = google_event.get("originalStartTime")
         return Event(
-            src=google_event,
+            src=google_event if keep_src else None,
             source_ids=[google_event["id"]],
-            iCalUID=uid,
+            iCalUID=self._gevent_uid(google_event),
+            original_uid=google_event.get("iCalUID"),
             sequence=google_event.get("sequence", 0),
-            start=from_google_cal_date(google_event["start"]),
-            end=from_google_cal_date(google_event["end"]),
-            type=google_event.get("eventType"),
+            start=from_google_cal_date(start),
+            end=from_google_cal_date(google_event.get("end", start)),
+            type=google_event.get("eventType", "default"),
             title=google_event.get("summary"),
             deleted=google_event.get("status") == "cancelled",
             location=google_event.get("location"),
             busy=google_event.get("transparency", "opaque") == "opaque",
-            attendees=[
-                Attendee(email=attendee["email"], status=attendee.get("responseStatus"))
-                for attendee in google_event.get("attendees", [])
-            ],
+            fingerprint=google_event.get("extendedProperties", {})
+            .get("private", {})
+            .get(FINGERPRINT_PROPERTY),
+            attendees=functools.partial(
+                self._gattendees_to_attendees, google_event.get("attendees", [])
+            ),
+            recurrence=google_event.get("recurrence"),
+            recurring_id=google_event.get("recurringEventId"),
+            original_start=original_start and from_google_cal_date(original_start),
+            timezone=start.get("timeZone"),
         )
 
+    @staticmethod
+    def _gattendees_to_attendees(
+        google_attendees: list[GoogleAttendee],
+    ) -> list[Attendee]:
+        return [
+            Attendee(email=attendee["email"], status=attendee.get("responseStatus"))
+            for attendee in google_attendees
+        ]
+
     def _event_to_gevent(self, event: Event) -> GoogleCalendarEvent:
+        body = self._event_body(event)
         return {
-            "iCalUID": event.iCalUID,
+            **body,
             "sequence": event.sequence,
+            "extendedProperties": {
+                "private": {
+                    FINGERPRINT_PROPERTY: event.fingerprint or gevent_fingerprint(body)
+                }
+            },
+        }
+
+    def _event_body(self, event: Event) -> GoogleCalendarEvent:
+        """Fields of `event` which are written to the target"""
+        body: GoogleCalendarEvent = {
+            "iCalUID": event.iCalUID,
             "summary": event.title,
             "start": to_google_cal_date(event.start),
             "end": to_google_cal_date(event.end),
@@ -225,34 +724,129 @@ class GoogleCalendarService:
             "transparency": "opaque" if event.busy else "transparent",
             "eventType": event.type,
         }
+        if event.recurrence:
+            # Google requires time zone of series, which rules are expanded in
+            timezone = event.timezone or "UTC"
+            body["start"] = to_google_cal_date(event.start, timezone)
+            body["end"] = to_google_cal_date(event.end, timezone)
+            body["recurrence"] = event.recurrence
+        return body
+
+    def event_fingerprint(self, event: Event) -> str:
+        """Fingerprint of `event` content as it would be written to the target"""
+        return gevent_fingerprint(self._event_body(event))
+
+    def patch_fields(
+        self, event: Event, fingerprint: Optional[str]
+    ) -> Optional[frozenset[str]]:
+        """
+        Fields to patch for the target event of `fingerprint` to match `event`
 
-    def sync_events(self, calendar_id: str, sync_events: Iterable[Event]):
-        sync_events = list(sync_events)
-        batch = self.service.new_batch_http_request()
+        None if the target event has to be re-imported instead, e.g. when a
+        field changed which can't be patched, or was removed.
+        """
+        body = self._event_body(event)
+        fields = changed_fields(body, fingerprint)
+        if fields is None or fields & IMMUTABLE_FIELDS or fields - body.keys():
+            return None
+        # Google validates start against end of the patched event
+        if fields & {"start", "end"}:
+            fields |= {"start", "end"}
+        return fields
+
+    def _event_patch(self, event: Event, fields: frozenset[str]) -> GoogleCalendarEvent:
+        body = self._event_body(event)
+        patch: GoogleCalendarEvent = {field: body[field] for field in fields}
+        for field in {"start", "end"} & fields:
+            # nested objects are merged by patch, unset the other kind of date
+            patch[field] = {"date": None, "dateTime": None, "timeZone": None}
+            patch[field].update(body[field])
+        patch["extendedProperties"] = {
+            "private": {
+                FINGERPRINT_PROPERTY: event.fingerprint or gevent_fingerprint(body)
+            }
+        }
+        return patch
+
+    def sync_events(
+        self,
+        calendar_id: str,
+        sync_events: Iterable[Event],
+        chunk_size: int = 50,
+        concurrency: int = 1,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        patches: Optional[dict[str, EventPatch]] = None,
+    ) -> SyncReport:
+        """
+        Import, patch or delete events in target calendar using batch requests
 
-        def cb(request_id, response, exception):
-            if exception is not None:
-                raise exception
+        See `BatchWriter` for meaning of batching parameters.
 
+        :param patches: fields to patch by iCalUID, other events are imported;
+            patches of events missing from the target fall back to import
+        """
+        patches = patches or {}
+        operations = []
         updated = set()
         for event in sync_events:
             if event.deleted:
                 for source_id in set(event.source_ids) - updated:
-                    batch.add(
-                        self.service.events().delete(
-                            calendarId=calendar_id,
-                            eventId=source_id,
-                            sendNotifications=False,
-                            sendUpdates="none",
-                        ),
-                        callback=cb,
+                    operations.append(
+                        Operation(
+                            result=OperationResult(
+                                operation="delete",
+                                uid=event.iCalUID,
+                                event_id=source_id,
+                            ),
+                            request=functools.partial(
+                                self.service.events().delete,
+                                calendarId=calendar_id,
+                                eventId=source_id,
+                                sendNotifications=False,
+                                sendUpdates="none",
+                            ),
+                            ok_statuses=frozenset({404, 410}),
+                        )
                     )
-            else:
-                batch.add(
-                    self.service.events().import_(
-                        calendarId=calendar_id, body=self._event_to_gevent(event)
+                continue
+            event.validate()
+            operation = Operation(
+                result=OperationResult(operation="import", uid=event.iCalUID),
+                request=functools.partial(
+                    self.service.events().import_,
+                    calendarId=calendar_id,
+                    body=self._event_to_gevent(event),
+                    fields="id",
+                ),
+            )
+            patch = patches.get(event.iCalUID)
+            if patch is not None:
+                operation = Operation(
+                    result=OperationResult(
+                        operation="patch", uid=event.iCalUID, event_id=patch.event_id
+                    ),
+                    request=functools.partial(
+                        self.service.events().patch,
+                        calendarId=calendar_id,
+                        eventId=patch.event_id,
+                        body=self._event_patch(event, patch.fields),
+                        sendUpdates="none",
+                        fields="id",
                     ),
-                    callback=cb,
+                    fallback=operation,
                 )
-                updated.update(event.source_ids)
-        batch.execute()
+            operations.append(operation)
+            updated.update(event.source_ids)
+
+        writer = BatchWriter(
+            new_batch=self.service.new_batch_http_request,
+            http_factory=self.new_http,
+            chunk_size=chunk_size,
+            concurrency=concurrency,
+            max_retries=max_retries,
+            backoff=backoff,
+            metrics=self.metrics,
+            limiter=self.limiter,
+        )
+        return writer.execute(operations)
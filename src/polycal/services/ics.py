@@ -0,0 +1,473 @@
+"""
+iCalendar (.ics) files as event sources
+
+Exports of other calendar systems can be hundreds of megabytes of history.
+`IcsCalendarService` memory-maps the file and scans it for VEVENT components,
+only events overlapping the sync window are turned into `Event`s, the rest is
+skipped after reading their start and end. Recurring events are expanded
+locally within the window, see `polycal.recurrence`, and modified instances
+(VEVENTs with RECURRENCE-ID) replace instances of their series.
+
+Time zones must be given as IANA names, times in other zones (e.g. defined by
+VTIMEZONE components of the file) are read as UTC.
+"""
+
+import datetime
+import functools
+import hashlib
+import logging
+import mmap
+import os
+import pathlib
+import re
+import zoneinfo
+from typing import Generator, Iterator, Optional, Union
+
+from polycal import recurrence
+from polycal.services.gcal import CalendarChanges, FetchedEvents, SyncTokenExpired
+from polycal.types import Attendee, Event, dt_sort_key, event_sort_key
+
+LOG = logging.getLogger(__name__)
+
+BEGIN = b"BEGIN:VEVENT"
+END = b"END:VEVENT"
+# continuation of a content line folded over multiple lines
+FOLD = re.compile(rb"\r?\n[ \t]")
+# components nested in events, e.g. VALARM
+NESTED = re.compile(rb"^BEGIN:([A-Z-]+).*?^END:\1\r?$", re.M | re.S)
+# name, parameters and value of a content line
+CONTENT_LINE = re.compile(
+    rb'^([A-Za-z0-9-]+)((?:;(?:"[^"]*"|[^;:"\r\n])*)*):([^\r\n]*)', re.M
+)
+# lines telling whether a single event is in the window, unfolded lines only
+SPAN_LINE = re.compile(rb"^(DTSTART|DTEND|DURATION)((?:;[^:\r\n]*)?):([^\r\n]*)", re.M)
+PARAMETER = re.compile(r';([^=;]+)=("[^"]*"|[^;]*)')
+DURATION = re.compile(
+    r"([-+])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?"
+)
+ESCAPED = re.compile(r"\\([\\;,nN])")
+RECURRENCE_PROPERTIES = ("RRULE", "RDATE", "EXRULE", "EXDATE")
+PARTSTATS = {
+    "ACCEPTED": "accepted",
+    "DECLINED": "declined",
+    "TENTATIVE": "tentative",
+    "NEEDS-ACTION": "needsAction",
+}
+
+# content lines of an event by property name, as (parameters, value)
+Properties = dict[str, list[tuple[bytes, bytes]]]
+
+
+def read_vevents(path: pathlib.Path) -> Generator[bytes, None, None]:
+    """Content of every VEVENT of an iCalendar file, memory-mapped"""
+    with path.open("rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+            pos = data.find(BEGIN)
+            while pos != -1:
+                end = data.find(END, pos)
+                if end == -1:
+                    LOG.warning("Unterminated VEVENT at byte %d of %s", pos, path)
+                    return
+                yield data[pos + len(BEGIN) : end]
+                pos = data.find(BEGIN, end)
+
+
+def parse_properties(component: bytes) -> Properties:
+    r"""
+    >>> parse_properties(b"\r\nSUMMARY:Long\r\n  title\r\nDTSTART;VALUE=DATE:20240101\r\n")
+    {'SUMMARY': [(b'', b'Long title')], 'DTSTART': [(b';VALUE=DATE', b'20240101')]}
+    """
+    component = FOLD.sub(b"", component)
+    if b"BEGIN:" in component:
+        component = NESTED.sub(b"", component)
+    properties: Properties = {}
+    for name, parameters, value in CONTENT_LINE.findall(component):
+        properties.setdefault(name.decode().upper(), []).append((parameters, value))
+    return properties
+
+
+def parameters(raw: bytes) -> dict[str, str]:
+    """
+    >>> parameters(b';TZID=Europe/Warsaw;CN="Doe; John"')
+    {'TZID': 'Europe/Warsaw', 'CN': 'Doe; John'}
+    """
+    return {
+        name.upper(): value.strip('"')
+        for name, value in PARAMETER.findall(raw.decode("utf-8", "replace"))
+    }
+
+
+def unescape(value: bytes) -> str:
+    r"""
+    >>> unescape(rb"Room 1\, floor 2\nBring laptop")
+    'Room 1, floor 2\nBring laptop'
+    """
+    return ESCAPED.sub(
+        lambda match: "\n" if match.group(1) in "nN" else match.group(1),
+        value.decode("utf-8", "replace"),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def zone(tzid: Optional[str]) -> datetime.tzinfo:
+    """Time zone of a TZID parameter, UTC if it isn't an IANA name"""
+    if tzid is None:
+        return datetime.timezone.utc
+    try:
+        return zoneinfo.ZoneInfo(tzid.lstrip("/"))
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError):
+        LOG.warning("Unknown time zone %r, reading its times as UTC", tzid)
+        return datetime.timezone.utc
+
+
+def parse_date(
+    raw_parameters: bytes, value: bytes
+) -> Union[datetime.datetime, datetime.date]:
+    """
+    DATE or DATE-TIME value, floating times are read as UTC
+
+    >>> parse_date(b";VALUE=DATE", b"20240105")
+    datetime.date(2024, 1, 5)
+    >>> parse_date(b"", b"20240105T103000Z")
+    datetime.datetime(2024, 1, 5, 10, 30, tzinfo=datetime.timezone.utc)
+    """
+    text = value.decode("ascii").strip()
+    date = datetime.date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+    if len(text) == 8:
+        return date
+    tzid = parameters(raw_parameters).get("TZID") if b"TZID" in raw_parameters else None
+    return datetime.datetime(
+        date.year,
+        date.month,
+        date.day,
+        int(text[9:11]),
+        int(text[11:13]),
+        int(text[13:15]),
+        tzinfo=zone(None if text.endswith("Z") else tzid),
+    )
+
+
+def parse_duration(value: bytes) -> datetime.timedelta:
+    """
+    >>> parse_duration(b"PT1H30M")
+    datetime.timedelta(seconds=5400)
+    """
+    match = DURATION.fullmatch(value.decode("ascii").strip())
+    if match is None:
+        raise ValueError(f"Invalid duration {value!r}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = datetime.timedelta(
+        weeks=int(weeks or 0),
+        days=int(days or 0),
+        hours=int(hours or 0),
+        minutes=int(minutes or 0),
+        seconds=int(seconds or 0),
+    )
+    return -duration if sign == "-" else duration
+
+
+def event_span(
+    properties: Properties,
+) -> tuple[
+    Union[datetime.datetime, datetime.date], Union[datetime.datetime, datetime.date]
+]:
+    """Start and end of an event, or of the first instance of a series"""
+    # cancelled instances of series may only have their original start
+    start = parse_date(*(properties.get("DTSTART") or properties["RECURRENCE-ID"])[0])
+    if "DTEND" in properties:
+        end = parse_date(*properties["DTEND"][0])
+    elif "DURATION" in properties:
+        end = start + parse_duration(properties["DURATION"][0][1])
+    elif isinstance(start, datetime.datetime):
+        end = start
+    else:
+        end = start + datetime.timedelta(days=1)
+    return start, end
+
+
+def text(properties: Properties, name: str) -> Optional[str]:
+    values = properties.get(name)
+    return unescape(values[0][1]) if values else None
+
+
+def uid_event_id(uid: str) -> str:
+    """
+    Source id of an event, `polycal` target UIDs are derived from it
+
+    UIDs of other systems can be too long or contain characters Google event ids
+    can't, so they are hashed.
+    """
+    return hashlib.blake2s(uid.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def parse_attendees(values: list[tuple[bytes, bytes]]) -> list[Attendee]:
+    attendees = []
+    for raw_parameters, value in values:
+        email = value.decode("utf-8", "replace")
+        if email.lower().startswith("mailto:"):
+            email = email[len("mailto:") :]
+        status = parameters(raw_parameters).get("PARTSTAT", "NEEDS-ACTION")
+        attendees.append(Attendee(email=email, status=PARTSTATS.get(status.upper())))
+    return attendees
+
+
+def vevent_to_event(
+    properties: Properties,
+    start: Union[datetime.datetime, datetime.date],
+    end: Union[datetime.datetime, datetime.date],
+    keep_src: bool = False,
+) -> Event:
+    uid = text(properties, "UID") or ""
+    event_id = uid_event_id(uid)
+    original_start = recurring_id = None
+    if "RECURRENCE-ID" in properties:
+        original_start = parse_date(*properties["RECURRENCE-ID"][0])
+        recurring_id = event_id
+        event_id = f"{event_id}_{recurrence.instance_suffix(original_start)}"
+    timezone = None
+    if isinstance(start, datetime.datetime) and isinstance(
+        start.tzinfo, zoneinfo.ZoneInfo
+    ):
+        timezone = start.tzinfo.key
+    return Event(
+        src=(
+            {
+                name.lower(): unescape(values[0][1])
+                for name, values in properties.items()
+            }
+            if keep_src
+            else None
+        ),
+        source_ids=[event_id],
+        iCalUID=f"{event_id}@polycal",
+        original_uid=uid or None,
+        sequence=int(properties.get("SEQUENCE", [(b"", b"0")])[0][1] or 0),
+        start=start,
+        end=end,
+        title=text(properties, "SUMMARY"),
+        description=text(properties, "DESCRIPTION"),
+        location=text(properties, "LOCATION"),
+        deleted=(text(properties, "STATUS") or "").upper() == "CANCELLED",
+        busy=(text(properties, "TRANSP") or "").upper() != "TRANSPARENT",
+        attendees=functools.partial(parse_attendees, properties.get("ATTENDEE", [])),
+        recurrence=[
+            f"{name}{raw_parameters.decode()}:{value.decode()}"
+            for name in RECURRENCE_PROPERTIES
+            for raw_parameters, value in properties.get(name, [])
+        ]
+        or None,
+        recurring_id=recurring_id,
+        original_start=original_start,
+        timezone=timezone,
+    )
+
+
+def overlaps(
+    start: Union[datetime.datetime, datetime.date],
+    end: Union[datetime.datetime, datetime.date],
+    window_start: float,
+    window_end: float,
+) -> bool:
+    """Whether an event overlaps the window, as `events().list` tells"""
+    start_key, end_key = dt_sort_key(start), dt_sort_key(end)
+    if start_key == end_key:
+        return window_start <= start_key < window_end
+    return start_key < window_end and end_key > window_start
+
+
+def window_dates(
+    start: datetime.datetime, end: datetime.datetime
+) -> tuple[bytes, bytes]:
+    """
+    Raw dates events have to end after and start before to overlap the window
+
+    With a day of margin, times in any time zone compare as their UTC dates.
+    """
+    margin = datetime.timedelta(days=1)
+    return (
+        f"{start.date() - margin:%Y%m%d}".encode(),
+        f"{end.date() + margin:%Y%m%d}".encode(),
+    )
+
+
+def may_overlap(
+    component: bytes,
+    window_start: float,
+    window_end: float,
+    dates: Optional[tuple[bytes, bytes]] = None,
+) -> bool:
+    """
+    Whether a VEVENT can overlap the window, judging by its raw content
+
+    Cheaper than parsing the whole event, which only events in the window or
+    (possibly) recurring are. Most events are told apart by comparing the
+    dates of their DTSTART and DTEND as bytes with `dates` (see
+    `window_dates`), anything unusual is left to the full parsing.
+    """
+    if b"RRULE" in component or b"RDATE" in component or b"RECURRENCE-ID" in component:
+        return True
+    properties: Properties = {}
+    for name, raw_parameters, value in SPAN_LINE.findall(component):
+        properties.setdefault(name.decode(), []).append((raw_parameters, value))
+    if dates is not None and "DTSTART" in properties:
+        if properties["DTSTART"][0][1][:8] > dates[1]:
+            return False
+        if "DTEND" in properties and properties["DTEND"][0][1][:8] < dates[0]:
+            return False
+    try:
+        start, end = event_span(properties)
+    except (KeyError, ValueError):
+        return True
+    return overlaps(start, end, window_start, window_end)
+
+
+def ended_before(event: Event, window_start: datetime.datetime) -> bool:
+    """Whether all rules of a series end before the window, without expanding it"""
+    if any(line.startswith("RDATE") for line in event.recurrence):
+        return False
+    untils = [
+        recurrence.UNTIL.search(line)
+        for line in event.recurrence
+        if line.startswith("RRULE")
+    ]
+    if not untils or None in untils:
+        return False
+    # a day of margin for time zones
+    cutoff = (window_start - event.duration - datetime.timedelta(days=1)).date()
+    return max(until.group(1) for until in untils) < f"{cutoff:%Y%m%d}"
+
+
+class IcsCalendarService:
+    """
+    Source backend reading events of an iCalendar file
+
+    Counterpart of `GoogleCalendarService` for `list_events` and
+    `list_events_changes`. There are no sync tokens in files, size and
+    modification time of the file are used instead: an unchanged file has no
+    changes, a changed one forces full sync.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path).expanduser()
+
+    def read_events(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        keep_src: bool = False,
+    ) -> tuple[list[Event], list[Event]]:
+        """
+        Events overlapping the window and all series with any instances
+
+        Modified instances are returned with single events, those which only
+        moved out of the window as deleted, so that their series skip them.
+        """
+        window_start, window_end = dt_sort_key(start), dt_sort_key(end)
+        dates = window_dates(start, end)
+        events, series = [], []
+        skipped = 0
+        for component in read_vevents(self.path):
+            if not may_overlap(component, window_start, window_end, dates):
+                continue
+            properties = parse_properties(component)
+            try:
+                event_start, event_end = event_span(properties)
+                is_series = any(name in properties for name in ("RRULE", "RDATE"))
+                in_window = overlaps(event_start, event_end, window_start, window_end)
+                if "RECURRENCE-ID" in properties:
+                    original_start = parse_date(*properties["RECURRENCE-ID"][0])
+                    if not in_window and not overlaps(
+                        original_start, original_start, window_start, window_end
+                    ):
+                        continue
+                elif not is_series and not in_window:
+                    continue
+                event = vevent_to_event(properties, event_start, event_end, keep_src)
+            except (KeyError, ValueError) as e:
+                skipped += 1
+                LOG.debug("Skipping invalid event of %s: %r", self.path, e)
+                continue
+            if is_series and event.recurring_id is None:
+                if not ended_before(event, start):
+                    series.append(event)
+            else:
+                event.deleted = event.deleted or not in_window
+                if event.deleted and event.recurring_id is None:
+                    continue
+                events.append(event)
+        if skipped:
+            LOG.warning("Skipped %d invalid events of %s", skipped, self.path)
+        return events, series
+
+    def list_events(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        keep_src: bool = False,
+        attendees: bool = True,
+        series: bool = False,
+    ) -> Iterator[Event]:
+        """
+        Events overlapping the window, sorted by start
+
+        With `series`, series with instances in the window are listed as single
+        events with their modified instances, not folded into them, as Google
+        lists them. `attendees` are only parsed when accessed.
+        """
+        events, all_series = self.read_events(start, end, keep_src=keep_src)
+        if series:
+            events.extend(
+                event
+                for event in all_series
+                if next(recurrence.instances(event, start, end), None) is not None
+            )
+            events.sort(key=event_sort_key)
+            return iter(events)
+        return iter(
+            recurrence.expand(
+                recurrence.fold_exceptions(events + all_series), start, end
+            )
+        )
+
+    def fetch_events(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        keep_src: bool = False,
+        attendees: bool = True,
+        series: bool = False,
+    ) -> FetchedEvents:
+        """`list_events`, fingerprinted by path, size and modification time"""
+        return FetchedEvents(
+            fingerprint=f"{self.path.resolve()}:{self.sync_token()}",
+            parse=lambda: self.list_events(
+                calendar_id, start, end, keep_src, attendees, series
+            ),
+        )
+
+    def sync_token(self) -> str:
+        stat = self.path.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def list_events_changes(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        sync_token: Optional[str] = None,
+        keep_src: bool = False,
+        attendees: bool = True,
+    ) -> CalendarChanges:
+        token = self.sync_token()
+        if sync_token is None:
+            events = list(self.list_events(calendar_id, start, end, keep_src=keep_src))
+            return CalendarChanges(events=events, removed_uids=set(), sync_token=token)
+        if sync_token != token:
+            raise SyncTokenExpired(calendar_id)
+        return CalendarChanges(events=[], removed_uids=set(), sync_token=token)
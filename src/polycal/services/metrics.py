@@ -0,0 +1,160 @@
+import contextlib
+import cProfile
+import json
+import pathlib
+import threading
+import time
+from typing import Any, Generator, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+PREFIX = "polycal_"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Metrics:
+    """
+    Thread-safe counters and gauges describing sync runs
+
+    Counters accumulate over the lifetime of the process, so with `polycal serve`
+    they cover all runs so far. Exported as JSON or in the Prometheus text format
+    understood by node_exporter's textfile collector.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types: dict[str, str] = {}
+        self.samples: dict[str, dict[Labels, float]] = {}
+
+    def add(self, kind: str, name: str, value: float, labels: dict[str, str]) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.types.setdefault(name, kind)
+            samples = self.samples.setdefault(name, {})
+            if kind == "counter":
+                samples[key] = samples.get(key, 0) + value
+            else:
+                samples[key] = value
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        self.add("counter", name, value, labels)
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        self.add("gauge", name, value, labels)
+
+    def get(self, name: str, **labels: str) -> float:
+        with self.lock:
+            return self.samples.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: str) -> Generator[None, None, None]:
+        """Add time spent in the block to counter `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - started, **labels)
+
+    def timed(
+        self, items: Iterable[T], name: str, count_name: str, **labels: str
+    ) -> Iterator[T]:
+        """
+        Pass `items` through, timing how long producing them takes
+
+        Time spent by the consumer between items is not included. Totals are
+        recorded once `items` are exhausted or the generator is closed.
+        """
+        seconds = 0.0
+        count = 0
+        iterator = iter(items)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += time.perf_counter() - started
+                    break
+                seconds += time.perf_counter() - started
+                count += 1
+                yield item
+        finally:
+            self.inc(name, seconds, **labels)
+            self.inc(count_name, count, **labels)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                f"{PREFIX}{name}": {
+                    "type": self.types[name],
+                    "samples": [
+                        {"labels": dict(labels), "value": value}
+                        for labels, value in sorted(samples.items())
+                    ],
+                }
+                for name, samples in sorted(self.samples.items())
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, metric in self.to_dict().items():
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for sample in metric["samples"]:
+                labels = ",".join(
+                    f'{label}="{escape_label(value)}"'
+                    for label, value in sample["labels"].items()
+                )
+                lines.append(
+                    f"{name}{{{labels}}} {sample['value']!r}"
+                    if labels
+                    else f"{name} {sample['value']!r}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: pathlib.Path) -> None:
+        """Atomically write metrics, as JSON if `path` ends with .json"""
+        content = self.to_json() if path.suffix == ".json" else self.to_prometheus()
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(content)
+        tmp_path.replace(path)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+class MeteredHttp:
+    """`httplib2.Http` compatible wrapper counting requests and payload bytes"""
+
+    def __init__(self, http: Any, metrics: Metrics):
+        self.http = http
+        self.metrics = metrics
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        self.metrics.inc("api_requests_total", method=method, status=str(resp.status))
+        self.metrics.inc("api_sent_bytes_total", len(body or b""))
+        self.metrics.inc("api_received_bytes_total", len(content or b""))
+        return resp, content
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.http, name)
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[pathlib.Path]) -> Generator[None, None, None]:
+    """Dump cProfile stats of the block (calling thread only) to `path`"""
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
@@ -0,0 +1,228 @@
+"""
+Client side rate limiting of Calendar API calls
+
+Google enforces per-user and per-project quotas of API calls per minute, every
+call of a batch request counts. `RateLimiter` spaces calls out with a token
+bucket and caps how many requests are in flight. Both limits adapt to rate
+limit errors: they are halved on errors and raised in steps while no errors
+come (additive increase, multiplicative decrease), so that concurrent jobs
+sharing a project settle on rates the quota allows.
+"""
+
+import collections
+import contextlib
+import dataclasses
+import logging
+import math
+import threading
+import time
+from typing import Callable, Generator, Optional
+
+from polycal.services.metrics import Metrics
+
+LOG = logging.getLogger(__name__)
+
+# limits are decreased at most once per this many seconds, rate limit errors
+# of requests already in flight shouldn't decrease them again; calls pause for
+# as long after a decrease, letting the quota window move on
+DECREASE_INTERVAL = 1.0
+# seconds of calls the rate observed before the first error is measured over
+RATE_WINDOW = 10.0
+# increases needed to get back to the limits before the first error
+RECOVERY_STEPS = 10
+
+
+@dataclasses.dataclass
+class QuotaUsage:
+    """Cumulative API usage, see `since` for usage of a single run"""
+
+    started: float = dataclasses.field(default_factory=time.monotonic)
+    calls: int = 0
+    throttled: int = 0
+    waited: float = 0.0
+
+    def since(self, earlier: "QuotaUsage") -> "QuotaUsage":
+        return QuotaUsage(
+            started=earlier.started,
+            calls=self.calls - earlier.calls,
+            throttled=self.throttled - earlier.throttled,
+            waited=self.waited - earlier.waited,
+        )
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket and concurrency limit adapting to rate limit errors
+
+    :param rate: API calls per second, unlimited if None until the first rate
+        limit error, the observed rate is halved then
+    :param burst: calls which can be made at once after a pause
+    :param min_rate: calls per second rate limit errors can't decrease rate below
+    :param recovery: seconds without rate limit errors before limits are
+        increased by a step
+    :param max_retries: retries of rate limited single requests
+    :param clock: monotonic time in seconds, and `sleep` waiting for it to pass,
+        replaced in tests
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: int = 20,
+        min_rate: float = 1.0,
+        recovery: float = 10.0,
+        max_retries: int = 5,
+        metrics: Optional[Metrics] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        # current limits, None for unlimited
+        self.rate = rate
+        self.concurrency: Optional[int] = None
+        # rate increase per `recovery`, and concurrency to recover to, set
+        # since the first rate limit error
+        self.step: Optional[float] = None
+        self.max_concurrency = 1
+        self.adjusted = -math.inf
+        self.tokens = float(burst)
+        self.refilled = clock()
+        self.active = 0
+        self.recent: collections.deque[tuple[float, int]] = collections.deque()
+        self.total = QuotaUsage(started=clock())
+
+    def usage(self) -> QuotaUsage:
+        with self.lock:
+            return dataclasses.replace(self.total, started=self.clock())
+
+    def acquire(self, calls: int = 1) -> None:
+        """Wait until `calls` API calls can be made"""
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            self.recover(now)
+            self.total.calls += calls
+            self.recent.append((now, calls))
+            while self.recent[0][0] < now - RATE_WINDOW:
+                self.recent.popleft()
+            if self.rate is None:
+                return
+            # calls over the burst are taken on credit, paid off by waiting
+            self.tokens -= calls
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.total.waited += wait
+        if wait:
+            self.sleep(wait)
+            if self.metrics is not None:
+                self.metrics.inc("rate_limit_wait_seconds_total", wait)
+
+    def refill(self, now: float) -> None:
+        """Add tokens for the time since the last refill, up to `burst`"""
+        if self.rate is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.refilled) * self.rate
+            )
+        self.refilled = now
+
+    @contextlib.contextmanager
+    def slot(self) -> Generator[None, None, None]:
+        """Hold one of the concurrent request slots for the block"""
+        with self.released:
+            if self.concurrency is not None and self.active >= self.concurrency:
+                started = self.clock()
+                while self.concurrency is not None and self.active >= self.concurrency:
+                    self.released.wait()
+                self.total.waited += self.clock() - started
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.released:
+                self.active -= 1
+                self.released.notify()
+
+    def throttled(self) -> None:
+        """Report a rate limit error, decreasing the limits and pausing calls"""
+        with self.lock:
+            now = self.clock()
+            self.total.throttled += 1
+            if self.metrics is not None:
+                self.metrics.inc("rate_limited_total")
+            self.refill(now)
+            if now - self.adjusted >= DECREASE_INTERVAL:
+                self.decrease(now)
+            self.tokens = min(self.tokens, -self.rate * DECREASE_INTERVAL)
+
+    def decrease(self, now: float) -> None:
+        rate = self.rate if self.rate is not None else self.observed_rate(now)
+        concurrency = self.concurrency or max(self.active, 1)
+        if self.step is None:
+            self.step = (self.max_rate or rate) / RECOVERY_STEPS
+            self.max_concurrency = concurrency
+        self.rate = max(rate / 2, self.min_rate)
+        self.concurrency = max(concurrency // 2, 1)
+        self.adjusted = now
+        LOG.warning(
+            "Rate limited, slowing down to %.1f calls/s, %d concurrent requests",
+            self.rate,
+            self.concurrency,
+        )
+        self.record_limits()
+
+    def observed_rate(self, now: float) -> float:
+        """Calls per second over the last `RATE_WINDOW` seconds"""
+        if not self.recent:
+            return self.min_rate
+        seconds = max(now - self.recent[0][0], 1.0)
+        return max(sum(calls for _, calls in self.recent) / seconds, self.min_rate)
+
+    def recover(self, now: float) -> None:
+        """
+        Increase the limits by a step, if `recovery` passed since the last change
+
+        Without configured `max_rate` the rate keeps increasing until the next
+        rate limit error, it's never unlimited again.
+        """
+        if self.step is None or now - self.adjusted < self.recovery:
+            return
+        self.adjusted = now
+        self.rate += self.step
+        if self.max_rate is not None and self.rate >= self.max_rate:
+            self.rate = self.max_rate
+        if self.concurrency is not None:
+            self.concurrency += 1
+            if self.concurrency >= self.max_concurrency:
+                self.concurrency = None
+        if self.rate == self.max_rate and self.concurrency is None:
+            LOG.info("Recovered from rate limiting")
+            self.step = None
+        self.record_limits()
+
+    def record_limits(self) -> None:
+        if self.metrics is not None:
+            # 0 for unlimited
+            self.metrics.set("rate_limit_calls_per_second", self.rate or 0)
+            self.metrics.set("rate_limit_concurrency", self.concurrency or 0)
+
+    def summary(self, since: QuotaUsage) -> str:
+        usage = self.usage().since(since)
+        seconds = self.clock() - usage.started
+        with self.lock:
+            rate, concurrency = self.rate, self.concurrency
+        limits = f"{rate:.1f}/s" if rate is not None else "unlimited"
+        if concurrency is not None:
+            limits += f", {concurrency} concurrent"
+        return (
+            f"{usage.calls} API calls ({usage.calls / seconds if seconds else 0:.1f}/s),"
+            f" {usage.throttled} rate limited, {usage.waited:.1f}s waited,"
+            f" limit {limits}"
+        )
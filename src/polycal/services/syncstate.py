@@ -0,0 +1,45 @@
+import datetime
+import logging
+import pathlib
+from typing import Optional
+
+import pydantic
+
+LOG = logging.getLogger(__name__)
+
+SYNC_STATE_FILE = "sync_state.json"
+
+
+class SyncStateModel(pydantic.BaseModel):
+    start: Optional[datetime.datetime] = None
+    end: Optional[datetime.datetime] = None
+    sync_tokens: dict[str, str] = {}
+    # hash of the sources and targets config the segments were synced with
+    config_hash: Optional[str] = None
+    # unix time of the last sync of window segments, by ISO segment start
+    segments: dict[str, float] = {}
+
+
+class SyncStateStore:
+    """Per-calendar sync tokens and window segments persisted between runs"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path / SYNC_STATE_FILE
+
+    def load(self) -> SyncStateModel:
+        if not self.path.exists():
+            return SyncStateModel()
+        try:
+            return SyncStateModel.parse_file(self.path)
+        except (ValueError, pydantic.ValidationError) as e:
+            LOG.warning("Ignoring invalid sync state %s: %r", self.path, e)
+            return SyncStateModel()
+
+    def save(self, state: SyncStateModel) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(state.json())
+        tmp_path.replace(self.path)
+
+    def clear(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
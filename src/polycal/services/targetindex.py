@@ -0,0 +1,169 @@
+import datetime
+import math
+import pathlib
+import sqlite3
+import time
+from typing import Iterable, NamedTuple, Optional
+
+from polycal.recurrence import end_key
+from polycal.services.batch import SyncReport
+from polycal.types import Event, dt_sort_key
+
+TARGET_INDEX_FILE = "target_index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, uid)
+);
+CREATE INDEX IF NOT EXISTS events_window ON events (calendar_id, start, end);
+CREATE TABLE IF NOT EXISTS reconciliations (
+    calendar_id TEXT PRIMARY KEY,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    reconciled_at REAL NOT NULL
+);
+"""
+
+
+class IndexedEvent(NamedTuple):
+    uid: str
+    event_id: str
+    start: float
+    end: float
+    fingerprint: str
+
+    def to_event(self) -> Event:
+        """Minimal event, good enough to be deleted from the target"""
+        return Event(
+            iCalUID=self.uid,
+            source_ids=[self.event_id],
+            start=datetime.datetime.fromtimestamp(self.start, datetime.timezone.utc),
+            # endless series
+            end=datetime.datetime.fromtimestamp(
+                self.start if math.isinf(self.end) else self.end, datetime.timezone.utc
+            ),
+        )
+
+
+class TargetIndex:
+    """
+    Local SQLite mirror of events polycal wrote to target calendars
+
+    The index is only trusted for a window which was fully reconciled with
+    the target calendar recently enough, see `needs_reconciliation`.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path / TARGET_INDEX_FILE
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def needs_reconciliation(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        max_age: datetime.timedelta,
+    ) -> bool:
+        row = self.connection.execute(
+            "SELECT start, end, reconciled_at FROM reconciliations"
+            " WHERE calendar_id = ?",
+            (calendar_id,),
+        ).fetchone()
+        if row is None:
+            return True
+        reconciled_start, reconciled_end, reconciled_at = row
+        return (
+            reconciled_start > dt_sort_key(start)
+            or reconciled_end < dt_sort_key(end)
+            or time.time() - reconciled_at > max_age.total_seconds()
+        )
+
+    def events(
+        self, calendar_id: str, start: datetime.datetime, end: datetime.datetime
+    ) -> dict[str, IndexedEvent]:
+        rows = self.connection.execute(
+            "SELECT uid, event_id, start, end, fingerprint FROM events"
+            " WHERE calendar_id = ? AND start < ? AND end > ?",
+            (calendar_id, dt_sort_key(end), dt_sort_key(start)),
+        )
+        return {row[0]: IndexedEvent(*row) for row in rows}
+
+    def lookup(self, calendar_id: str, uids: Iterable[str]) -> list[IndexedEvent]:
+        return [
+            IndexedEvent(*row)
+            for uid in uids
+            for row in self.connection.execute(
+                "SELECT uid, event_id, start, end, fingerprint FROM events"
+                " WHERE calendar_id = ? AND uid = ?",
+                (calendar_id, uid),
+            )
+        ]
+
+    def reconcile(
+        self,
+        calendar_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        events: Iterable[IndexedEvent],
+    ) -> None:
+        """Replace index content of the window with actual target events"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM events WHERE calendar_id = ? AND start < ? AND end > ?",
+                (calendar_id, dt_sort_key(end), dt_sort_key(start)),
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                ((calendar_id, *event) for event in events),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO reconciliations VALUES (?, ?, ?, ?)",
+                (calendar_id, dt_sort_key(start), dt_sort_key(end), time.time()),
+            )
+
+    def update(
+        self,
+        calendar_id: str,
+        report: SyncReport,
+        fingerprints: dict[str, tuple[Event, str]],
+    ) -> None:
+        """
+        Record successful operations of `report`
+
+        :param fingerprints: written events and their fingerprints by iCalUID
+        """
+        with self.connection:
+            for result in report.results:
+                if not result.ok:
+                    continue
+                if result.operation == "delete":
+                    self.connection.execute(
+                        "DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+                        (calendar_id, result.event_id),
+                    )
+                elif result.uid in fingerprints and result.event_id:
+                    event, fingerprint = fingerprints[result.uid]
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            calendar_id,
+                            result.uid,
+                            result.event_id,
+                            dt_sort_key(event.start),
+                            end_key(event),
+                            fingerprint,
+                        ),
+                    )
@@ -0,0 +1,128 @@
+"""
+Transformed events of unchanged sources, reused between runs
+
+Most source calendars don't change between runs, yet every run parses and
+transforms all of their events again. `TransformCache` keeps the output of
+source pipelines in SQLite, keyed by a fingerprint of what the source listed
+(see `FetchedEvents`) and of everything else the output depends on. Entries
+of a source are dropped once its transforms change, the rest are evicted in
+least recently used order once the cache outgrows `max_size`.
+"""
+
+import logging
+import pathlib
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from polycal.types import Event
+
+LOG = logging.getLogger(__name__)
+
+TRANSFORM_CACHE_FILE = "transform_cache.sqlite"
+# part of every key, bumped whenever transforms or `Event` change in a way
+# which makes earlier results invalid
+CACHE_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    source_id TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    events BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_source ON results (source_id);
+CREATE INDEX IF NOT EXISTS results_used ON results (used_at);
+"""
+
+
+class TransformCache:
+    """
+    Thread-safe store of pipeline results, as pickled lists of events
+
+    :param max_size: bytes of pickled events kept, results larger than that
+        aren't stored at all
+    """
+
+    def __init__(self, path: pathlib.Path, max_size: int = 256 * 2**20):
+        self.path = path / TRANSFORM_CACHE_FILE
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # fetch worker threads take turns, see `lock`
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def get(self, key: str) -> Optional[list[Event]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT events FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key)
+                )
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            LOG.warning("Dropping unreadable cached events: %r", e)
+            with self.lock, self.connection:
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+
+    def put(
+        self, key: str, source_id: str, config_hash: str, events: list[Event]
+    ) -> None:
+        """Store `events`, dropping results of the source's earlier config"""
+        data = pickle.dumps(events, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM results WHERE source_id = ? AND config_hash != ?",
+                (source_id, config_hash),
+            )
+            if len(data) > self.max_size:
+                LOG.info(
+                    "Not caching %d events of %s, %d bytes are over the limit",
+                    len(events),
+                    source_id,
+                    len(data),
+                )
+                return
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, source_id, config_hash, data, len(data), time.time()),
+            )
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop least recently used results over `max_size`"""
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_size:
+            return
+        evicted = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM results ORDER BY used_at"
+        ):
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+        LOG.debug("Evicted %d cached results", len(evicted))
+
+    def clear(self) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM results")
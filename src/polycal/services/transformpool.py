@@ -0,0 +1,155 @@
+"""
+Source transforms run in a pool of worker processes
+
+Transforms are pure Python, so however many sources there are, one core does
+all of the work. `TransformPool` runs the pipeline of every source in a worker
+process instead, started as soon as the source is fetched, so that sources are
+transformed in parallel with each other and with fetching of the next ones.
+
+Events are passed to and from workers packed column by column (see
+`pack_events`), several times cheaper than pickling them one by one.
+"""
+
+import itertools
+import multiprocessing
+import operator
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from polycal.pipeline import Pipeline, StageStats
+from polycal.transforms import Filter, Transform
+from polycal.types import Attendee, Event
+
+Stages = list[tuple[Transform, list[Filter]]]
+
+
+def pack_events(events: list[Event], attendees: bool = True) -> bytes:
+    """
+    Events as pickled columns of their fields
+
+    Columns without any values are left out, and so are attendees unless
+    `attendees`, unpacked events have none then.
+
+    >>> import datetime
+    >>> day = datetime.date(2024, 1, 1)
+    >>> events = [
+    ...     Event(iCalUID="a", source_ids=["1"], start=day, end=day, title="A"),
+    ...     Event(
+    ...         iCalUID="b",
+    ...         source_ids=["2"],
+    ...         start=day,
+    ...         end=day,
+    ...         attendees=[Attendee("x@example.com", "accepted")],
+    ...     ),
+    ... ]
+    >>> unpack_events(pack_events(events)) == events
+    True
+    >>> unpack_events(pack_events(events, attendees=False))[1].attendees
+    []
+    """
+    columns = []
+    for field in Event.fields:
+        if field == "attendees":
+            column = None
+            if attendees:
+                column = [
+                    [(attendee.email, attendee.status.value) for attendee in people]
+                    for people in map(operator.attrgetter(field), events)
+                ]
+        else:
+            column = list(map(operator.attrgetter(field), events))
+        columns.append(
+            column if column and any(value is not None for value in column) else None
+        )
+    return pickle.dumps((len(events), columns), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def unpack_events(data: bytes) -> list[Event]:
+    count, columns = pickle.loads(data)
+    attendees = columns[Event.fields.index("attendees")]
+    if attendees is not None:
+        columns[Event.fields.index("attendees")] = [
+            [Attendee(email, status) for email, status in people]
+            for people in attendees
+        ]
+    events = []
+    for state in zip(
+        *(
+            itertools.repeat(None, count) if column is None else column
+            for column in columns
+        )
+    ):
+        event = Event.__new__(Event)
+        event.__setstate__(state)
+        events.append(event)
+    return events
+
+
+def run_pipeline(
+    stages: Stages, data: bytes, timed: bool, columnar: bool, attendees: bool
+) -> tuple[bytes, dict[str, StageStats]]:
+    """Worker side of `TransformPool.process`"""
+    pipeline = Pipeline(stages, timed=timed, columnar=columnar)
+    events = list(pipeline.process(unpack_events(data)))
+    return pack_events(events, attendees=attendees), pipeline.stats
+
+
+class TransformPool:
+    """
+    Worker processes running source pipelines, started on first use
+
+    :param processes: number of workers, one per CPU by default
+    """
+
+    def __init__(self, processes: Optional[int] = None):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self._executor is None:
+                # spawned rather than forked from a process with fetch threads
+                # and open connections
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def process(
+        self, pipeline: Pipeline, events: Iterable[Event], attendees: bool = True
+    ) -> Callable[[], list[Event]]:
+        """
+        Start passing `events` through `pipeline` in a worker
+
+        Returns a function waiting for the resulting events, which also fills
+        `pipeline.stats` with those collected by the worker.
+
+        :param attendees: whether attendees are passed to the worker and back,
+            they are dropped otherwise
+        """
+        future = self.executor.submit(
+            run_pipeline,
+            pipeline.stages,
+            pack_events(list(events), attendees=attendees),
+            pipeline.timed,
+            pipeline.columnar,
+            attendees,
+        )
+
+        def result() -> list[Event]:
+            data, stats = future.result()
+            pipeline.stats.update(stats)
+            return unpack_events(data)
+
+        return result
+
+    def shutdown(self) -> None:
+        with self.lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
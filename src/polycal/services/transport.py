@@ -0,0 +1,159 @@
+"""
+Pooled HTTP transport for the Google API client
+
+`googleapiclient` sends requests through an `httplib2.Http` compatible object.
+`httplib2.Http` isn't thread-safe and holds its own connections, so every
+worker thread and every batch chunk used to open (and TLS handshake) new ones.
+`HttpTransport` serves all threads of a run from one `requests` connection
+pool, with a session per thread and credentials shared, and refreshed, by all
+of them.
+"""
+
+import logging
+import threading
+import urllib.parse
+from typing import TYPE_CHECKING, Any, Optional
+
+# requests and httplib2 are imported on first use, like Google client libraries
+if TYPE_CHECKING:
+    import httplib2
+    import requests
+
+LOG = logging.getLogger(__name__)
+
+
+class HttpTransport:
+    """
+    Thread-safe `httplib2.Http` compatible transport over a shared pool
+
+    :param creds: google-auth credentials, requests are sent unauthenticated
+        without them (e.g. to a local stand-in server)
+    :param pool_size: connections kept open per host, requests of more
+        concurrent threads than that open short-lived extra connections
+    :param connect_timeout: seconds to establish a connection
+    :param read_timeout: seconds to wait for response data
+    :param keep_alive: reuse connections between requests
+    """
+
+    def __init__(
+        self,
+        creds: Any = None,
+        pool_size: int = 10,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        keep_alive: bool = True,
+    ):
+        from requests.adapters import HTTPAdapter
+
+        # not `credentials`, googleapiclient would refresh those on its own
+        self.creds = creds
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+        )
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.environments: dict[tuple[str, str], dict[str, Any]] = {}
+
+    @property
+    def session(self) -> "requests.Session":
+        """Session of the calling thread, all sessions share the pool"""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            import requests
+
+            session = self.local.session = requests.Session()
+            # environment is looked up once per host by `environment`
+            session.trust_env = False
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+        return session
+
+    def environment(self, uri: str) -> dict[str, Any]:
+        """
+        Proxy and CA bundle settings from the environment for `uri`'s host
+
+        `requests` scans the environment on every request otherwise, which takes
+        about as long as a request to a local server.
+        """
+        origin = urllib.parse.urlsplit(uri)[:2]
+        settings = self.environments.get(origin)
+        if settings is None:
+            import requests
+
+            with requests.Session() as session:
+                settings = session.merge_environment_settings(uri, {}, None, None, None)
+            self.environments[origin] = settings
+        return settings
+
+    def authorize(self, headers: dict[str, str]) -> Optional[str]:
+        """Add authorization to `headers`, returns the access token used"""
+        if self.creds is None:
+            return None
+        with self.lock:
+            if not self.creds.valid:
+                self._refresh()
+            self.creds.apply(headers)
+            return self.creds.token
+
+    def refresh(self, rejected_token: Optional[str]) -> None:
+        """Refresh credentials, unless another thread already replaced the token"""
+        with self.lock:
+            if self.creds.token == rejected_token:
+                self._refresh()
+
+    def _refresh(self) -> None:
+        from google.auth.transport.requests import Request
+
+        LOG.debug("Refreshing access token")
+        self.creds.refresh(Request(self.session))
+
+    def request(
+        self,
+        uri: str,
+        method: str = "GET",
+        body: Any = None,
+        headers: Optional[dict[str, str]] = None,
+        redirections: int = 5,
+        connection_type: Any = None,
+    ) -> tuple["httplib2.Response", bytes]:
+        headers = dict(headers or {})
+        if not self.keep_alive:
+            headers["connection"] = "close"
+        for attempt in range(2):
+            request_headers = dict(headers)
+            token = self.authorize(request_headers)
+            response = self.session.request(
+                method,
+                uri,
+                data=body,
+                headers=request_headers,
+                timeout=self.timeout,
+                allow_redirects=redirections > 0,
+                **self.environment(uri),
+            )
+            if response.status_code != 401 or token is None or attempt:
+                break
+            # hand the connection back to the pool for the retry
+            response.close()
+            self.refresh(token)
+        return to_httplib2_response(response), response.content
+
+    def close(self) -> None:
+        self.adapter.close()
+
+
+def to_httplib2_response(response: "requests.Response") -> "httplib2.Response":
+    """`httplib2.Response` googleapiclient expects, of a `requests` response"""
+    import httplib2
+
+    info = {key.lower(): value for key, value in response.headers.items()}
+    # content is already decompressed, as httplib2 does it
+    if "content-encoding" in info:
+        info["-content-encoding"] = info.pop("content-encoding")
+        info["content-length"] = str(len(response.content))
+    info["status"] = str(response.status_code)
+    resp = httplib2.Response(info)
+    resp.reason = response.reason
+    return resp
@@ -1,132 +1,411 @@
 import datetime
-import itertools
+import heapq
 import re
-from collections import defaultdict
+from collections import deque
+from collections.abc import Hashable
 from datetime import timedelta
-from typing import Generator, Optional, Type, Union
+from typing import TYPE_CHECKING, Callable, Generator, Iterable, Optional, Type, TypeVar
 
-from polycal.types import AttendeeRSVP, Event
+from polycal.types import AttendeeRSVP, Event, dt_sort_key
+
+# numpy is an optional dependency, see `polycal.columnar`
+if TYPE_CHECKING:
+    import numpy as np
+
+    from polycal.columnar import EventBatch
+
+Predicate = Callable[[Event], bool]
+
+REGEX_SPECIAL_CHARS = frozenset(".^$*+?{}[]\\|()")
+# max number of distinct titles memoized by title matchers and replacements
+MEMO_SIZE = 2**16
+# event attributes columnar batches hold arrays of, see `polycal.columnar`
+COLUMN_ATTRS = frozenset(("busy", "deleted", "type", "title"))
+# event attributes `SetAttr` may set, the rest is sync bookkeeping
+SETTABLE_ATTRS = frozenset(
+    ("start", "end", "type", "title", "description", "location", "deleted", "busy")
+)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def getattr_by_path(value, path: str):
+    path_splitted = path.split(".")
+    for attr in path_splitted:
+        if isinstance(value, dict):
+            value = value.get(attr)
+        else:
+            value = getattr(value, attr)
+    return value
+
+
+class Filter:
+    """Predicate selecting events a transform applies to"""
+
+    # whether raw API payload (`Event.src`) is used
+    uses_src = False
+    # whether `Event.attendees` are used
+    uses_attendees = False
+    # whether `mask` works on columns, rather than calling `match` per event
+    vectorized = False
+
+    def match(self, event: Event) -> bool:
+        return True
+
+    def mask(self, batch: "EventBatch") -> "np.ndarray":
+        """`match` of every event of a columnar batch"""
+        return batch.event_mask(self.match)
+
+
+FILTERS: dict[str, Type[Filter]] = {}
+
+F = TypeVar("F", bound=Type[Filter])
+
+
+def register_filter(cls: F) -> F:
+    type_ = cls.__name__
+    assert type_ not in FILTERS, type_
+    FILTERS[type_] = cls
+    return cls
+
+
+@register_filter
+class ByAttr(Filter):
+    """Events with all given attributes (or `.` separated paths) equal"""
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        roots = {path.split(".")[0] for path in attrs}
+        self.uses_src = "src" in roots
+        self.uses_attendees = "attendees" in roots
+        self.vectorized = COLUMN_ATTRS.issuperset(attrs)
+
+    def match(self, event: Event) -> bool:
+        return all(
+            getattr_by_path(event, path) == value for path, value in self.attrs.items()
+        )
+
+    def mask(self, batch: "EventBatch") -> "np.ndarray":
+        return batch.all_of(
+            [batch.attr_mask(path, value) for path, value in self.attrs.items()]
+        )
+
+
+class TitleMatcher:
+    """
+    Check whether a title `re.match`-es any of many patterns at once
+
+    Patterns which are plain literals are looked up by title prefix in a set
+    per literal length; the rest is combined into a single alternation regex.
+    Patterns with capturing groups or global flags can't be safely combined
+    and are tried one by one. Results are memoized per distinct title.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.literals: dict[int, set[str]] = {}
+        combined = []
+        self.separate: list[re.Pattern] = []
+        for pattern in patterns:
+            if not REGEX_SPECIAL_CHARS.intersection(pattern):
+                self.literals.setdefault(len(pattern), set()).add(pattern)
+                continue
+            compiled = re.compile(pattern)
+            if compiled.groups or compiled.flags & ~re.UNICODE:
+                self.separate.append(compiled)
+            else:
+                combined.append(f"(?:{pattern})")
+        self.regex = re.compile("|".join(combined)) if combined else None
+        self.cache: dict[str, bool] = {}
+
+    def match(self, title: Optional[str]) -> bool:
+        title = title or ""
+        try:
+            return self.cache[title]
+        except KeyError:
+            pass
+        matched = (
+            any(
+                title[:length] in literals for length, literals in self.literals.items()
+            )
+            or (self.regex is not None and self.regex.match(title) is not None)
+            or any(pattern.match(title) for pattern in self.separate)
+        )
+        if len(self.cache) >= MEMO_SIZE:
+            self.cache.clear()
+        self.cache[title] = matched
+        return matched
+
+
+@register_filter
+class ByTitle(Filter):
+    """Events with title matching any of the patterns"""
+
+    vectorized = True
+
+    def __init__(self, titles: list[str]):
+        self.matcher = TitleMatcher(titles)
+
+    def match(self, event: Event) -> bool:
+        return self.matcher.match(event.title)
+
+    def mask(self, batch: "EventBatch") -> "np.ndarray":
+        return batch.value_mask("title", self.matcher.match)
+
+
+@register_filter
+class ByAttendee(Filter):
+    """Events attended by `email`, only if accepted with `confirmed`"""
+
+    uses_attendees = True
+
+    def __init__(self, email: str, confirmed: bool = False):
+        self.email = email
+        self.confirmed = confirmed
+
+    def match(self, event: Event) -> bool:
+        return any(
+            attendee.email == self.email
+            and (not self.confirmed or attendee.status == AttendeeRSVP.accepted)
+            for attendee in event.attendees
+        )
+
+
+@register_filter
+class ByDuration(Filter):
+    """Events lasting at least `min_duration` and at most `max_duration`"""
+
+    vectorized = True
+
+    def __init__(
+        self, min_duration: Optional[str] = None, max_duration: Optional[str] = None
+    ):
+        self.min_duration = (
+            interpret_human_timedelta(min_duration)
+            if min_duration is not None
+            else None
+        )
+        self.max_duration = (
+            interpret_human_timedelta(max_duration)
+            if max_duration is not None
+            else None
+        )
+
+    def match(self, event: Event) -> bool:
+        duration = event.duration
+        return (self.min_duration is None or duration >= self.min_duration) and (
+            self.max_duration is None or duration <= self.max_duration
+        )
+
+    def mask(self, batch: "EventBatch") -> "np.ndarray":
+        durations = batch.durations
+        masks = []
+        if self.min_duration is not None:
+            masks.append(durations >= self.min_duration // MICROSECOND)
+        if self.max_duration is not None:
+            masks.append(durations <= self.max_duration // MICROSECOND)
+        return batch.all_of(masks)
 
 
 class Transform:
+    # whether output for an event depends on other events in the stream
+    stateful = False
+    # whether raw API payload (`Event.src`) is used
+    uses_src = False
+    # whether `Event.attendees` are used
+    uses_attendees = False
+    # whether events are modified in place
+    mutates = True
+    # whether events may no longer be ordered by start afterwards
+    reorders = False
+    # whether `process_batch` is implemented
+    vectorized = False
+
+    def apply(self, event: Event) -> Optional[Event]:
+        """Transform single event, returning None drops it"""
+        return event
+
     def process(
-        self, events: Generator[Event, None, None]
+        self, events: Iterable[Event], include: Optional[Predicate] = None
     ) -> Generator[Event, None, None]:
-        yield from events
+        """
+        :param include: transform only events matching it, pass the rest as is
+        """
+        for event in events:
+            if include is None or include(event):
+                event = self.apply(event)
+            if event is not None:
+                yield event
+
+    def process_batch(
+        self, batch: "EventBatch", include: Optional["np.ndarray"] = None
+    ) -> Optional["EventBatch"]:
+        """
+        Transform a columnar batch, see `polycal.columnar`
+
+        :param include: mask of events to transform, the rest passes as is
+        :return: None if the batch can't be transformed as a whole, `process`
+            has to be used instead
+        """
+        return None
 
 
 TRANSFORMERS: dict[str, Type[Transform]] = {}
 
+T = TypeVar("T", bound=Type[Transform])
+
 
-def register(cls: Type[Transform]) -> None:
+def register(cls: T) -> T:
     type_ = cls.__name__
     assert type_ not in TRANSFORMERS, type_
     TRANSFORMERS[type_] = cls
+    return cls
 
 
 @register
 class ReplaceTitle(Transform):
+    vectorized = True
+
     def __init__(self, pattern: str = r"^.*$", repl: str = "n/a", **kwargs):
         self.pattern = re.compile(pattern, **kwargs)
         self.repl = repl
-
-    def process(
-        self, events: Generator[Event, None, None]
-    ) -> Generator[Event, None, None]:
-        for event in events:
-            event.title = self.pattern.sub(self.repl, event.title or "")
-            yield event
+        self.replacements = [(self.pattern, repl)]
+        self.cache: dict[str, str] = {}
+
+    @classmethod
+    def chain(cls, transforms: list["ReplaceTitle"]) -> "ReplaceTitle":
+        """Single transform doing replacements of all `transforms` in order"""
+        chained = cls.__new__(cls)
+        chained.replacements = [
+            replacement
+            for transform in transforms
+            for replacement in transform.replacements
+        ]
+        chained.cache = {}
+        return chained
+
+    def replace(self, title: Optional[str]) -> str:
+        title = title or ""
+        try:
+            return self.cache[title]
+        except KeyError:
+            replaced = title
+            for pattern, repl in self.replacements:
+                replaced = pattern.sub(repl, replaced)
+            if len(self.cache) >= MEMO_SIZE:
+                self.cache.clear()
+            self.cache[title] = replaced
+            return replaced
+
+    def apply(self, event: Event) -> Optional[Event]:
+        event.title = self.replace(event.title)
+        return event
+
+    def process_batch(
+        self, batch: "EventBatch", include: Optional["np.ndarray"] = None
+    ) -> Optional["EventBatch"]:
+        batch.replace_values("title", batch.rows(include), self.replace)
+        return batch
 
 
 @register
 class SetAttr(Transform):
     def __init__(self, **attrs):
         for attr_name in attrs:
-            assert attr_name in Event.__fields__
+            if attr_name not in SETTABLE_ATTRS:
+                raise ValueError(f"Can't set event attribute: {attr_name!r}")
         self.override = attrs
+        self.reorders = "start" in attrs
+        # start and end aren't kept in sync with their columns, values of
+        # the other columns are interned
+        self.vectorized = not {"start", "end"} & attrs.keys() and all(
+            isinstance(value, Hashable)
+            for attr_name, value in attrs.items()
+            if attr_name in COLUMN_ATTRS
+        )
 
-    def process(
-        self, events: Generator[Event, None, None]
-    ) -> Generator[Event, None, None]:
-        for event in events:
-            for attr_name, value in self.override.items():
-                setattr(event, attr_name, value)
-            yield event
+    def apply(self, event: Event) -> Optional[Event]:
+        for attr_name, value in self.override.items():
+            setattr(event, attr_name, value)
+        return event
+
+    def process_batch(
+        self, batch: "EventBatch", include: Optional["np.ndarray"] = None
+    ) -> Optional["EventBatch"]:
+        rows = batch.rows(include)
+        for attr_name, value in self.override.items():
+            batch.set_attr(rows, attr_name, value)
+        return batch
+
+
+class Skip(Transform):
+    """Drop events matching `self.filter`"""
+
+    mutates = False
+    filter: Filter
+
+    @property
+    def uses_src(self) -> bool:
+        return self.filter.uses_src
+
+    @property
+    def uses_attendees(self) -> bool:
+        return self.filter.uses_attendees
+
+    @property
+    def vectorized(self) -> bool:
+        return self.filter.vectorized
+
+    def apply(self, event: Event) -> Optional[Event]:
+        return None if self.filter.match(event) else event
+
+    def process_batch(
+        self, batch: "EventBatch", include: Optional["np.ndarray"] = None
+    ) -> Optional["EventBatch"]:
+        matched = self.filter.mask(batch)
+        if include is not None:
+            matched = matched & include
+        return batch.select(~matched)
 
 
 @register
-class SkipByAttr(Transform):
+class SkipByAttr(Skip):
     def __init__(self, **skip_by):
-        self.skip_by = skip_by
+        self.filter = ByAttr(**skip_by)
 
-    def process(
-        self, events: Generator[Event, None, None]
-    ) -> Generator[Event, None, None]:
-        for event in events:
-            if not all(
-                self.getattr_by_path(event, attr_name) == value
-                for attr_name, value in self.skip_by.items()
-            ):
-                yield event
-
-    @staticmethod
-    def getattr_by_path(value, path: str):
-        path_splitted = path.split(".")
-        for attr in path_splitted:
-            if isinstance(value, dict):
-                value = value.get(attr)
-            else:
-                value = getattr(value, attr)
-        return value
+    getattr_by_path = staticmethod(getattr_by_path)
 
 
 @register
-class SkipByTitle(Transform):
+class SkipByTitle(Skip):
     def __init__(self, titles: list[str]):
-        self.patterns = [re.compile(title) for title in titles]
-
-    def process(
-        self, events: Generator[Event, None, None]
-    ) -> Generator[Event, None, None]:
-        for event in events:
-            if not any(pattern.match(event.title) for pattern in self.patterns):
-                yield event
+        self.filter = ByTitle(titles)
 
 
 @register
-class SkipByAttendee(Transform):
+class SkipByAttendee(Skip):
     def __init__(self, email: str, confirmed: bool = False):
-        self.email = email
-        self.confirmed = confirmed
-
-    def process(
-        self, events: Generator[Event, None, None]
-    ) -> Generator[Event, None, None]:
-        for event in events:
-            if not any(
-                attendee.email == self.email
-                and (not self.confirmed or attendee.status == AttendeeRSVP.accepted)
-                for attendee in event.attendees
-            ):
-                yield event
+        self.filter = ByAttendee(email, confirmed)
 
 
 @register
-class SkipByDuration(Transform):
+class SkipByDuration(Skip):
     def __init__(self, min_duration: str):
         self.min_duration = interpret_human_timedelta(min_duration)
-
-    def process(
-        self, events: Generator[Event, None, None]
-    ) -> Generator[Event, None, None]:
-        for event in events:
-            if event.duration > self.min_duration:
-                yield event
+        self.filter = ByDuration(max_duration=min_duration)
 
 
 @register
 class Merge(Transform):
-    """Merge events with the same title and overlapping time ranges."""
+    """
+    Merge events with the same title and overlapping time ranges.
+
+    Events are expected to be ordered by start time, as they are returned by
+    Google Calendar API; `Pipeline` sorts them again after transforms which
+    `reorders` them. All-day events, and events not matching `include`, are
+    never merged.
+    """
+
+    stateful = True
+    vectorized = True
 
     def __init__(self, elipsis: Optional[str] = None):
         """
@@ -135,33 +414,163 @@ class Merge(Transform):
         self.elipsis = interpret_human_timedelta(elipsis) if elipsis else timedelta()
 
     def process(
-        self, events: Generator[Event, None, None]
+        self, events: Iterable[Event], include: Optional[Predicate] = None
     ) -> Generator[Event, None, None]:
-        merged_events = defaultdict(list)
-
-        def sort_dt_key(dt: Union[datetime.date, datetime.datetime]) -> datetime:
-            return datetime.datetime.combine(dt, datetime.datetime.min.time())
-
-        for event in sorted(events, key=lambda e: sort_dt_key(e.start)):
-            similar_events = merged_events[event.title]
-            for existing_event in similar_events:
-                if isinstance(event.start, datetime.datetime) and isinstance(
-                    existing_event.start, datetime.datetime
+        elipsis_seconds = self.elipsis.total_seconds()
+        # [event, closed] entries in order of the first merged event;
+        # merged event is yielded once it and all preceding ones are closed
+        pending = deque()
+        # the only interval per title that later events can still extend
+        open_entries = {}
+        # (end + elipsis, n, entry) of open entries, lazily updated
+        close_heap = []
+
+        for n, event in enumerate(events):
+            start_key = dt_sort_key(event.start)
+            while close_heap and close_heap[0][0] < start_key:
+                _, _, entry = heapq.heappop(close_heap)
+                merged_event = entry[0]
+                if (
+                    not entry[1]
+                    and dt_sort_key(merged_event.end) + elipsis_seconds < start_key
                 ):
-                    if (
-                        existing_event.start <= event.start
-                        and event.start - self.elipsis <= existing_event.end
-                    ):
-                        existing_event.end = max(existing_event.end, event.end)
-                        break
+                    entry[1] = True
+                    if open_entries.get(merged_event.title) is entry:
+                        del open_entries[merged_event.title]
+
+            if not isinstance(event.start, datetime.datetime) or (
+                include is not None and not include(event)
+            ):
+                pending.append([event, True])
             else:
-                similar_events.append(event)
-        yield from sorted(
-            itertools.chain.from_iterable(
-                similar_events for similar_events in merged_events.values()
-            ),
-            key=lambda e: sort_dt_key(e.start),
+                entry = open_entries.get(event.title)
+                if entry and event.start - self.elipsis <= entry[0].end:
+                    entry[0].end = max(entry[0].end, event.end)
+                else:
+                    if entry:
+                        entry[1] = True
+                    entry = open_entries[event.title] = [event, False]
+                    pending.append(entry)
+                heapq.heappush(
+                    close_heap,
+                    (dt_sort_key(entry[0].end) + elipsis_seconds, n, entry),
+                )
+
+            while pending and pending[0][1]:
+                yield pending.popleft()[0]
+
+        for merged_event, _ in pending:
+            yield merged_event
+
+    def process_batch(
+        self, batch: "EventBatch", include: Optional["np.ndarray"] = None
+    ) -> Optional["EventBatch"]:
+        mergeable = ~batch.all_day if include is None else ~batch.all_day & include
+        return batch.merge(batch.rows(mergeable), self.elipsis // MICROSECOND)
+
+
+def normalize_title(title: str) -> str:
+    """
+    >>> normalize_title("  Weekly   SYNC ")
+    'weekly sync'
+    """
+    return " ".join(title.casefold().split())
+
+
+@register
+class Dedup(Transform):
+    """
+    Collapse copies of the same event coming from multiple calendars.
+
+    Events are copies if they have the same `Event.original_uid` (and, for
+    instances of series, `Event.original_start`) or, with `titles`, the same
+    title up to case and whitespace, and both their starts and their ends are
+    at most `tolerance` apart. Events of the same source calendar are never
+    copies of each other. The first copy is kept, with `source_ids` of all of
+    them. Events are expected to be ordered by start time, as target transforms
+    get them. Cancelled events, series, and events not matching `include` pass
+    as they are.
+    """
+
+    stateful = True
+
+    def __init__(self, tolerance: Optional[str] = None, titles: bool = False):
+        self.tolerance = (
+            interpret_human_timedelta(tolerance) if tolerance else timedelta()
         )
+        self.titles = titles
+
+    def keys(self, event: Event) -> list[Hashable]:
+        keys = []
+        if event.original_uid:
+            # instances of a series share its UID
+            keys.append(("uid", event.original_uid, event.original_start))
+        if self.titles and event.title:
+            keys.append(("title", normalize_title(event.title)))
+        return keys
+
+    def process(
+        self, events: Iterable[Event], include: Optional[Predicate] = None
+    ) -> Generator[Event, None, None]:
+        tolerance = self.tolerance.total_seconds()
+        # (end, kept event, its source calendars) by key, in order of start;
+        # events starting more than `tolerance` before the current one can't
+        # have copies any more
+        index: dict[Hashable, deque[tuple[float, Event, set]]] = {}
+        # keys of indexed events, in the same order
+        indexed: deque[tuple[float, Hashable]] = deque()
+        # events in order, yielded once no more copies can be collapsed into them
+        pending: deque[tuple[float, Event]] = deque()
+
+        for event in events:
+            start_key = dt_sort_key(event.start)
+            while indexed and indexed[0][0] + tolerance < start_key:
+                _, key = indexed.popleft()
+                entries = index[key]
+                entries.popleft()
+                if not entries:
+                    del index[key]
+            while pending and pending[0][0] + tolerance < start_key:
+                yield pending.popleft()[1]
+
+            if (
+                event.deleted
+                or event.recurrence
+                or (include is not None and not include(event))
+            ):
+                pending.append((start_key, event))
+                continue
+            keys = self.keys(event)
+            end_key = dt_sort_key(event.end)
+            calendar_id = event.calendar_id
+            entry = next(
+                (
+                    entry
+                    for key in keys
+                    for entry in index.get(key, ())
+                    if abs(entry[0] - end_key) <= tolerance
+                    and type(entry[1].start) is type(event.start)
+                    and (calendar_id is None or calendar_id not in entry[2])
+                ),
+                None,
+            )
+            if entry is not None:
+                _, kept, calendar_ids = entry
+                kept.source_ids += [
+                    source_id
+                    for source_id in event.source_ids
+                    if source_id not in kept.source_ids
+                ]
+                calendar_ids.add(calendar_id)
+                continue
+            entry = (end_key, event, {calendar_id})
+            for key in keys:
+                index.setdefault(key, deque()).append(entry)
+                indexed.append((start_key, key))
+            pending.append((start_key, event))
+
+        for _, event in pending:
+            yield event
 
 
 def interpret_human_timedelta(timedelta_str: str) -> timedelta:
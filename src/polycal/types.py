@@ -1,8 +1,9 @@
 import datetime
 import enum
-from typing import Any, Optional, Union
+from typing import Any, Callable, Optional, Union
 
-import pydantic
+# https://developers.google.com/calendar/api/v3/reference/events/import
+MAX_UID_LENGTH = 255
 
 
 @enum.unique
@@ -13,26 +14,187 @@ class AttendeeRSVP(str, enum.Enum):
     accepted = "accepted"
 
 
-class Attendee(pydantic.BaseModel):
-    email: str
-    status: AttendeeRSVP = AttendeeRSVP.needs_action
+class Attendee:
+    __slots__ = ("email", "status")
 
+    def __init__(
+        self,
+        email: str,
+        status: Union[AttendeeRSVP, str, None] = AttendeeRSVP.needs_action,
+    ):
+        self.email = email
+        self.status = AttendeeRSVP(status or AttendeeRSVP.needs_action)
 
-class Event(pydantic.BaseModel):
-    src: Any
-    iCalUID: pydantic.constr(max_length=255)
-    sequence: int = 0
-    source_ids: list[str]
-    start: Union[datetime.datetime, datetime.date]
-    end: Union[datetime.datetime, datetime.date]
-    type: str = "default"
-    title: Optional[str] = None
-    description: Optional[str] = None
-    location: Optional[str] = None
-    deleted: bool = False
-    busy: bool = True
-    attendees: list[Attendee] = []
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Attendee) and (self.email, self.status) == (
+            other.email,
+            other.status,
+        )
+
+    def __repr__(self) -> str:
+        return f"Attendee(email={self.email!r}, status={self.status!r})"
+
+
+class Event:
+    """
+    Calendar event as passed through the transforms
+
+    Plain slotted class rather than pydantic model, as there are many of them
+    and they come from already well-formed API responses; see `validate` for
+    checks done before an event is written out. `attendees` may be given as
+    a callable, which is only called once they are accessed. `src` (the raw
+    API payload) is only kept when some transform needs it.
+
+    Recurring series, when not expanded into instances, are a single event
+    with `recurrence` rules, timed by its first instance; see
+    `polycal.recurrence`.
+    """
+
+    fields = (
+        "src",
+        "iCalUID",
+        "original_uid",
+        "sequence",
+        "source_ids",
+        "start",
+        "end",
+        "type",
+        "title",
+        "description",
+        "location",
+        "deleted",
+        "busy",
+        "attendees",
+        "fingerprint",
+        "recurrence",
+        "recurring_id",
+        "original_start",
+        "timezone",
+        "calendar_id",
+    )
+    __slots__ = tuple(field for field in fields if field != "attendees") + (
+        "_attendees",
+    )
+
+    def __init__(
+        self,
+        *,
+        iCalUID: str,
+        source_ids: list[str],
+        start: Union[datetime.datetime, datetime.date],
+        end: Union[datetime.datetime, datetime.date],
+        src: Any = None,
+        # iCalUID in the source calendar, shared by copies of the event in
+        # other calendars, unlike `iCalUID` written to the target
+        original_uid: Optional[str] = None,
+        sequence: int = 0,
+        type: str = "default",
+        title: Optional[str] = None,
+        description: Optional[str] = None,
+        location: Optional[str] = None,
+        deleted: bool = False,
+        busy: bool = True,
+        attendees: Union[list[Attendee], Callable[[], list[Attendee]], None] = None,
+        # content fingerprint, as stored in the target calendar
+        fingerprint: Optional[str] = None,
+        # RRULE, EXRULE, RDATE and EXDATE lines of a series
+        recurrence: Optional[list[str]] = None,
+        # source id of the series an instance belongs to
+        recurring_id: Optional[str] = None,
+        # start of an instance as given by the series rules
+        original_start: Union[datetime.datetime, datetime.date, None] = None,
+        # IANA time zone of a series, which its rules are expanded in
+        timezone: Optional[str] = None,
+        # id of the source calendar the event comes from
+        calendar_id: Optional[str] = None,
+    ):
+        self.src = src
+        self.iCalUID = iCalUID
+        self.original_uid = original_uid
+        self.sequence = sequence
+        self.source_ids = source_ids
+        self.start = start
+        self.end = end
+        self.type = type
+        self.title = title
+        self.description = description
+        self.location = location
+        self.deleted = deleted
+        self.busy = busy
+        self._attendees = attendees
+        self.fingerprint = fingerprint
+        self.recurrence = recurrence
+        self.recurring_id = recurring_id
+        self.original_start = original_start
+        self.timezone = timezone
+        self.calendar_id = calendar_id
+
+    @property
+    def attendees(self) -> list[Attendee]:
+        if self._attendees is None:
+            self._attendees = []
+        elif callable(self._attendees):
+            self._attendees = self._attendees()
+        return self._attendees
+
+    @attendees.setter
+    def attendees(self, attendees: list[Attendee]) -> None:
+        self._attendees = attendees
 
     @property
     def duration(self) -> datetime.timedelta:
         return self.end - self.start
+
+    def validate(self) -> None:
+        if len(self.iCalUID) > MAX_UID_LENGTH:
+            raise ValueError(f"iCalUID too long: {self.iCalUID!r}")
+        if not isinstance(self.start, datetime.date) or type(self.start) is not type(
+            self.end
+        ):
+            raise ValueError(f"Invalid start/end of {self!r}")
+
+    def copy(self) -> "Event":
+        event = Event.__new__(Event)
+        event.__setstate__(self.__getstate__())
+        event.source_ids = list(self.source_ids)
+        if isinstance(self._attendees, list):
+            event._attendees = list(self._attendees)
+        return event
+
+    def __getstate__(self) -> tuple:
+        # lazy attendees are kept unconverted
+        return tuple(
+            self._attendees if field == "attendees" else getattr(self, field)
+            for field in self.fields
+        )
+
+    def __setstate__(self, state: tuple) -> None:
+        for field, value in zip(self.fields, state):
+            setattr(self, field, value)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Event) and all(
+            getattr(self, field) == getattr(other, field) for field in self.fields
+        )
+
+    def __repr__(self) -> str:
+        return "Event({})".format(
+            ", ".join(
+                f"{field}={getattr(self, field)!r}"
+                for field in self.fields
+                if field != "src"
+            )
+        )
+
+
+def dt_sort_key(dt: Union[datetime.datetime, datetime.date]) -> float:
+    """Comparable timestamp of date or datetime, naive values are treated as UTC"""
+    if not isinstance(dt, datetime.datetime):
+        dt = datetime.datetime.combine(dt, datetime.time())
+    if not dt.tzinfo:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def event_sort_key(event: Event) -> float:
+    return dt_sort_key(event.start)
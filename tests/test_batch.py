@@ -0,0 +1,189 @@
+import datetime
+
+import pytest
+
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.services.batch import SyncReport
+from polycal.services.gcal import EventPatch
+from polycal.services.metrics import Metrics
+from polycal.services.ratelimit import RateLimiter
+from polycal.types import Event
+
+TARGET_ID = "target@example.com"
+START = datetime.datetime(2024, 1, 1, 9, tzinfo=datetime.timezone.utc)
+
+
+def make_events(count: int, title: str = "Meeting") -> list[Event]:
+    return [
+        Event(
+            iCalUID=f"event{n}@polycal",
+            source_ids=[f"source{n}"],
+            start=START + datetime.timedelta(hours=n),
+            end=START + datetime.timedelta(hours=n + 1),
+            title=title,
+        )
+        for n in range(count)
+    ]
+
+
+@pytest.fixture
+def api() -> FakeCalendarApi:
+    return FakeCalendarApi()
+
+
+@pytest.fixture
+def service(api) -> FakeGoogleCalendarService:
+    return FakeGoogleCalendarService(api, metrics=Metrics())
+
+
+def sync(service: FakeGoogleCalendarService, events: list[Event], **kwargs):
+    kwargs.setdefault("chunk_size", 3)
+    return service.sync_events(TARGET_ID, events, backoff=0, **kwargs)
+
+
+def written(api: FakeCalendarApi) -> dict[str, str]:
+    """Titles of events in the target, by iCalUID"""
+    return {
+        event["iCalUID"]: event.get("summary")
+        for event in api.dump().get(TARGET_ID, [])
+        if event.get("status") != "cancelled"
+    }
+
+
+def imported(service: FakeGoogleCalendarService, count: int) -> SyncReport:
+    report = sync(service, make_events(count))
+    assert not report.failed
+    return report
+
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_chunks(api, service, concurrency):
+    report = sync(service, make_events(10), concurrency=concurrency)
+    metrics = service.metrics
+    assert metrics.get("api_batch_requests_total") == 4
+    assert metrics.get("api_batched_calls_total") == 10
+    assert [result.uid for result in report.results] == [
+        event.iCalUID for event in make_events(10)
+    ]
+    assert all(result.attempts == 1 and result.event_id for result in report.results)
+    assert report.count("import") == 10
+    assert report.summary() == "10 import, 0 retried, 0 failed"
+    assert written(api) == {event.iCalUID: "Meeting" for event in make_events(10)}
+
+
+def test_retryable_errors_are_retried(api, service):
+    api.fail("events.import", "event1@polycal", 500, 429)
+    api.fail("events.import", "event4@polycal", 503)
+    report = sync(service, make_events(5))
+    assert not report.failed
+    assert {result.uid: result.attempts for result in report.retried} == {
+        "event1@polycal": 3,
+        "event4@polycal": 2,
+    }
+    assert report.summary() == "5 import, 2 retried, 0 failed"
+    assert service.metrics.get("write_retries_total") == 3
+    assert len(written(api)) == 5
+
+
+def test_other_errors_fail_without_interrupting_the_rest(api, service):
+    api.fail("events.import", "event1@polycal", 400)
+    report = sync(service, make_events(5))
+    (failed,) = report.failed
+    assert (failed.uid, failed.attempts) == ("event1@polycal", 1)
+    assert failed.error.resp.status == 400
+    assert report.summary() == "4 import, 0 retried, 1 failed"
+    assert "event1@polycal" not in written(api)
+    assert len(written(api)) == 4
+
+
+def test_retries_are_limited(api, service):
+    api.fail("events.import", "event0@polycal", 500, 500, 500)
+    report = sync(service, make_events(2), max_retries=2)
+    (failed,) = report.failed
+    assert (failed.uid, failed.attempts) == ("event0@polycal", 3)
+    assert failed.error.resp.status == 500
+
+
+def test_failed_batch_requests_are_retried(api, service):
+    api.fail_batch(503)
+    report = sync(service, make_events(5))
+    assert not report.failed
+    # the first chunk was sent twice
+    assert service.metrics.get("api_batch_requests_total") == 3
+    assert service.metrics.get("write_retries_total") == 3
+    assert len(written(api)) == 5
+
+    api.fail_batch(400)
+    report = sync(service, make_events(5))
+    assert [result.ok for result in report.results] == [False] * 3 + [True] * 2
+
+
+def test_patches_of_missing_events_fall_back_to_import(api, service):
+    events = make_events(3)
+    report = imported(service, 3)
+    event_ids = [result.event_id for result in report.results]
+    api.fail("events.patch", event_ids[1], 404)
+    api.fail("events.patch", event_ids[2], 410)
+    for event in events:
+        event.title = "Moved"
+    patches = {
+        event.iCalUID: EventPatch(event_id, frozenset({"summary"}))
+        for event, event_id in zip(events, event_ids)
+    }
+    # missing from the target, but not from the index
+    patches["new@polycal"] = EventPatch("missing", frozenset({"summary"}))
+    new = make_events(1, title="New")[0]
+    new.iCalUID = "new@polycal"
+
+    report = sync(service, events + [new], patches=patches)
+    assert not report.failed
+    assert [result.operation for result in report.results] == [
+        "patch",
+        "import",
+        "import",
+        "import",
+    ]
+    assert report.count("patch") == 1
+    assert written(api) == {
+        **{event.iCalUID: "Moved" for event in events},
+        "new@polycal": "New",
+    }
+
+
+def test_no_fallback_on_the_last_attempt(api, service):
+    (event,) = make_events(1)
+    report = sync(
+        service,
+        [event],
+        patches={event.iCalUID: EventPatch("missing", frozenset({"summary"}))},
+        max_retries=0,
+    )
+    (failed,) = report.failed
+    assert failed.operation == "patch"
+    assert failed.error.resp.status == 404
+
+
+def test_deletes_of_missing_events_succeed(api, service):
+    report = imported(service, 3)
+    deleted = make_events(3)
+    for event, result in zip(deleted, report.results):
+        event.deleted = True
+        event.source_ids = [result.event_id]
+    deleted[1].source_ids = ["missing"]
+    api.fail("events.delete", report.results[2].event_id, 410)
+
+    report = sync(service, deleted)
+    assert not report.failed
+    assert report.count("delete") == 3
+    # neither was actually deleted, but both count as gone from the target
+    assert written(api) == {"event1@polycal": "Meeting", "event2@polycal": "Meeting"}
+
+
+def test_rate_limit_errors_slow_down(api):
+    limiter = RateLimiter()
+    service = FakeGoogleCalendarService(api, limiter=limiter)
+    api.fail("events.import", "event0@polycal", 429)
+    report = sync(service, make_events(3))
+    assert not report.failed
+    assert limiter.usage().throttled == 1
+    assert limiter.rate is not None
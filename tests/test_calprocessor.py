@@ -0,0 +1,237 @@
+import datetime
+from typing import Any
+
+import pydantic
+import pytest
+
+from benchmarks.calgen import gdatetime
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.services.calprocessor import (
+    CalendarProcessor,
+    ConfigModel,
+    segment_boundaries,
+)
+from polycal.services.gcal import GoogleCalendarEvent
+from polycal.services.syncstate import SyncStateStore
+
+SOURCE_ID = "source@example.com"
+TARGET_ID = "target@example.com"
+TOMORROW = datetime.datetime.utcnow().replace(
+    hour=0, minute=0, second=0, microsecond=0
+) + datetime.timedelta(days=1)
+DAYS = 10
+
+
+def gevent(
+    number: int, start: datetime.datetime, title: str = "Meeting"
+) -> GoogleCalendarEvent:
+    return {
+        "id": f"event{number}",
+        "iCalUID": f"event{number}@example.com",
+        "status": "confirmed",
+        "summary": title,
+        "start": gdatetime(start),
+        "end": gdatetime(start + datetime.timedelta(hours=1)),
+    }
+
+
+def daily_events(title: str) -> list[GoogleCalendarEvent]:
+    """An event at 10:00 of every day of the window"""
+    return [
+        gevent(day, TOMORROW + datetime.timedelta(days=day, hours=10), title)
+        for day in range(DAYS)
+    ]
+
+
+def make_config(**kwargs) -> ConfigModel:
+    return ConfigModel(
+        sources=[{"id": SOURCE_ID}],
+        target={"id": TARGET_ID, "name": "target"},
+        batch={"backoff": 0},
+        **kwargs,
+    )
+
+
+def make_processor(api: FakeCalendarApi, tmp_path, **kwargs) -> CalendarProcessor:
+    return CalendarProcessor(
+        config=make_config(**kwargs),
+        gcal_service=FakeGoogleCalendarService(api),
+        sync_state=SyncStateStore(tmp_path),
+    )
+
+
+def target_titles(api: FakeCalendarApi) -> list[str]:
+    events = FakeGoogleCalendarService(api).list_events(
+        TARGET_ID, TOMORROW, TOMORROW + datetime.timedelta(days=DAYS)
+    )
+    return [event.title for event in sorted(events, key=lambda event: event.start)]
+
+
+def spy(monkeypatch, obj: Any, name: str) -> list[tuple]:
+    """Record arguments of calls of a method"""
+    calls = []
+    method = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return method(*args, **kwargs)
+
+    monkeypatch.setattr(obj, name, wrapper)
+    return calls
+
+
+@pytest.fixture
+def incremental(tmp_path, monkeypatch):
+    """Processor which did an initial full incremental sync, and its API"""
+    api = FakeCalendarApi()
+    api.load(SOURCE_ID, daily_events("old"))
+    processor = make_processor(api, tmp_path, incremental=True)
+    processor.full_syncs = spy(monkeypatch, processor, "process_full")
+    processor.changes = spy(monkeypatch, processor, "process_changes")
+    processor.process(TOMORROW, TOMORROW + datetime.timedelta(days=DAYS))
+    assert len(processor.full_syncs) == 1
+    assert target_titles(api) == ["old"] * DAYS
+    return processor, api
+
+
+def test_incremental_sync_reuses_sync_tokens(incremental):
+    processor, api = incremental
+    state = processor.sync_state.load()
+    assert (state.start, state.end) == (
+        TOMORROW,
+        TOMORROW + datetime.timedelta(days=DAYS),
+    )
+    assert set(state.sync_tokens) == {SOURCE_ID}
+
+    api.load(SOURCE_ID, daily_events("new")[:3])
+    processor.process(state.start, state.end)
+    assert len(processor.full_syncs) == 1
+    assert len(processor.changes) == 1
+    assert target_titles(api) == ["new"] * 3 + ["old"] * (DAYS - 3)
+    # tokens are saved after every sync
+    assert processor.sync_state.load().sync_tokens != state.sync_tokens
+
+
+def test_incremental_sync_removes_events(incremental):
+    processor, api = incremental
+    api.load(
+        SOURCE_ID,
+        [
+            {**daily_events("old")[0], "status": "cancelled"},
+            # moved out of the window
+            gevent(1, TOMORROW - datetime.timedelta(days=2)),
+        ],
+    )
+    processor.process(TOMORROW, TOMORROW + datetime.timedelta(days=DAYS))
+    assert len(processor.changes) == 1
+    assert target_titles(api) == ["old"] * (DAYS - 2)
+
+
+def test_incremental_sync_skips_unchanged_calendars(incremental):
+    processor, api = incremental
+    api.load(SOURCE_ID, daily_events("new"))
+    processor.process(
+        TOMORROW, TOMORROW + datetime.timedelta(days=DAYS), calendar_ids=set()
+    )
+    assert len(processor.changes) == 1
+    assert target_titles(api) == ["old"] * DAYS
+
+
+def test_expired_sync_tokens_fall_back_to_full_sync(incremental):
+    processor, api = incremental
+    tokens = processor.sync_state.load().sync_tokens
+    api.expire_sync_tokens()
+    api.load(SOURCE_ID, daily_events("new"))
+    processor.process(TOMORROW, TOMORROW + datetime.timedelta(days=DAYS))
+    assert len(processor.changes) == 1
+    assert len(processor.full_syncs) == 2
+    assert target_titles(api) == ["new"] * DAYS
+    assert processor.sync_state.load().sync_tokens.keys() == tokens.keys()
+    assert processor.sync_state.load().sync_tokens != tokens
+
+
+def test_moved_window_falls_back_to_full_sync(incremental):
+    processor, api = incremental
+    start, end = TOMORROW, TOMORROW + datetime.timedelta(days=DAYS - 1)
+    processor.process(start, end)
+    assert not processor.changes
+    assert len(processor.full_syncs) == 2
+    state = processor.sync_state.load()
+    assert (state.start, state.end) == (start, end)
+
+
+def test_segment_boundaries():
+    start = datetime.datetime(2024, 1, 3, 12)
+    end = datetime.datetime(2024, 1, 17)
+    assert segment_boundaries(start, end, weeks=True) == [
+        start,
+        # Mondays
+        datetime.datetime(2024, 1, 8),
+        datetime.datetime(2024, 1, 15),
+        end,
+    ]
+    midnight = datetime.datetime(2024, 1, 1)
+    assert segment_boundaries(midnight, midnight + datetime.timedelta(days=2)) == [
+        midnight,
+        datetime.datetime(2024, 1, 2),
+        datetime.datetime(2024, 1, 3),
+    ]
+    assert segment_boundaries(start, start + datetime.timedelta(hours=1)) == [
+        start,
+        start + datetime.timedelta(hours=1),
+    ]
+
+
+def test_stale_segments(tmp_path):
+    api = FakeCalendarApi()
+    api.load(SOURCE_ID, daily_events("old"))
+    processor = make_processor(
+        api, tmp_path, window={"segment": "day", "near": "1d", "max_age": "1h"}
+    )
+    start, end = TOMORROW, TOMORROW + datetime.timedelta(days=DAYS)
+
+    def process() -> tuple[float, float]:
+        metrics = processor.metrics
+        stale = metrics.get("window_segments_total", state="stale")
+        fresh = metrics.get("window_segments_total", state="fresh")
+        processor.process(start, end)
+        return (
+            metrics.get("window_segments_total", state="stale") - stale,
+            metrics.get("window_segments_total", state="fresh") - fresh,
+        )
+
+    assert process() == (DAYS, 0)
+    assert target_titles(api) == ["old"] * DAYS
+
+    api.load(SOURCE_ID, daily_events("new"))
+    # only the near segment is synced, events of the others are left as they are
+    assert process() == (1, DAYS - 1)
+    assert target_titles(api) == ["new"] + ["old"] * (DAYS - 1)
+
+    # segments synced longer than `max_age` ago expire
+    state = processor.sync_state.load()
+    expired = sorted(state.segments)[DAYS // 2 :]
+    processor.sync_state.save(
+        state.copy(
+            update={
+                "segments": {
+                    key: synced - 2 * 3600 if key in expired else synced
+                    for key, synced in state.segments.items()
+                }
+            }
+        )
+    )
+    assert process() == (1 + len(expired), DAYS - 1 - len(expired))
+    assert target_titles(api) == (
+        ["new"] + ["old"] * (DAYS - 1 - len(expired)) + ["new"] * len(expired)
+    )
+
+    # everything is synced again once the config changes
+    processor.config.sources[0].name = "renamed"
+    assert process() == (DAYS, 0)
+    assert target_titles(api) == ["new"] * DAYS
+
+
+def test_segments_and_incremental_are_exclusive():
+    with pytest.raises(pydantic.ValidationError, match="segments"):
+        make_config(incremental=True, window={"segment": "day"})
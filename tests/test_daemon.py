@@ -0,0 +1,153 @@
+import queue
+import socket
+import threading
+import time
+from typing import Optional
+
+import pytest
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, generate_calendars
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+from polycal.services.daemon import SyncDaemon
+from polycal.services.syncstate import SyncStateStore
+
+SOURCE_IDS = ["a@example.com", "b@example.com", "c@example.com"]
+# sync within this many seconds after the last notification, scaled down from
+# the configured (whole seconds) debounce to keep tests fast
+DEBOUNCE = 0.3
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class RecordingProcessor(CalendarProcessor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.synced: queue.Queue[Optional[set[str]]] = queue.Queue()
+        self.fetched_changes: queue.Queue[Optional[set[str]]] = queue.Queue()
+        self.closed = threading.Event()
+
+    def process(self, start, end, calendar_ids=None):
+        super().process(start, end, calendar_ids)
+        self.synced.put(calendar_ids)
+
+    def process_changes(self, start, end, state, calendar_ids=None):
+        super().process_changes(start, end, state, calendar_ids)
+        self.fetched_changes.put(calendar_ids)
+
+    def close(self):
+        super().close()
+        self.closed.set()
+
+
+@pytest.fixture
+def api() -> FakeCalendarApi:
+    api = FakeCalendarApi()
+    for calendar_id, events in generate_calendars(SOURCE_IDS, 300).items():
+        api.load(calendar_id, events)
+    return api
+
+
+@pytest.fixture
+def daemon(api, tmp_path):
+    port = free_port()
+    config = ConfigModel(
+        sources=[{"id": source_id} for source_id in SOURCE_IDS],
+        target={"id": "target@example.com", "name": "target"},
+        # enabled by the daemon
+        incremental=False,
+        batch={"backoff": 0},
+        serve={
+            "port": port,
+            "webhook_url": f"http://127.0.0.1:{port}/notifications",
+        },
+    )
+    service = FakeGoogleCalendarService(api)
+    processor = RecordingProcessor(
+        config=config,
+        gcal_service=service,
+        sync_state=SyncStateStore(tmp_path),
+        gcal_service_factory=lambda: FakeGoogleCalendarService(api),
+    )
+    daemon = SyncDaemon(
+        config, processor, service, window=lambda now: (WINDOW_START, WINDOW_END)
+    )
+    daemon.debounce = DEBOUNCE
+    return daemon
+
+
+@pytest.fixture
+def running(daemon):
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        # the first sync covers all calendars, once they are all watched
+        assert daemon.processor.synced.get(timeout=30) is None
+        yield daemon
+    finally:
+        daemon.stop()
+        thread.join(timeout=30)
+    assert not thread.is_alive()
+
+
+def test_notifications_sync_changed_calendars(api, running):
+    assert all(api.notifier.watching(source_id) for source_id in SOURCE_IDS)
+
+    for _ in range(3):
+        api.modify("a@example.com", 1)
+        api.notifier.notify("a@example.com")
+        api.modify("b@example.com", 1)
+        api.notifier.notify("b@example.com")
+    # sent by Google when a channel is opened, not a change
+    api.notifier.notify("c@example.com", state="sync")
+
+    synced = running.processor.synced
+    assert synced.get(timeout=30) == {"a@example.com", "b@example.com"}
+    # only changes of the notified calendars were fetched
+    assert running.processor.fetched_changes.get_nowait() == {
+        "a@example.com",
+        "b@example.com",
+    }
+    # the burst was debounced into the single sync
+    with pytest.raises(queue.Empty):
+        synced.get(timeout=3 * DEBOUNCE)
+
+
+def test_stop_closes_channels_and_processor(api, running):
+    running.stop()
+    assert running.processor.closed.wait(timeout=30)
+    assert not api.notifier.channels
+
+
+def test_collect_changes_max_debounce(daemon):
+    daemon.max_debounce = 4 * DEBOUNCE
+    stop_sending = threading.Event()
+
+    def send() -> None:
+        while not stop_sending.is_set():
+            daemon.changed.put("a@example.com")
+            time.sleep(DEBOUNCE / 3)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    try:
+        started = time.time()
+        changed = daemon.collect_changes(timeout=10)
+        elapsed = time.time() - started
+    finally:
+        stop_sending.set()
+        sender.join()
+    assert changed == {"a@example.com"}
+    # continuous notifications don't postpone the sync past `max_debounce`
+    assert elapsed < 4 * DEBOUNCE + DEBOUNCE
+
+
+def test_window_segments_are_rejected(daemon):
+    processor = daemon.processor
+    processor.config.window.segment = "day"
+    with pytest.raises(ValueError, match="segments"):
+        SyncDaemon(processor.config, processor, daemon.gcal_service)
@@ -0,0 +1,211 @@
+import datetime
+import os
+
+import pytest
+
+from polycal.services.gcal import SyncTokenExpired
+from polycal.services.ics import IcsCalendarService, uid_event_id
+
+UTC = datetime.timezone.utc
+CALENDAR_ID = "calendar.ics"
+WINDOW_START = datetime.datetime(2024, 1, 1)
+WINDOW_END = datetime.datetime(2024, 2, 1)
+
+ICS = """\
+BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//polycal//tests//EN
+BEGIN:VEVENT
+UID:utc
+DTSTART:20240105T100000Z
+DTEND:20240105T110000Z
+SUMMARY:A title folded
+  over lines
+DESCRIPTION:Room 1\\, floor 2\\nBring laptop
+BEGIN:VALARM
+ACTION:DISPLAY
+DESCRIPTION:Not the description
+TRIGGER:-PT15M
+END:VALARM
+END:VEVENT
+BEGIN:VEVENT
+UID:all-day
+DTSTART;VALUE=DATE:20240110
+DTEND;VALUE=DATE:20240111
+SUMMARY:Holiday
+TRANSP:TRANSPARENT
+END:VEVENT
+BEGIN:VEVENT
+UID:zoned
+DTSTART;TZID=Europe/Warsaw:20240115T120000
+DURATION:PT30M
+SUMMARY:Lunch
+END:VEVENT
+BEGIN:VEVENT
+UID:before
+DTSTART:20231231T230000Z
+DTEND:20240101T000000Z
+SUMMARY:Ends as the window starts
+END:VEVENT
+BEGIN:VEVENT
+UID:after
+DTSTART:20240201T000000Z
+DTEND:20240201T010000Z
+SUMMARY:Starts as the window ends
+END:VEVENT
+BEGIN:VEVENT
+UID:cancelled
+DTSTART:20240120T100000Z
+DTEND:20240120T110000Z
+SUMMARY:Cancelled
+STATUS:CANCELLED
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly
+DTSTART:20231204T090000Z
+DTEND:20231204T100000Z
+RRULE:FREQ=WEEKLY;BYDAY=MO
+SUMMARY:Weekly
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly
+RECURRENCE-ID:20240108T090000Z
+DTSTART:20240108T150000Z
+DTEND:20240108T160000Z
+SUMMARY:Weekly, moved
+END:VEVENT
+BEGIN:VEVENT
+UID:ended
+DTSTART:20230102T090000Z
+DTEND:20230102T100000Z
+RRULE:FREQ=DAILY;UNTIL=20230110T090000Z
+SUMMARY:Ended
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / CALENDAR_ID
+    path.write_bytes(ICS.replace("\n", "\r\n").encode())
+    return path
+
+
+@pytest.fixture
+def service(path) -> IcsCalendarService:
+    return IcsCalendarService(path)
+
+
+def instance_id(uid: str, suffix: str) -> str:
+    return f"{uid_event_id(uid)}_{suffix}"
+
+
+def test_list_events(service):
+    events = list(service.list_events(CALENDAR_ID, WINDOW_START, WINDOW_END))
+    assert [(event.title, event.start) for event in events] == [
+        ("Weekly", datetime.datetime(2024, 1, 1, 9, tzinfo=UTC)),
+        ("A title folded over lines", datetime.datetime(2024, 1, 5, 10, tzinfo=UTC)),
+        ("Weekly, moved", datetime.datetime(2024, 1, 8, 15, tzinfo=UTC)),
+        ("Holiday", datetime.date(2024, 1, 10)),
+        ("Weekly", datetime.datetime(2024, 1, 15, 9, tzinfo=UTC)),
+        ("Lunch", datetime.datetime(2024, 1, 15, 11, tzinfo=UTC)),  # 12:00 in Warsaw
+        ("Weekly", datetime.datetime(2024, 1, 22, 9, tzinfo=UTC)),
+        ("Weekly", datetime.datetime(2024, 1, 29, 9, tzinfo=UTC)),
+    ]
+    by_id = {event.source_ids[0]: event for event in events}
+
+    utc = by_id[uid_event_id("utc")]
+    # not the description of the nested alarm
+    assert utc.description == "Room 1, floor 2\nBring laptop"
+    assert utc.iCalUID == f"{uid_event_id('utc')}@polycal"
+    assert utc.original_uid == "utc"
+    assert utc.timezone is None
+
+    all_day = by_id[uid_event_id("all-day")]
+    assert all_day.end == datetime.date(2024, 1, 11)
+    assert not all_day.busy
+
+    zoned = by_id[uid_event_id("zoned")]
+    assert zoned.timezone == "Europe/Warsaw"
+    assert zoned.duration == datetime.timedelta(minutes=30)
+
+    # the modified instance replaces the one of its series
+    moved = by_id[instance_id("weekly", "20240108T090000Z")]
+    assert moved.recurring_id == uid_event_id("weekly")
+    assert moved.original_start == datetime.datetime(2024, 1, 8, 9, tzinfo=UTC)
+    assert {event.source_ids[0] for event in events if event.title == "Weekly"} == {
+        instance_id("weekly", f"202401{day:02}T090000Z") for day in (1, 15, 22, 29)
+    }
+
+
+def test_list_series(service):
+    events = list(
+        service.list_events(CALENDAR_ID, WINDOW_START, WINDOW_END, series=True)
+    )
+    assert [event.title for event in events] == [
+        "Weekly",
+        "A title folded over lines",
+        "Weekly, moved",
+        "Holiday",
+        "Lunch",
+    ]
+    series = events[0]
+    assert series.source_ids == [uid_event_id("weekly")]
+    assert series.start == datetime.datetime(2023, 12, 4, 9, tzinfo=UTC)
+    assert series.recurrence == ["RRULE:FREQ=WEEKLY;BYDAY=MO"]
+
+
+def test_list_events_outside_series(service):
+    # series ending before the window aren't expanded
+    events = list(
+        service.list_events(
+            CALENDAR_ID, datetime.datetime(2023, 1, 5), datetime.datetime(2023, 1, 7)
+        )
+    )
+    assert [event.start.day for event in events] == [5, 6]
+    assert not list(
+        service.list_events(
+            CALENDAR_ID, datetime.datetime(2023, 2, 1), datetime.datetime(2023, 3, 1)
+        )
+    )
+
+
+def test_list_events_changes(service, path):
+    changes = service.list_events_changes(CALENDAR_ID, WINDOW_START, WINDOW_END)
+    assert len(changes.events) == 8
+    assert not changes.removed_uids
+    token = changes.sync_token
+
+    # an unchanged file has no changes
+    changes = service.list_events_changes(
+        CALENDAR_ID, WINDOW_START, WINDOW_END, sync_token=token
+    )
+    assert (changes.events, changes.removed_uids) == ([], set())
+    assert changes.sync_token == token
+    fingerprint = service.fetch_events(
+        CALENDAR_ID, WINDOW_START, WINDOW_END
+    ).fingerprint
+
+    # a changed one forces full sync, even without its size changing
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    with pytest.raises(SyncTokenExpired):
+        service.list_events_changes(
+            CALENDAR_ID, WINDOW_START, WINDOW_END, sync_token=token
+        )
+    assert (
+        service.fetch_events(CALENDAR_ID, WINDOW_START, WINDOW_END).fingerprint
+        != fingerprint
+    )
+    path.write_bytes(path.read_bytes().replace(b"SUMMARY:Lunch", b"SUMMARY:Dinner"))
+    changes = service.list_events_changes(CALENDAR_ID, WINDOW_START, WINDOW_END)
+    assert changes.sync_token != token
+    assert "Dinner" in [event.title for event in changes.events]
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / CALENDAR_ID
+    path.touch()
+    service = IcsCalendarService(path)
+    assert not list(service.list_events(CALENDAR_ID, WINDOW_START, WINDOW_END))
@@ -0,0 +1,129 @@
+import datetime
+from typing import Callable, Iterable
+
+import pytest
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, generate_calendars
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.pipeline import Pipeline
+from polycal.transforms import (
+    ByAttendee,
+    ByAttr,
+    ByDuration,
+    ByTitle,
+    Merge,
+    ReplaceTitle,
+    SetAttr,
+    SkipByAttr,
+    SkipByDuration,
+    SkipByTitle,
+)
+from polycal.types import Event
+
+SOURCE_ID = "source@example.com"
+
+
+def make_stages() -> list:
+    return [
+        (SkipByAttr(type="outOfOffice"), []),
+        (ReplaceTitle(r"^Sync: (\w+)$", r"Sync \1"), []),
+        # merged into a chain with the previous one
+        (ReplaceTitle("^Lunch$", "Break"), []),
+        (SetAttr(busy=False), [ByTitle(["Break", "Office hours"])]),
+        (SkipByDuration("20m"), []),
+        (SetAttr(title="Accepted"), [ByAttendee(SOURCE_ID, confirmed=True)]),
+        (Merge("15m"), []),
+        (ReplaceTitle("^Standup$", "Daily"), [ByDuration(max_duration="1h")]),
+        (SkipByTitle(["Retro", "Design"]), [ByDuration(min_duration="45m")]),
+        (Merge(), []),
+    ]
+
+
+def matching(filters: list) -> Callable[[Event], bool]:
+    return lambda event: all(filter_.match(event) for filter_ in filters)
+
+
+def one_by_one(stages: list, events: Iterable[Event]) -> list[Event]:
+    """Every transform run on its own, as a generator over the previous one"""
+    for transform, filters in stages:
+        events = transform.process(events, matching(filters) if filters else None)
+    return list(events)
+
+
+@pytest.fixture(scope="module")
+def service() -> FakeGoogleCalendarService:
+    api = FakeCalendarApi()
+    api.load(SOURCE_ID, generate_calendars([SOURCE_ID], 3000)[SOURCE_ID])
+    return FakeGoogleCalendarService(api)
+
+
+def list_events(service: FakeGoogleCalendarService) -> list[Event]:
+    return list(service.list_events(SOURCE_ID, WINDOW_START, WINDOW_END))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("shared", [False, True])
+def test_pipeline_matches_transforms_one_by_one(service, columnar, shared):
+    if columnar:
+        pytest.importorskip("numpy")
+    expected = one_by_one(make_stages(), list_events(service))
+    events = list_events(service)
+    pipeline = Pipeline(make_stages(), columnar=columnar, shared=shared)
+    if not columnar:
+        # stateless transforms are fused
+        assert len(pipeline.segments) < len(pipeline.stages)
+    assert list(pipeline.process(events)) == expected
+    if shared:
+        assert events == list_events(service)
+
+
+def test_timed_pipeline_counts_events(service):
+    events = list_events(service)
+    pipeline = Pipeline(make_stages(), timed=True)
+    processed = list(pipeline.process(events))
+    assert processed == one_by_one(make_stages(), list_events(service))
+    stats = pipeline.stats
+    assert next(iter(stats.values())).events_in == len(events)
+    assert list(stats.values())[-1].events_out == len(processed)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_pipeline_sorts_events_moved_before_stateful_transforms(columnar):
+    if columnar:
+        pytest.importorskip("numpy")
+    day = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def at(hour: float) -> datetime.datetime:
+        return day + datetime.timedelta(hours=hour)
+
+    events = [
+        Event(iCalUID=uid, source_ids=[uid], start=at(start), end=at(end), title="x")
+        for uid, start, end in [("a", 9, 9.5), ("b", 10, 11), ("c", 12, 13)]
+    ]
+    events[2].location = "moved"
+    pipeline = Pipeline(
+        [
+            (SetAttr(start=at(9.25)), [ByAttr(location="moved")]),
+            (Merge(), []),
+        ],
+        columnar=columnar,
+    )
+    assert [
+        (event.iCalUID, event.start, event.end) for event in pipeline.process(events)
+    ] == [("a", at(9), at(13))]
+
+
+def test_pipeline_sorts_events_moved_at_the_end():
+    day = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    events = [
+        Event(
+            iCalUID=uid,
+            source_ids=[uid],
+            start=day + datetime.timedelta(hours=hour),
+            end=day + datetime.timedelta(hours=14),
+            title=uid,
+        )
+        for uid, hour in [("a", 9), ("b", 10), ("c", 12)]
+    ]
+    pipeline = Pipeline([(SetAttr(start=day), [ByTitle(["c"])])])
+    assert [event.iCalUID for event in pipeline.process(events)] == ["c", "a", "b"]
@@ -0,0 +1,152 @@
+import contextlib
+import threading
+
+import pytest
+
+from polycal.services.metrics import Metrics
+from polycal.services.ratelimit import DECREASE_INTERVAL, RECOVERY_STEPS, RateLimiter
+
+
+class FakeClock:
+    """Monotonic clock which only moves when slept on, or explicitly"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def make_limiter(clock: FakeClock, **kwargs) -> RateLimiter:
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_unlimited(clock):
+    limiter = make_limiter(clock)
+    for _ in range(1000):
+        limiter.acquire()
+    assert not clock.sleeps
+    assert limiter.usage().calls == 1000
+
+
+def test_token_bucket(clock):
+    limiter = make_limiter(clock, rate=10, burst=5)
+    for _ in range(5):
+        limiter.acquire()
+    assert not clock.sleeps
+    # calls over the burst wait for tokens to be refilled
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == pytest.approx([0.1, 0.1])
+    # calls of a batch are taken at once, on credit
+    limiter.acquire(calls=3)
+    assert clock.sleeps[-1] == pytest.approx(0.3)
+    # a pause refills the bucket, up to `burst`
+    clock.now += 60
+    clock.sleeps.clear()
+    for _ in range(5):
+        limiter.acquire()
+    assert not clock.sleeps
+    limiter.acquire()
+    assert clock.sleeps == pytest.approx([0.1])
+    assert limiter.usage().waited == pytest.approx(0.6)
+
+
+def test_decrease(clock):
+    metrics = Metrics()
+    limiter = make_limiter(clock, min_rate=2, metrics=metrics)
+    limiter.acquire(calls=100)
+    clock.now = 10
+    limiter.throttled()
+    # half of the observed rate
+    assert limiter.rate == pytest.approx(5)
+    assert limiter.concurrency == 1
+    assert metrics.get("rate_limited_total") == 1
+    assert metrics.get("rate_limit_calls_per_second") == pytest.approx(5)
+    # errors of requests already in flight don't decrease the limits again
+    limiter.throttled()
+    assert limiter.rate == pytest.approx(5)
+    # calls pause for `DECREASE_INTERVAL`, on top of the rate
+    limiter.acquire()
+    assert clock.sleeps == pytest.approx([DECREASE_INTERVAL + 1 / 5])
+
+    limiter.throttled()
+    assert limiter.rate == pytest.approx(2.5)
+    clock.now += DECREASE_INTERVAL
+    limiter.throttled()
+    # but not below `min_rate`
+    assert limiter.rate == pytest.approx(2)
+    assert limiter.usage().throttled == 4
+
+
+def test_recover(clock):
+    limiter = make_limiter(clock, rate=8, recovery=10)
+    with contextlib.ExitStack() as stack:
+        for _ in range(4):
+            stack.enter_context(limiter.slot())
+        limiter.throttled()
+    assert (limiter.rate, limiter.concurrency) == (4, 2)
+
+    clock.now += 9
+    limiter.acquire()
+    assert (limiter.rate, limiter.concurrency) == (4, 2)
+    clock.now += 1
+    limiter.acquire()
+    assert limiter.rate == pytest.approx(4 + 8 / RECOVERY_STEPS)
+    assert limiter.concurrency == 3
+    clock.now += 10
+    limiter.acquire()
+    # concurrency from before the first error is unlimited again
+    assert limiter.concurrency is None
+    for _ in range(RECOVERY_STEPS):
+        clock.now += 10
+        limiter.acquire()
+    # never over the configured rate
+    assert limiter.rate == 8
+    assert limiter.step is None
+
+
+def test_recover_without_configured_rate(clock):
+    limiter = make_limiter(clock)
+    limiter.acquire(calls=100)
+    clock.now = 10
+    limiter.throttled()
+    for _ in range(2 * RECOVERY_STEPS):
+        clock.now += limiter.recovery
+        limiter.acquire()
+    # steps are a fraction of the observed rate, the rate keeps increasing
+    # until the next error
+    assert limiter.step == pytest.approx(10 / RECOVERY_STEPS)
+    assert limiter.rate == pytest.approx(5 + 2 * RECOVERY_STEPS * limiter.step)
+
+
+def test_slot_concurrency(clock):
+    limiter = make_limiter(clock)
+    with limiter.slot(), limiter.slot():
+        limiter.throttled()
+    assert limiter.concurrency == 1
+
+    entered = threading.Event()
+
+    def request() -> None:
+        with limiter.slot():
+            entered.set()
+
+    with limiter.slot():
+        thread = threading.Thread(target=request)
+        thread.start()
+        assert not entered.wait(timeout=0.2)
+        assert limiter.active == 1
+    assert entered.wait(timeout=10)
+    thread.join()
+    assert limiter.active == 0
@@ -0,0 +1,87 @@
+import datetime
+
+from polycal import recurrence
+from polycal.types import Event
+
+UTC = datetime.timezone.utc
+WINDOW_START = datetime.datetime(2024, 1, 1)
+WINDOW_END = datetime.datetime(2024, 2, 1)
+
+
+def make_series(start: datetime.datetime, rule: str, **kwargs) -> Event:
+    return Event(
+        iCalUID="series@google.com",
+        source_ids=["series"],
+        start=start,
+        end=start + datetime.timedelta(hours=1),
+        recurrence=[rule],
+        **kwargs,
+    )
+
+
+def test_bounded_rebases_and_ends_series_in_window():
+    series = make_series(
+        datetime.datetime(2023, 6, 5, 10, tzinfo=UTC),
+        "RRULE:FREQ=WEEKLY;BYDAY=MO",
+        timezone="Europe/Warsaw",
+    )
+    bounded = recurrence.bounded(series, WINDOW_START, WINDOW_END)
+    # 12:00 in Warsaw, in winter time
+    assert bounded.start == datetime.datetime(2024, 1, 1, 11, tzinfo=UTC)
+    assert bounded.duration == series.duration
+    assert bounded.recurrence == ["RRULE:FREQ=WEEKLY;BYDAY=MO;UNTIL=20240129T110000Z"]
+    assert [
+        instance.start
+        for instance in recurrence.instances(bounded, WINDOW_START, WINDOW_END)
+    ] == [
+        instance.start
+        for instance in recurrence.instances(series, WINDOW_START, WINDOW_END)
+    ]
+    # the original isn't modified
+    assert series.recurrence == ["RRULE:FREQ=WEEKLY;BYDAY=MO"]
+
+
+def test_bounded_replaces_count():
+    series = make_series(
+        datetime.datetime(2023, 12, 30, 10), "RRULE:FREQ=DAILY;COUNT=100"
+    )
+    bounded = recurrence.bounded(series, WINDOW_START, WINDOW_END)
+    assert bounded.start == datetime.datetime(2024, 1, 1, 10)
+    assert bounded.recurrence == ["RRULE:FREQ=DAILY;UNTIL=20240131T100000"]
+
+
+def test_bounded_all_day():
+    series = Event(
+        iCalUID="series@google.com",
+        source_ids=["series"],
+        start=datetime.date(2023, 12, 25),
+        end=datetime.date(2023, 12, 26),
+        recurrence=["RRULE:FREQ=WEEKLY"],
+    )
+    bounded = recurrence.bounded(series, WINDOW_START, WINDOW_END)
+    assert (bounded.start, bounded.end) == (
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 1, 2),
+    )
+    assert bounded.recurrence == ["RRULE:FREQ=WEEKLY;UNTIL=20240129"]
+
+
+def test_bounded_keeps_series_within_window():
+    series = make_series(
+        datetime.datetime(2024, 1, 8, 10, tzinfo=UTC), "RRULE:FREQ=DAILY;COUNT=3"
+    )
+    assert recurrence.bounded(series, WINDOW_START, WINDOW_END) is series
+
+
+def test_bound_drops_series_without_instances_in_window():
+    ended = make_series(
+        datetime.datetime(2023, 1, 2, 10, tzinfo=UTC),
+        "RRULE:FREQ=WEEKLY;UNTIL=20231201T000000Z",
+    )
+    single = Event(
+        iCalUID="single@google.com",
+        source_ids=["single"],
+        start=datetime.datetime(2024, 1, 3, 10, tzinfo=UTC),
+        end=datetime.datetime(2024, 1, 3, 11, tzinfo=UTC),
+    )
+    assert recurrence.bound([ended, single], WINDOW_START, WINDOW_END) == [single]
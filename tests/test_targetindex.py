@@ -0,0 +1,111 @@
+import datetime
+import math
+import time
+from typing import Optional
+
+import pytest
+
+from polycal.services.batch import OperationResult, SyncReport
+from polycal.services.targetindex import IndexedEvent, TargetIndex
+from polycal.types import Event, dt_sort_key
+
+CALENDAR_ID = "target@example.com"
+START = datetime.datetime(2024, 1, 1)
+END = datetime.datetime(2024, 2, 1)
+DAY = datetime.timedelta(days=1)
+MAX_AGE = datetime.timedelta(hours=1)
+
+
+def indexed(
+    uid: str, start: datetime.datetime, end: Optional[float] = None
+) -> IndexedEvent:
+    start_key = dt_sort_key(start)
+    return IndexedEvent(
+        uid=uid,
+        event_id=f"id-{uid}",
+        start=start_key,
+        end=start_key + 3600 if end is None else end,
+        fingerprint=f"fingerprint-{uid}",
+    )
+
+
+@pytest.fixture
+def index(tmp_path) -> TargetIndex:
+    return TargetIndex(tmp_path)
+
+
+def test_reconcile_round_trip(index, tmp_path):
+    events = [
+        indexed("a", START + DAY),
+        indexed("b", START + 2 * DAY),
+        # endless series
+        indexed("c", START - 30 * DAY, end=math.inf),
+    ]
+    index.reconcile(CALENDAR_ID, START, END, events)
+    # persisted
+    index = TargetIndex(tmp_path)
+    assert index.events(CALENDAR_ID, START, END) == {
+        event.uid: event for event in events
+    }
+    assert index.events(CALENDAR_ID, START + 2 * DAY, END) == {
+        "b": events[1],
+        "c": events[2],
+    }
+    assert index.events("other@example.com", START, END) == {}
+    assert index.lookup(CALENDAR_ID, ["a", "missing"]) == [events[0]]
+
+    # reconciliation replaces events of its window only
+    outside = indexed("d", END + DAY)
+    index.reconcile(CALENDAR_ID, END, END + 2 * DAY, [outside])
+    index.reconcile(CALENDAR_ID, START, END, [events[0]])
+    assert index.lookup(CALENDAR_ID, ["a", "b", "c", "d"]) == [events[0], outside]
+
+
+def test_needs_reconciliation(index, monkeypatch):
+    assert index.needs_reconciliation(CALENDAR_ID, START, END, MAX_AGE)
+    index.reconcile(CALENDAR_ID, START, END, [])
+    assert not index.needs_reconciliation(CALENDAR_ID, START, END, MAX_AGE)
+    # windows within the reconciled one can be trusted
+    assert not index.needs_reconciliation(CALENDAR_ID, START + DAY, END - DAY, MAX_AGE)
+    assert index.needs_reconciliation(CALENDAR_ID, START - DAY, END, MAX_AGE)
+    assert index.needs_reconciliation(CALENDAR_ID, START, END + DAY, MAX_AGE)
+    assert index.needs_reconciliation("other@example.com", START, END, MAX_AGE)
+
+    reconciled_at = time.time()
+    monkeypatch.setattr(time, "time", lambda: reconciled_at + 2 * 3600)
+    assert index.needs_reconciliation(CALENDAR_ID, START, END, MAX_AGE)
+
+
+def test_update(index):
+    a, b = indexed("a", START + DAY), indexed("b", START + 2 * DAY)
+    index.reconcile(CALENDAR_ID, START, END, [a, b])
+    written = Event(
+        iCalUID="c",
+        source_ids=["source-c"],
+        start=START + 3 * DAY,
+        end=START + 3 * DAY + datetime.timedelta(hours=2),
+    )
+    failed = Event(iCalUID="e", source_ids=["source-e"], start=START, end=START)
+    report = SyncReport(
+        results=[
+            OperationResult("import", "c", event_id="id-c", attempts=1),
+            OperationResult("delete", "a", event_id="id-a", attempts=1),
+            OperationResult("delete", "b", event_id="id-b", error=ValueError()),
+            OperationResult("import", "e", attempts=1, error=ValueError()),
+        ]
+    )
+    index.update(
+        CALENDAR_ID,
+        report,
+        {"c": (written, "fingerprint-c"), "e": (failed, "fingerprint-e")},
+    )
+    assert index.events(CALENDAR_ID, START, END) == {
+        "b": b,
+        "c": IndexedEvent(
+            uid="c",
+            event_id="id-c",
+            start=dt_sort_key(written.start),
+            end=dt_sort_key(written.end),
+            fingerprint="fingerprint-c",
+        ),
+    }
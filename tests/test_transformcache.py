@@ -0,0 +1,137 @@
+import datetime
+import pickle
+import time
+
+import pytest
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, generate_calendars
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.services.calprocessor import CalendarProcessor, ConfigModel
+from polycal.services.transformcache import TransformCache
+from polycal.types import Event
+
+SOURCE_ID = "source@example.com"
+
+
+def make_events(count: int, title: str = "Meeting") -> list[Event]:
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        Event(
+            iCalUID=str(n),
+            source_ids=[str(n)],
+            start=start + datetime.timedelta(hours=n),
+            end=start + datetime.timedelta(hours=n + 1),
+            title=title,
+        )
+        for n in range(count)
+    ]
+
+
+@pytest.fixture
+def cache(tmp_path) -> TransformCache:
+    return TransformCache(tmp_path)
+
+
+def test_round_trip(cache, tmp_path):
+    events = make_events(3)
+    cache.put("key", SOURCE_ID, "config", events)
+    assert cache.get("key") == events
+    # persisted
+    assert TransformCache(tmp_path).get("key") == events
+    assert cache.get("other") is None
+
+
+def test_config_change_drops_results_of_the_source(cache):
+    cache.put("old", SOURCE_ID, "config", make_events(1))
+    cache.put("other", "other@example.com", "config", make_events(1))
+    cache.put("new", SOURCE_ID, "changed", make_events(1))
+    assert cache.get("old") is None
+    assert cache.get("other") is not None
+    assert cache.get("new") is not None
+
+
+def test_eviction(tmp_path, monkeypatch):
+    size = len(pickle.dumps(make_events(10), protocol=pickle.HIGHEST_PROTOCOL))
+    cache = TransformCache(tmp_path, max_size=int(size * 2.5))
+    now = time.time()
+    for n, key in enumerate(["a", "b", "c"]):
+        monkeypatch.setattr(time, "time", lambda n=n: now + n)
+        cache.put(key, key, "config", make_events(10))
+        if key == "b":
+            # used after "a" was stored, but before "b"
+            monkeypatch.setattr(time, "time", lambda: now + 1.5)
+            assert cache.get("a") is not None
+    # least recently used is evicted first
+    assert [cache.get(key) is not None for key in "abc"] == [True, False, True]
+
+    # results over the limit aren't stored at all
+    cache.put("large", "large", "config", make_events(100))
+    assert cache.get("large") is None
+
+
+def test_unreadable_results_are_dropped(cache):
+    cache.put("key", SOURCE_ID, "config", make_events(1))
+    with cache.connection:
+        cache.connection.execute("UPDATE results SET events = ?", (b"garbage",))
+    assert cache.get("key") is None
+    (count,) = cache.connection.execute("SELECT COUNT(*) FROM results").fetchone()
+    assert count == 0
+
+
+@pytest.fixture
+def processor(tmp_path) -> CalendarProcessor:
+    api = FakeCalendarApi()
+    api.load(SOURCE_ID, generate_calendars([SOURCE_ID], 300)[SOURCE_ID])
+    config = ConfigModel(
+        sources=[
+            {
+                "id": SOURCE_ID,
+                "transforms": [{"type": "ReplaceTitle", "kwargs": {"repl": "busy"}}],
+            }
+        ],
+        target={"id": "target@example.com", "name": "target"},
+        batch={"backoff": 0},
+        transform_cache={"enabled": True},
+    )
+    processor = CalendarProcessor(
+        config=config,
+        gcal_service=FakeGoogleCalendarService(api),
+        transform_cache=TransformCache(tmp_path),
+    )
+    processor.api = api
+    return processor
+
+
+def cache_results(processor: CalendarProcessor, start=WINDOW_START) -> list[str]:
+    """Cache hits and misses of a sync"""
+    metrics = processor.metrics
+    counts = {
+        result: metrics.get("transform_cache_total", result=result, source=SOURCE_ID)
+        for result in ["hit", "miss"]
+    }
+    processor.process(start, WINDOW_END)
+    return [
+        result
+        for result, count in counts.items()
+        if metrics.get("transform_cache_total", result=result, source=SOURCE_ID) > count
+    ]
+
+
+def test_processor_reuses_cached_results(processor):
+    assert cache_results(processor) == ["miss"]
+    assert cache_results(processor) == ["hit"]
+
+    # page ETags change with the listing
+    processor.api.modify(SOURCE_ID, 1)
+    assert cache_results(processor) == ["miss"]
+    assert cache_results(processor) == ["hit"]
+
+    # so does the key, with transforms of the source
+    processor.config.sources[0].transforms[0].kwargs["repl"] = "other"
+    assert cache_results(processor) == ["miss"]
+    assert cache_results(processor) == ["hit"]
+
+    # and with the window
+    assert cache_results(processor, WINDOW_START + datetime.timedelta(days=1)) == [
+        "miss"
+    ]
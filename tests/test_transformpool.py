@@ -0,0 +1,64 @@
+import pathlib
+
+import pytest
+import yaml
+
+from benchmarks.calgen import WINDOW_END, WINDOW_START, generate_calendars
+from benchmarks.fakegcal import FakeCalendarApi, FakeGoogleCalendarService
+from polycal.pipeline import Pipeline
+from polycal.services.transformpool import TransformPool
+from polycal.transforms import FILTERS, TRANSFORMERS
+
+HEAVY = pathlib.Path(__file__).parent.parent / "benchmarks" / "heavy.yml"
+SOURCE_ID = "source@example.com"
+
+
+def heavy_pipeline(columnar: bool = False) -> Pipeline:
+    return Pipeline(
+        [
+            (
+                TRANSFORMERS[transform["type"]](**transform.get("kwargs", {})),
+                [
+                    FILTERS[filter_["type"]](**filter_.get("kwargs", {}))
+                    for filter_ in transform.get("filters", [])
+                ],
+            )
+            for transform in yaml.safe_load(HEAVY.read_text())
+        ],
+        columnar=columnar,
+    )
+
+
+@pytest.fixture(scope="module")
+def service() -> FakeGoogleCalendarService:
+    api = FakeCalendarApi()
+    api.load(SOURCE_ID, generate_calendars([SOURCE_ID], 2000)[SOURCE_ID])
+    return FakeGoogleCalendarService(api)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = TransformPool(processes=2)
+    yield pool
+    pool.shutdown()
+
+
+def list_events(service: FakeGoogleCalendarService) -> list:
+    return list(service.list_events(SOURCE_ID, WINDOW_START, WINDOW_END))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_pool_matches_serial(service, pool, columnar):
+    if columnar:
+        pytest.importorskip("numpy")
+    serial = list(heavy_pipeline(columnar).process(list_events(service)))
+    pooled = pool.process(heavy_pipeline(columnar), list_events(service))()
+    assert len(serial) > 100
+    assert pooled == serial
+
+
+def test_pool_restarts_after_shutdown(service, pool):
+    events = list_events(service)[:100]
+    expected = list(heavy_pipeline().process(list_events(service)[:100]))
+    pool.shutdown()
+    assert pool.process(heavy_pipeline(), events)() == expected
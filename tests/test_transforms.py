@@ -0,0 +1,252 @@
+import datetime
+import random
+import re
+
+import pytest
+
+from polycal.transforms import Dedup, Merge, SetAttr, SkipByDuration, TitleMatcher
+from polycal.types import Event, event_sort_key
+
+START = datetime.datetime(2024, 1, 1, 9, tzinfo=datetime.timezone.utc)
+
+
+def make_event(
+    uid: str,
+    start: datetime.datetime = START,
+    duration: datetime.timedelta = datetime.timedelta(hours=1),
+    **kwargs,
+) -> Event:
+    kwargs.setdefault("source_ids", ["source@example.com"])
+    return Event(iCalUID=uid, start=start, end=start + duration, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "min_duration, kept",
+    [("0s", ["15m", "1h"]), ("15m", ["1h"]), ("1h", [])],
+)
+def test_skip_by_duration(min_duration, kept):
+    events = [
+        make_event("empty", duration=datetime.timedelta()),
+        make_event("15m", duration=datetime.timedelta(minutes=15)),
+        make_event("1h", duration=datetime.timedelta(hours=1)),
+    ]
+    assert [
+        event.iCalUID for event in SkipByDuration(min_duration).process(events)
+    ] == kept
+
+
+TITLE_PATTERNS = [
+    "Lunch",
+    "Sync",
+    "1:1",
+    r"Standup$",
+    r"^Retro",
+    r"[Dd]esign review",
+    r"\w+ sync",
+    r"(\w+) and \1",
+    r"(?P<team>\w+) planning",
+    r"(?i)all hands",
+    r"(?x) focus \s time",
+]
+TITLES = [
+    None,
+    "",
+    "Lunch",
+    "Lunch break",
+    "lunch",
+    "Sync",
+    "Team sync",
+    "1:1 with Ann",
+    "Standup",
+    "Standup notes",
+    "Retro",
+    "design review",
+    "Design Review",
+    "this and this",
+    "this and that",
+    "Ops planning",
+    "ALL HANDS",
+    "Focus time",
+    "Focustime",
+]
+
+
+@pytest.mark.parametrize("title", TITLES)
+@pytest.mark.parametrize(
+    "patterns",
+    [
+        TITLE_PATTERNS,
+        TITLE_PATTERNS[:3],
+        TITLE_PATTERNS[3:6],
+        TITLE_PATTERNS[6:],
+        [TITLE_PATTERNS[0], TITLE_PATTERNS[7]],
+    ],
+)
+def test_title_matcher_matches_patterns_one_by_one(patterns, title):
+    matcher = TitleMatcher(patterns)
+    expected = any(re.match(pattern, title or "") for pattern in patterns)
+    assert matcher.match(title) is expected
+    # memoized
+    assert matcher.match(title) is expected
+
+
+def test_title_matcher_combines_patterns_it_can():
+    matcher = TitleMatcher(TITLE_PATTERNS)
+    assert matcher.literals == {3: {"1:1"}, 4: {"Sync"}, 5: {"Lunch"}}
+    assert matcher.regex.pattern == (
+        r"(?:Standup$)|(?:^Retro)|(?:[Dd]esign review)|(?:\w+ sync)"
+    )
+    # groups would be renumbered, flags would apply to all patterns
+    assert [pattern.pattern for pattern in matcher.separate] == TITLE_PATTERNS[7:]
+
+
+def test_set_attr():
+    event = make_event("a", title="Standup")
+    assert SetAttr(title="Busy", busy=False).apply(event) is event
+    assert (event.title, event.busy) == ("Busy", False)
+
+
+@pytest.mark.parametrize(
+    "attr_name", ["iCalUID", "source_ids", "src", "fingerprint", "calendar_id", "x"]
+)
+def test_set_attr_rejects_bookkeeping_fields(attr_name):
+    with pytest.raises(ValueError, match=attr_name):
+        SetAttr(**{attr_name: "value"})
+
+
+def merge_pairwise(events: list[Event], elipsis: datetime.timedelta) -> list[Event]:
+    """Merge as it was before the sweep, comparing all events of a title"""
+    merged: dict[str, list[Event]] = {}
+    for event in events:
+        similar = merged.setdefault(event.title, [])
+        for existing in similar:
+            if (
+                isinstance(event.start, datetime.datetime)
+                and isinstance(existing.start, datetime.datetime)
+                and existing.start <= event.start
+                and event.start - elipsis <= existing.end
+            ):
+                existing.end = max(existing.end, event.end)
+                break
+        else:
+            similar.append(event)
+    return [event for similar in merged.values() for event in similar]
+
+
+def random_events(seed: int, count: int = 300) -> list[Event]:
+    rng = random.Random(seed)
+    events = []
+    for n in range(count):
+        day = datetime.timedelta(days=rng.randrange(5))
+        if rng.random() < 0.1:
+            start = (START + day).date()
+            end = start + datetime.timedelta(days=rng.randint(1, 3))
+        else:
+            start = START + day + datetime.timedelta(minutes=5 * rng.randrange(200))
+            end = start + datetime.timedelta(minutes=5 * rng.randrange(1, 40))
+        events.append(
+            Event(
+                iCalUID=str(n),
+                source_ids=[str(n)],
+                start=start,
+                end=end,
+                title=rng.choice(["a", "b", "c"]),
+            )
+        )
+    events.sort(key=event_sort_key)
+    return events
+
+
+def interval_set(events: list[Event]) -> list[tuple]:
+    return sorted((event.iCalUID, event.start, event.end) for event in events)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("elipsis", [None, "15m", "1h"])
+def test_merge_matches_pairwise_merge(seed, elipsis):
+    merged = list(Merge(elipsis).process(random_events(seed)))
+    expected = merge_pairwise(random_events(seed), Merge(elipsis).elipsis)
+    assert interval_set(merged) == interval_set(expected)
+    # merged events stream out in order of their start
+    assert merged == sorted(merged, key=event_sort_key)
+
+
+def test_merge():
+    hour = datetime.timedelta(hours=1)
+    events = [
+        make_event("a", title="x"),
+        make_event("b", start=START + hour / 2, title="x"),
+        make_event("c", start=START + hour / 2, title="y"),
+        make_event("d", start=START + 2 * hour, title="x"),
+        make_event("e", start=START + 4 * hour, duration=hour / 4, title="x"),
+        make_event("f", start=START + 4 * hour + hour / 2, title="x"),
+    ]
+    merged = Merge("15m").process(events, include=lambda event: event.iCalUID != "f")
+    assert [(event.iCalUID, event.end - START) for event in merged] == [
+        ("a", hour * 3 / 2),
+        ("c", hour * 3 / 2),
+        ("d", 3 * hour),
+        ("e", hour * 17 / 4),
+        ("f", hour * 11 / 2),
+    ]
+
+
+def dedup(events: list[Event], **kwargs) -> list[tuple[str, list[str]]]:
+    return [
+        (event.iCalUID, event.source_ids) for event in Dedup(**kwargs).process(events)
+    ]
+
+
+def meeting_copies() -> list[Event]:
+    return [
+        make_event("a", source_ids=["a"], original_uid="m", calendar_id="1"),
+        make_event(
+            "b",
+            start=START + datetime.timedelta(minutes=2),
+            source_ids=["b"],
+            original_uid="m",
+            calendar_id="2",
+        ),
+        make_event("c", source_ids=["c"], original_uid="other", calendar_id="3"),
+    ]
+
+
+def test_dedup_collapses_copies_from_other_calendars():
+    assert dedup(meeting_copies(), tolerance="5m") == [
+        ("a", ["a", "b"]),
+        ("c", ["c"]),
+    ]
+    assert dedup(meeting_copies()) == [("a", ["a"]), ("b", ["b"]), ("c", ["c"])]
+
+
+def test_dedup_by_title():
+    events = [
+        make_event("a", title="Weekly  sync", calendar_id="1"),
+        make_event("b", title="weekly sync", calendar_id="2"),
+    ]
+    assert [uid for uid, _ in dedup(events)] == ["a", "b"]
+    assert [uid for uid, _ in dedup(events, titles=True)] == ["a"]
+
+
+def test_dedup_keeps_instances_of_a_series():
+    day = datetime.timedelta(days=1)
+    events = [
+        make_event(
+            f"{calendar_id}{n}",
+            start=START + n * day,
+            original_uid="series",
+            original_start=START + n * day,
+            calendar_id=calendar_id,
+        )
+        for n in range(3)
+        for calendar_id in ("1", "2")
+    ]
+    assert [uid for uid, _ in dedup(events, tolerance="2d")] == ["10", "11", "12"]
+
+
+def test_dedup_never_collapses_events_of_one_calendar():
+    events = [
+        make_event(uid, original_uid="m", calendar_id=calendar_id)
+        for uid, calendar_id in [("a", "1"), ("b", "1"), ("c", "2"), ("d", "2")]
+    ]
+    assert [uid for uid, _ in dedup(events)] == ["a", "b"]
@@ -0,0 +1,46 @@
+import datetime
+import pickle
+
+from polycal.types import Attendee, Event
+
+DAY = datetime.date(2024, 1, 1)
+
+
+class Converter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self) -> list[Attendee]:
+        self.calls += 1
+        return [Attendee("a@example.com", "accepted")]
+
+
+def test_copy_keeps_attendees_lazy():
+    convert = Converter()
+    event = Event(iCalUID="a", source_ids=["s"], start=DAY, end=DAY, attendees=convert)
+    copy = event.copy()
+    assert convert.calls == 0
+    assert copy.attendees == event.attendees
+    assert convert.calls == 2
+
+
+def test_copy_doesnt_share_lists():
+    event = Event(
+        iCalUID="a",
+        source_ids=["s"],
+        start=DAY,
+        end=DAY,
+        attendees=[Attendee("a@example.com")],
+    )
+    copy = event.copy()
+    copy.source_ids.append("t")
+    copy.attendees.append(Attendee("b@example.com"))
+    assert event.source_ids == ["s"]
+    assert event.attendees == [Attendee("a@example.com")]
+
+
+def test_pickle_round_trip():
+    event = Event(
+        iCalUID="a", source_ids=["s"], start=DAY, end=DAY, attendees=Converter()
+    )
+    assert pickle.loads(pickle.dumps(event)) == event